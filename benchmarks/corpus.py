@@ -0,0 +1,138 @@
+import dataclasses
+import random
+from collections.abc import Iterator
+from pathlib import Path
+
+_WORDS = [
+    "the", "last", "dark", "star", "night", "city", "blue", "fire", "house", "king",
+    "lost", "road", "girl", "world", "ghost", "iron", "silent", "wild", "code", "garden",
+    "empire", "river", "shadow", "winter", "hunter", "sky", "academia", "hero", "my", "of",
+]  # fmt: skip
+
+_GROUPS = ["RARBG", "PHOBOS", "NTb", "FLUX", "Silence", "RCVR", "GalaxyTV", "YTS.MX"]
+_ANIME_GROUPS = ["Erai-raws", "SubsPlease", "Anime Time", "HorribleSubs", "AC"]
+_RESOLUTIONS = ["720p", "1080p", "2160p"]
+_SOURCES = ["WEB-DL", "BluRay", "AMZN WEB-DL", "DVDRip", "HDTV"]
+_CODECS = ["x264", "x265", "HEVC", "H 264"]
+_EXTS = ["mkv", "mkv", "mkv", "mp4", "avi"]
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class SyntheticShow:
+    title: str
+    year: int
+    style: str
+    folder_name: str
+    seasons: dict[int, list[str]]
+
+
+def _title(rng: random.Random) -> str:
+    return " ".join(w.capitalize() for w in rng.sample(_WORDS, rng.randint(1, 4)))
+
+
+def _hash(rng: random.Random) -> str:
+    return f"{rng.getrandbits(32):08X}"
+
+
+def movie_name(rng: random.Random, *, is_file: bool) -> str:
+    title = _title(rng)
+    year = rng.randint(1950, 2025)
+    res = rng.choice(_RESOLUTIONS)
+
+    name = rng.choice(
+        [
+            f"{title.replace(' ', '.')}.{year}.{res}.{rng.choice(_SOURCES).replace(' ', '.')}.{rng.choice(_CODECS).replace(' ', '.')}-{rng.choice(_GROUPS)}",
+            f"{title} ({year}) [{res}] [BluRay] [5.1] [{rng.choice(_GROUPS)}]",
+            f"{title} ({year}) ({res} {rng.choice(_SOURCES)} {rng.choice(_CODECS)} {rng.choice(_GROUPS)})",
+            f"www.UIndex.org    -    {title} {year} {res} WEB-DL DD 5 1 H 264-{rng.choice(_GROUPS)}",
+            f"[{rng.choice(_ANIME_GROUPS)}] {title} [{res}][{_hash(rng)}]",
+        ]
+    )
+
+    if is_file:
+        name += f".{rng.choice(_EXTS)}"
+
+    return name
+
+
+def _episode_name(
+    rng: random.Random, show: str, year: int, style: str, season: int, ep: int
+) -> str:
+    res = rng.choice(_RESOLUTIONS)
+    ext = rng.choice(_EXTS)
+    ep_title = _title(rng)
+
+    if style == "scene":
+        return f"{show.replace(' ', '.')}.S{season:02d}E{ep:02d}.{ep_title.replace(' ', '.')}.{res}.WEB-DL.x264-{rng.choice(_GROUPS)}.{ext}"
+    if style == "anime":
+        return f"[{rng.choice(_ANIME_GROUPS)}] {show} - {ep:02d} [{res}][Multiple Subtitle][{_hash(rng)}].{ext}"
+    if style == "bluray":
+        return f"{show} ({year}) - S{season:02d}E{ep:02d} - {ep_title} ({res} BluRay x265 {rng.choice(_GROUPS)}).{ext}"
+
+    return f"{show} - {season}x{ep:02d} - {ep_title}.{ext}"
+
+
+def generate_show(
+    rng: random.Random, *, seasons: int, episodes_per_season: int
+) -> SyntheticShow:
+    title = _title(rng)
+    year = rng.randint(1970, 2025)
+    style = rng.choice(["scene", "anime", "bluray", "classic"])
+
+    folder_name = {
+        "scene": f"{title.replace(' ', '.')}.{year}.1080p.WEB-DL.x264-{rng.choice(_GROUPS)}",
+        "anime": f"[{rng.choice(_ANIME_GROUPS)}] {title} [1080p][{_hash(rng)}]",
+        "bluray": f"{title} ({year}) (1080p BluRay x265 {rng.choice(_GROUPS)})",
+        "classic": title,
+    }[style]
+
+    return SyntheticShow(
+        title=title,
+        year=year,
+        style=style,
+        folder_name=folder_name,
+        seasons={
+            season: [
+                _episode_name(rng, title, year, style, season, ep)
+                for ep in range(1, episodes_per_season + 1)
+            ]
+            for season in range(1, seasons + 1)
+        },
+    )
+
+
+def generate_movie_names(
+    count: int, *, seed: int = 0, is_file: bool = False
+) -> list[str]:
+    rng = random.Random(seed)
+    return [movie_name(rng, is_file=is_file) for _ in range(count)]
+
+
+def generate_shows(
+    file_count: int, *, seed: int = 0, seasons: int = 3, episodes_per_season: int = 24
+) -> Iterator[SyntheticShow]:
+    """Yields shows until at least file_count episode files have been generated"""
+
+    rng = random.Random(seed)
+    generated = 0
+
+    while generated < file_count:
+        show = generate_show(
+            rng, seasons=seasons, episodes_per_season=episodes_per_season
+        )
+        generated += seasons * episodes_per_season
+        yield show
+
+
+def build_show_tree(root: Path, show: SyntheticShow) -> Path:
+    show_folder = root / show.folder_name
+    show_folder.mkdir(parents=True)
+
+    for season, episodes in show.seasons.items():
+        season_folder = show_folder / f"S{season:02d}"
+        season_folder.mkdir()
+
+        for episode in episodes:
+            (season_folder / episode).touch()
+
+    return show_folder
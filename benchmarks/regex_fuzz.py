@@ -0,0 +1,313 @@
+"""Searches for inputs that make the parser's regular expressions backtrack, and checks that each
+pattern's matching time grows linearly with the input on the worst one found
+
+Usage: python -m benchmarks.regex_fuzz [--seed N] [--rounds N] [--seconds S] [--json out.json]
+"""
+
+import argparse
+import dataclasses
+import json
+import math
+import random
+import re
+import sys
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from types import ModuleType
+
+from jellyfin_media_renamer import audit, parsing, shows, titles
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python 3.10
+    import sre_parse
+
+# How much slower matching may get when the input is made this many times longer, as a power of
+# the factor: 1 is linear, 2 quadratic
+GROWTH_FACTOR = 4
+MAX_GROWTH_EXPONENT = 1.5
+
+# Candidates are compared with their pumped part repeated to about this many characters, long
+# enough for backtracking to stand out from timer noise
+_FUZZ_LENGTH = 2048
+# And the worst one is checked for growth starting from this length
+_GROWTH_LENGTH = 2048
+
+_SEPARATORS = " ._-[]()"
+
+_CATEGORY_EXAMPLES = {
+    "CATEGORY_DIGIT": "0",
+    "CATEGORY_NOT_DIGIT": "a",
+    "CATEGORY_SPACE": " ",
+    "CATEGORY_NOT_SPACE": "a",
+    "CATEGORY_WORD": "a",
+    "CATEGORY_NOT_WORD": ".",
+}
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class Attack:
+    """An input made of a prefix, a part repeated many times and a suffix"""
+
+    prefix: str
+    pump: str
+    suffix: str
+
+    def build(self, length: int) -> str:
+        """Repeats the pump until the whole input is about length characters long"""
+
+        repeats = max(
+            (length - len(self.prefix) - len(self.suffix)) // len(self.pump), 1
+        )
+        return self.prefix + self.pump * repeats + self.suffix
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class FuzzResult:
+    name: str
+    pattern: str
+    attack: Attack
+    # Seconds to scan the worst input found, and how that grows with its length
+    seconds: float
+    growth_exponent: float
+
+    @property
+    def linear(self) -> bool:
+        return self.growth_exponent <= MAX_GROWTH_EXPONENT
+
+
+def _patterns_in(module: ModuleType) -> Iterator[tuple[str, re.Pattern[str]]]:
+    for attr, value in vars(module).items():
+        # Junk patterns are kept in tuples along with the text they need
+        candidates = value if isinstance(value, tuple) else (value,)
+        for i, candidate in enumerate(candidates):
+            if isinstance(candidate, tuple) and candidate:
+                candidate = candidate[0]
+            if isinstance(candidate, re.Pattern) and isinstance(candidate.pattern, str):
+                yield (
+                    f"{module.__name__.rpartition('.')[2]}.{attr}"
+                    + (f"[{i}]" if candidates is value else ""),
+                    candidate,
+                )
+
+
+def collect_patterns() -> dict[str, re.Pattern[str]]:
+    """Every pattern filenames are matched against, including a season's episode patterns"""
+
+    patterns = {
+        name: pattern
+        for module in (parsing, shows, titles, audit)
+        for name, pattern in _patterns_in(module)
+    }
+
+    season_patterns = parsing.episode_patterns("Show Name", "Show Name", 1)
+    for i, (pattern, _, _) in enumerate(season_patterns.ep_number):
+        if pattern not in patterns.values():
+            patterns[f"parsing.episode_patterns().ep_number[{i}]"] = pattern
+
+    return patterns
+
+
+def _alphabet(pattern: re.Pattern[str]) -> str:
+    """Characters that are likely to take the pattern down different paths"""
+
+    literals = {c for c in pattern.pattern if c.isprintable() and c not in "\\^$*+?{}|"}
+    literals |= {c.swapcase() for c in literals}
+
+    return "".join(sorted(literals | set(_SEPARATORS) | set("0123456789aEeSx")))
+
+
+def _scan_seconds(pattern: re.Pattern[str], text: str, *, runs: int = 3) -> float:
+    """How long finding every match takes, which is what sub() and a failing search() do"""
+
+    best = math.inf
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in pattern.finditer(text):
+            pass
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def growth(
+    pattern: re.Pattern[str], attack: Attack, length: int = _GROWTH_LENGTH
+) -> tuple[float, float]:
+    """Returns how scanning time grows with the length of the attack, as a power of the length,
+    and the seconds it takes at GROWTH_FACTOR times length"""
+
+    short = _scan_seconds(pattern, attack.build(length))
+    long = _scan_seconds(pattern, attack.build(length * GROWTH_FACTOR))
+
+    return math.log(max(long, 1e-9) / max(short, 1e-9), GROWTH_FACTOR), long
+
+
+def _sample_set(items: list, rng: random.Random) -> str:
+    if items and items[0][0].name == "NEGATE":
+        literals = {chr(av) for op, av in items if op.name == "LITERAL"}
+        return rng.choice([c for c in "a0 .-_!" if c not in literals] or ["!"])
+
+    op, av = rng.choice(items)
+    match op.name:
+        case "LITERAL":
+            return chr(av)
+        case "RANGE":
+            return chr(rng.randint(*av))
+        case "CATEGORY":
+            return _CATEGORY_EXAMPLES.get(av.name, "!")
+
+    return "!"
+
+
+def _sample(items, rng: random.Random, out: list[str]):
+    """Appends a random string the parsed pattern (mostly) matches, ignoring anchors and
+    lookarounds"""
+
+    for op, av in items:
+        match op.name:
+            case "LITERAL":
+                out.append(chr(av))
+            case "NOT_LITERAL":
+                out.append("a" if chr(av) != "a" else "0")
+            case "ANY":
+                out.append(rng.choice("a0 ."))
+            case "IN":
+                out.append(_sample_set(av, rng))
+            case "MAX_REPEAT" | "MIN_REPEAT" | "POSSESSIVE_REPEAT":
+                low, high, sub = av
+                for _ in range(rng.randint(low, min(high, low + 3))):
+                    _sample(sub, rng, out)
+            case "SUBPATTERN":
+                _sample(av[-1], rng, out)
+            case "ATOMIC_GROUP":
+                _sample(av, rng, out)
+            case "BRANCH":
+                _sample(rng.choice(av[1]), rng, out)
+
+
+def _example_matches(
+    pattern: re.Pattern[str], rng: random.Random, count: int
+) -> list[str]:
+    parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+
+    examples = []
+    for _ in range(count):
+        out: list[str] = []
+        _sample(parsed, rng, out)
+        examples.append("".join(out))
+
+    return examples
+
+
+def _seeds(pattern: re.Pattern[str], rng: random.Random, alphabet: str) -> list[Attack]:
+    """Starting points for the search: every character on its own, and (parts of) strings the
+    pattern matches repeated, with and without something that stops the match at the end"""
+
+    seeds = [Attack(prefix="", pump=c, suffix="") for c in alphabet]
+
+    for example in _example_matches(pattern, rng, 12):
+        for pump in {example, example[:-1], example[1:]}:
+            if pump:
+                seeds.append(Attack(prefix="", pump=pump, suffix=""))
+                seeds.append(Attack(prefix="", pump=pump, suffix="!"))
+                seeds.append(Attack(prefix=example, pump=pump, suffix="!"))
+
+    return seeds
+
+
+def _mutate(attack: Attack, rng: random.Random, alphabet: str) -> Attack:
+    field = rng.choice(["prefix", "pump", "pump", "suffix"])
+    value = getattr(attack, field)
+
+    i = rng.randint(0, len(value))
+    match rng.randrange(3):
+        case 0:
+            value = value[:i] + rng.choice(alphabet) + value[i:]
+        case 1:
+            value = value[:i] + value[i + 1 :]
+        case _:
+            value = value[:i] + rng.choice(alphabet) + value[i + 1 :]
+
+    if field == "pump" and not value:
+        return attack
+
+    return dataclasses.replace(attack, **{field: value})
+
+
+def fuzz_pattern(
+    name: str,
+    pattern: re.Pattern[str],
+    *,
+    rng: random.Random,
+    rounds: int,
+    seconds: float = 1.0,
+) -> FuzzResult:
+    """Hill climbs towards the attack that's slowest to scan per character, then measures how its
+    scanning time grows with its length"""
+
+    alphabet = _alphabet(pattern)
+
+    def cost(attack: Attack) -> float:
+        text = attack.build(_FUZZ_LENGTH)
+        return _scan_seconds(pattern, text, runs=2) / len(text)
+
+    best = max(_seeds(pattern, rng, alphabet), key=cost)
+    best_cost = cost(best)
+
+    # The closer the search gets, the slower each try becomes
+    deadline = time.perf_counter() + seconds
+    for _ in range(rounds):
+        if time.perf_counter() > deadline:
+            break
+
+        candidate = _mutate(best, rng, alphabet)
+        if (candidate_cost := cost(candidate)) > best_cost:
+            best, best_cost = candidate, candidate_cost
+
+    exponent, seconds = growth(pattern, best)
+
+    return FuzzResult(
+        name=name,
+        pattern=pattern.pattern,
+        attack=best,
+        seconds=seconds,
+        growth_exponent=exponent,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, default=300)
+    parser.add_argument(
+        "--seconds", type=float, default=1.0, help="search time limit per pattern"
+    )
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = [
+        fuzz_pattern(name, pattern, rng=rng, rounds=args.rounds, seconds=args.seconds)
+        for name, pattern in collect_patterns().items()
+    ]
+
+    for result in sorted(results, key=lambda r: r.growth_exponent, reverse=True):
+        attack = result.attack
+        print(
+            f"{result.name:<45} n^{result.growth_exponent:<5.2f} {result.seconds * 1000:>9.3f}ms"
+            f"  {attack.prefix!r} + {attack.pump!r} * n + {attack.suffix!r}"
+            + ("" if result.linear else "  SUPERLINEAR")
+        )
+
+    if args.json:
+        args.json.write_text(
+            json.dumps([dataclasses.asdict(r) for r in results], indent=2)
+        )
+
+    if not all(r.linear for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
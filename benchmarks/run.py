@@ -0,0 +1,204 @@
+"""Parser and end-to-end throughput benchmarks over a synthetic release-name corpus
+
+Usage: python -m benchmarks.run [--names N] [--files N] [--json out.json] [--baseline old.json]
+"""
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from benchmarks.corpus import (
+    build_show_tree,
+    generate_movie_names,
+    generate_shows,
+)
+from jellyfin_media_renamer.common import CommandError, infer_name_and_year
+from jellyfin_media_renamer.fs import clear_snapshots
+from jellyfin_media_renamer.parsing import (
+    episode_patterns,
+    parse_episode_info,
+    parse_episodes,
+    parse_name_and_year,
+)
+from jellyfin_media_renamer.shows import process_show
+
+# Results slower than the baseline by more than this fraction are reported as regressions
+REGRESSION_THRESHOLD = 0.10
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class BenchResult:
+    name: str
+    items: int
+    seconds: float
+    failures: int = 0
+
+    @property
+    def per_second(self) -> float:
+        return self.items / self.seconds if self.seconds else float("inf")
+
+
+def _timed(name: str, items: int, fn: Callable[[], int]) -> BenchResult:
+    episode_patterns.cache_clear()
+
+    start = time.perf_counter()
+    failures = fn()
+    seconds = time.perf_counter() - start
+
+    return BenchResult(name=name, items=items, seconds=seconds, failures=failures)
+
+
+def bench_parse_name_and_year(count: int, seed: int) -> BenchResult:
+    names = generate_movie_names(count, seed=seed, is_file=True)
+
+    def run() -> int:
+        for name in names:
+            parse_name_and_year(name, is_file=True)
+        return 0
+
+    return _timed("parse_name_and_year", count, run)
+
+
+def bench_parse_episode_info(count: int, seed: int) -> BenchResult:
+    shows = list(generate_shows(count, seed=seed))
+    items = sum(len(eps) for show in shows for eps in show.seasons.values())
+    contexts = [
+        (show, infer_name_and_year(Path(show.folder_name)), season, episodes)
+        for show in shows
+        for season, episodes in show.seasons.items()
+    ]
+
+    def run() -> int:
+        failures = 0
+        for _, (raw_name, name, year), season, episodes in contexts:
+            for episode in episodes:
+                if parse_episode_info(episode, raw_name, name, year, season) is None:
+                    failures += 1
+        return failures
+
+    return _timed("parse_episode_info", items, run)
+
+
+def bench_parse_episodes(count: int, seed: int) -> BenchResult:
+    shows = list(generate_shows(count, seed=seed))
+    items = sum(len(eps) for show in shows for eps in show.seasons.values())
+    contexts = [
+        (infer_name_and_year(Path(show.folder_name)), season, episodes)
+        for show in shows
+        for season, episodes in show.seasons.items()
+    ]
+
+    def run() -> int:
+        failures = 0
+        for (raw_name, name, year), season, episodes in contexts:
+            results = parse_episodes(episodes, raw_name, name, year, season)
+            failures += results.count(None)
+        return failures
+
+    return _timed("parse_episodes (per season)", items, run)
+
+
+def bench_process_show(count: int, seed: int, root: Path) -> BenchResult:
+    shows = list(generate_shows(count, seed=seed))
+    items = sum(len(eps) for show in shows for eps in show.seasons.values())
+
+    show_folders = [
+        build_show_tree(root / str(i), show) for i, show in enumerate(shows)
+    ]
+    clear_snapshots()
+
+    def run() -> int:
+        failures = 0
+        for show_folder in show_folders:
+            raw_name, name, year = infer_name_and_year(show_folder)
+            new_stem = f"{name} ({year})" if year else name
+            try:
+                process_show(show_folder, raw_name, name, year, new_stem)
+            except CommandError:
+                failures += 1
+        return failures
+
+    return _timed("process_show (end to end)", items, run)
+
+
+def _default_tmp_root() -> Path | None:
+    # Prefer tmpfs so the end to end numbers measure this tool rather than the disk
+    shm = Path("/dev/shm")
+    return shm if shm.is_dir() and os.access(shm, os.W_OK) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--names", type=int, default=100_000)
+    parser.add_argument("--files", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tmp", type=Path, default=_default_tmp_root())
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    parser.add_argument(
+        "--baseline", type=Path, help="compare against results written by --json"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    results = [
+        bench_parse_name_and_year(args.names, args.seed),
+        bench_parse_episode_info(args.names, args.seed),
+        bench_parse_episodes(args.names, args.seed),
+    ]
+
+    tmp_root = Path(tempfile.mkdtemp(prefix="jmr-bench-", dir=args.tmp))
+    try:
+        results.append(bench_process_show(args.files, args.seed, tmp_root))
+    finally:
+        shutil.rmtree(tmp_root)
+
+    baseline: dict[str, float] = {}
+    if args.baseline:
+        baseline = {
+            r["name"]: r["per_second"] for r in json.loads(args.baseline.read_text())
+        }
+
+    regressed = False
+    for result in results:
+        line = (
+            f"{result.name:<30} {result.items:>9} items {result.seconds:>8.3f}s "
+            f"{result.per_second:>12,.0f}/s"
+        )
+        if result.failures:
+            line += f"  ({result.failures} failed to parse)"
+
+        if result.name in baseline:
+            change = result.per_second / baseline[result.name] - 1
+            line += f"  {change:+.1%} vs baseline"
+            if change < -REGRESSION_THRESHOLD:
+                line += "  REGRESSION"
+                regressed = True
+
+        print(line)
+
+    if args.json:
+        args.json.write_text(
+            json.dumps(
+                [
+                    {**dataclasses.asdict(r), "per_second": r.per_second}
+                    for r in results
+                ],
+                indent=2,
+            )
+        )
+
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
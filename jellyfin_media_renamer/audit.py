@@ -0,0 +1,366 @@
+import contextvars
+import dataclasses
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from jellyfin_media_renamer.common import SUBTITLES_FILE_EXTS, VIDEO_FILE_EXTS
+from jellyfin_media_renamer.events import emit
+from jellyfin_media_renamer.metrics import count, timed
+from jellyfin_media_renamer.parsing import (
+    PARSER_VERSION,
+    ParseTimeout,
+    parse_name_and_year,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUDIT_JOBS = 16
+
+# Bumped whenever the checks change, so that folders skipped by an older state get re-examined
+AUDIT_VERSION = 1
+
+# Some filesystems only keep mtimes to the second (or two), so a folder that changed just after it
+# was listed can keep the mtime it was listed with. Those aren't remembered, like git does for its
+# index.
+_RACY_SECONDS = 2
+
+# How deep into a library a folder is, each level is checked differently
+_LIBRARY = 0
+_TITLE = 1
+_SEASON = 2
+
+_SEASON_FOLDER_RE = re.compile(r"Season (\d{2,})")
+
+
+def default_audit_state_path() -> Path:
+    state_home = os.environ.get("XDG_STATE_HOME") or Path.home() / ".local" / "state"
+    return Path(state_home) / "jellyfin-media-renamer" / "audit-state.json"
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class Issue:
+    path: Path
+    problem: str
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class AuditReport:
+    issues: list[Issue]
+    # Folders that were listed and checked, and folders whose earlier results were reused
+    examined: int
+    skipped: int
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class _Examined:
+    mtime_ns: int
+    issues: list[Issue]
+    # Names of the subfolders that are checked too
+    subdirs: list[str]
+    # Whether this is what the folder held at the last audit
+    remembered: bool = False
+
+
+class AuditState:
+    """What each folder held when it was last examined, keyed by its mtime, which changes whenever
+    an entry is added, removed or renamed in it"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._dirs: dict[str, dict] = {}
+        self._seen: set[str] = set()
+        # Folders are looked up from worker threads
+        self._lock = threading.Lock()
+
+        try:
+            data = json.loads(path.read_text())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable audit state at {path}: {e}")
+            return
+
+        if data.get("version") == [AUDIT_VERSION, PARSER_VERSION]:
+            self._dirs = data["dirs"]
+
+    def lookup(self, path: Path, mtime_ns: int) -> _Examined | None:
+        with self._lock:
+            entry = self._dirs.get(str(path))
+            if entry is None or entry["mtime_ns"] != mtime_ns:
+                return None
+
+            self._seen.add(str(path))
+
+        return _Examined(
+            mtime_ns=mtime_ns,
+            issues=[
+                Issue(path=Path(issue_path), problem=problem)
+                for issue_path, problem in entry["issues"]
+            ],
+            subdirs=entry["subdirs"],
+            remembered=True,
+        )
+
+    def record(self, path: Path, examined: _Examined):
+        with self._lock:
+            self._dirs[str(path)] = {
+                "mtime_ns": examined.mtime_ns,
+                "issues": [[str(i.path), i.problem] for i in examined.issues],
+                "subdirs": examined.subdirs,
+            }
+            self._seen.add(str(path))
+
+    def save(self, roots: Iterable[Path]):
+        """Writes the state out, forgetting folders under roots that weren't come across this
+        time (they were removed, or changed too recently to be remembered)"""
+
+        roots = list(roots)
+
+        with self._lock:
+            dirs = {
+                path: entry
+                for path, entry in self._dirs.items()
+                if path in self._seen
+                or not any(Path(path).is_relative_to(root) for root in roots)
+            }
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(
+            json.dumps({"version": [AUDIT_VERSION, PARSER_VERSION], "dirs": dirs})
+        )
+        os.replace(tmp_path, self.path)
+
+
+def _extension(name: str) -> str:
+    return name.rpartition(".")[2].lower() if "." in name else ""
+
+
+def _expected_title_name(name: str) -> str | None:
+    """The name the title folder would have been renamed to, if it's not that already"""
+
+    _, title, year = parse_name_and_year(name, is_file=False)
+    expected = f"{title} ({year})" if year else title
+
+    return None if expected == name else expected
+
+
+def _examine_library(
+    path: Path, entries: list[os.DirEntry]
+) -> tuple[list[Issue], list[str]]:
+    issues: list[Issue] = []
+    subdirs: list[str] = []
+
+    for entry in entries:
+        if entry.is_dir():
+            subdirs.append(entry.name)
+            if expected := _expected_title_name(entry.name):
+                issues.append(
+                    Issue(path=path / entry.name, problem=f"expected {expected!r}")
+                )
+        elif _extension(entry.name) in VIDEO_FILE_EXTS:
+            issues.append(
+                Issue(path=path / entry.name, problem="not inside a title folder")
+            )
+
+    return issues, subdirs
+
+
+def _examine_title(
+    path: Path, entries: list[os.DirEntry]
+) -> tuple[list[Issue], list[str]]:
+    issues: list[Issue] = []
+    subdirs: list[str] = []
+
+    files = [e.name for e in entries if e.is_file()]
+    dirs = [e.name for e in entries if e.is_dir()]
+    # Checked against the name the folder should have, so a misnamed folder isn't reported again
+    # for everything in it
+    stem = _expected_title_name(path.name) or path.name
+
+    # Told apart the same way infer_input_type does
+    if any("SEASON" in name.upper() or "S0" in name.upper() for name in dirs):
+        for name in dirs:
+            if _SEASON_FOLDER_RE.fullmatch(name):
+                subdirs.append(name)
+            else:
+                issues.append(
+                    Issue(path=path / name, problem="expected a 'Season NN' folder")
+                )
+
+        for name in files:
+            if _extension(name) in VIDEO_FILE_EXTS:
+                issues.append(
+                    Issue(
+                        path=path / name, problem="episode outside of a season folder"
+                    )
+                )
+
+        return issues, subdirs
+
+    if not any(_extension(name) in VIDEO_FILE_EXTS for name in files):
+        issues.append(Issue(path=path, problem="no video files or season folders"))
+        return issues, subdirs
+
+    # A movie's video and subtitles are named after its folder
+    movie_re = re.compile(re.escape(stem) + r"(?:\.(?P<language>[^.]{1,3}))?\.[^.]+")
+    for name in files:
+        extension = _extension(name)
+        if extension not in VIDEO_FILE_EXTS and extension not in SUBTITLES_FILE_EXTS:
+            continue
+
+        match = movie_re.fullmatch(name)
+        if match is None or (
+            match["language"] and extension not in SUBTITLES_FILE_EXTS
+        ):
+            issues.append(
+                Issue(path=path / name, problem=f"expected '{stem}.{extension}'")
+            )
+
+    return issues, subdirs
+
+
+def _examine_season(
+    path: Path, entries: list[os.DirEntry]
+) -> tuple[list[Issue], list[str]]:
+    issues: list[Issue] = []
+
+    season = int(_SEASON_FOLDER_RE.fullmatch(path.name).group(1))
+    show_stem = _expected_title_name(path.parent.name) or path.parent.name
+    episode_re = re.compile(
+        re.escape(show_stem)
+        + rf" S{season:02d}(?:E\d{{2,}})+(?: .+?)?(?:\.[^.]{{1,3}})?\.[^.]+"
+    )
+
+    for entry in entries:
+        extension = _extension(entry.name)
+        if not entry.is_file() or (
+            extension not in VIDEO_FILE_EXTS and extension not in SUBTITLES_FILE_EXTS
+        ):
+            continue
+
+        if not episode_re.fullmatch(entry.name):
+            issues.append(
+                Issue(
+                    path=path / entry.name,
+                    problem=f"expected '{show_stem} S{season:02d}EMM[ <episode name>].{extension}'",
+                )
+            )
+
+    return issues, []
+
+
+_EXAMINERS = {
+    _LIBRARY: _examine_library,
+    _TITLE: _examine_title,
+    _SEASON: _examine_season,
+}
+
+
+def _audit_dir(path: Path, depth: int, state: AuditState | None) -> _Examined | None:
+    """Checks the folder's entries, or returns what they were found to be last time if it hasn't
+    changed since. Returns None if the folder has been removed in the meantime."""
+
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    if state is not None and (examined := state.lookup(path, mtime_ns)) is not None:
+        count("audit_dirs_skipped")
+        return examined
+
+    count("audit_dirs_examined")
+    try:
+        with timed("audit_dir", path), os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except FileNotFoundError:
+        return None
+
+    issues, subdirs = _EXAMINERS[depth](path, entries)
+
+    return _Examined(mtime_ns=mtime_ns, issues=issues, subdirs=subdirs)
+
+
+def audit_library(
+    roots: Iterable[Path],
+    *,
+    state: AuditState | None = None,
+    jobs: int = DEFAULT_AUDIT_JOBS,
+) -> AuditReport:
+    """Checks that every title under the library roots is laid out and named the way it would be
+    renamed to, without changing anything. Folders are listed in parallel (by up to jobs threads),
+    and with a state, folders that haven't changed since the last audit aren't listed again."""
+
+    started = time.time()
+    issues: list[Issue] = []
+    examined = skipped = 0
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running: dict[Future[_Examined | None], tuple[Path, int]] = {}
+
+        def submit(path: Path, depth: int):
+            future = pool.submit(
+                contextvars.copy_context().run, _audit_dir, path, depth, state
+            )
+            running[future] = (path, depth)
+
+        for root in roots:
+            submit(root, _LIBRARY)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, depth = running.pop(future)
+                try:
+                    result = future.result()
+                except (OSError, ParseTimeout) as e:
+                    result = _Examined(
+                        mtime_ns=0,
+                        issues=[Issue(path=path, problem=f"unable to check: {e}")],
+                        subdirs=[],
+                    )
+
+                if result is None:
+                    continue
+
+                if result.remembered:
+                    skipped += 1
+                else:
+                    examined += 1
+                    if (
+                        state is not None
+                        and result.mtime_ns
+                        and result.mtime_ns / 1e9 < started - _RACY_SECONDS
+                    ):
+                        state.record(path, result)
+
+                for issue in result.issues:
+                    emit("nonconforming", path=str(issue.path), problem=issue.problem)
+                issues += result.issues
+
+                for name in result.subdirs:
+                    submit(path / name, depth + 1)
+
+    return AuditReport(
+        issues=sorted(issues, key=lambda i: i.path),
+        examined=examined,
+        skipped=skipped,
+    )
+
+
+def log_audit_report(report: AuditReport):
+    logger.info(
+        f"Audited {report.examined + report.skipped} folders ({report.skipped} unchanged since the"
+        f" last audit), {len(report.issues)} nonconforming names"
+    )
+
+    for issue in report.issues:
+        logger.warning(f"\t{issue.path}: {issue.problem}")
@@ -0,0 +1,504 @@
+import contextlib
+import contextvars
+import dataclasses
+import logging
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from jellyfin_media_renamer.common import (
+    CommandError,
+    InputType,
+    current_terminal,
+    get_name_and_year,
+    infer_input_type,
+)
+from jellyfin_media_renamer.events import emit
+from jellyfin_media_renamer.fs import invalidate, scan_dir
+from jellyfin_media_renamer.journal import Journal, apply_plan_journaled
+from jellyfin_media_renamer.linking import plan_links
+from jellyfin_media_renamer.locking import hold_locks
+from jellyfin_media_renamer.metrics import count, timed
+from jellyfin_media_renamer.movies import (
+    plan_movie_inside_folder,
+    plan_movie_without_folder,
+)
+from jellyfin_media_renamer.parsing import (
+    ParseTimeout,
+    parse_name_and_year,
+    score_name_and_year,
+)
+from jellyfin_media_renamer.plan import (
+    DEFAULT_IO_JOBS,
+    DeleteOp,
+    DestinationIndex,
+    MkdirOp,
+    Plan,
+    RenameOp,
+    apply_plan,
+    confirm_deletes,
+    log_plan,
+    validate_plan,
+)
+from jellyfin_media_renamer.shows import plan_show
+from jellyfin_media_renamer.titles import match_title
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 4
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class ProcessOptions:
+    dry_run: bool = False
+    # When not interactive, nothing prompts and titles below min_confidence are queued for review
+    interactive: bool = True
+    # Nobody is around to review the queued titles at the end of the run either, e.g. when watching
+    unattended: bool = False
+    # Whether extra files and duplicate copies are deleted when not interactive, since nobody
+    # confirms them they're left in place otherwise
+    purge: bool = False
+    min_confidence: float = DEFAULT_MIN_CONFIDENCE
+    # Records every op so interrupted runs can be resumed or undone
+    journal: Journal | None = None
+    # Build the renamed tree here out of links instead of renaming in place
+    output_root: Path | None = None
+    # Destinations claimed by titles earlier in the run, each plan is checked against them
+    destinations: DestinationIndex | None = None
+    # How many of a title's renames, links and deletes may run at once
+    io_jobs: int = DEFAULT_IO_JOBS
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class BatchResult:
+    path: Path
+    input_type: InputType | None
+    error: str | None = None
+    needs_review: bool = False
+    confidence: float | None = None
+    # Where the title ended up next to the original path, if it was renamed in place
+    destination: Path | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.needs_review
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class _BatchJob:
+    path: Path
+    input_type: InputType
+    raw_name: str
+    name: str
+    year: int | None
+    confidence: float
+    options: ProcessOptions
+
+    @property
+    def lock_paths(self) -> frozenset[Path]:
+        return title_lock_paths(
+            self.path, self.name, self.year, output_root=self.options.output_root
+        )
+
+
+def _new_stem(name: str, year: int | None) -> str:
+    return f"{name} ({year})" if year else name
+
+
+def title_lock_paths(
+    fp: Path, name: str, year: int | None, *, output_root: Path | None = None
+) -> frozenset[Path]:
+    """The paths a job on this title has to lock: the title itself and where it gets renamed to"""
+
+    destination = (output_root or fp.parent) / _new_stem(name, year)
+    return frozenset({fp.absolute(), destination.absolute()})
+
+
+@contextlib.contextmanager
+def hold_title_locks(fp: Path, lock_paths: frozenset[Path]) -> Iterator[None]:
+    """Locks a title's paths for the duration of the block. If another job held them first, the
+    title was listed before that job changed it, so those listings are dropped."""
+
+    with hold_locks(lock_paths) as waited:
+        if waited:
+            for path in {fp, *lock_paths}:
+                invalidate(path)
+        yield
+
+
+def _plan_title_in_place(
+    fp: Path, input_type: InputType, raw_name: str, name: str, year: int | None
+) -> Plan:
+    new_stem = _new_stem(name, year)
+
+    if input_type == InputType.MOVIE_WITHOUT_FOLDER:
+        return plan_movie_without_folder(fp, name, year, new_stem)
+
+    if input_type == InputType.FOLDER_WITH_MOVIE:
+        return plan_movie_inside_folder(fp, name, year, new_stem)
+
+    if input_type == InputType.FOLDER_WITH_SHOW_SEASONS:
+        return plan_show(fp, raw_name, name, year, new_stem)
+
+    raise CommandError(f"Unsupported input type: {input_type}")
+
+
+def plan_title(
+    fp: Path,
+    input_type: InputType,
+    raw_name: str,
+    name: str,
+    year: int | None,
+    *,
+    output_root: Path | None = None,
+) -> Plan:
+    plan = _plan_title_in_place(fp, input_type, raw_name, name, year)
+
+    if output_root is not None:
+        plan = plan_links(plan, fp, output_root)
+
+    return plan
+
+
+def _apply(plan: Plan, options: ProcessOptions):
+    if options.dry_run:
+        log_plan(plan)
+    elif options.journal is not None:
+        apply_plan_journaled(plan, options.journal, jobs=options.io_jobs)
+    else:
+        apply_plan(plan, jobs=options.io_jobs)
+
+
+def process_title(
+    fp: Path,
+    input_type: InputType,
+    raw_name: str,
+    name: str,
+    year: int | None,
+    *,
+    options: ProcessOptions | None = None,
+) -> Plan:
+    if options is None:
+        options = ProcessOptions()
+
+    plan = plan_title(
+        fp, input_type, raw_name, name, year, output_root=options.output_root
+    )
+    validate_plan(plan, options.destinations)
+
+    if not options.dry_run:
+        plan = confirm_deletes(plan)
+
+    _apply(plan, options)
+
+    return plan
+
+
+def _destination(plan: Plan, fp: Path) -> Path | None:
+    """Finds the entry next to fp that the plan moves the title into"""
+
+    for op in plan.ops:
+        if isinstance(op, RenameOp) and op.dst.parent == fp.parent:
+            return op.dst
+        if isinstance(op, MkdirOp) and op.path.parent == fp.parent:
+            return op.path
+
+    return None
+
+
+def collect_targets(paths: Iterable[Path], *, expand_roots: bool) -> list[Path]:
+    """Returns the titles to process, expanding each path to its children if expand_roots is set"""
+
+    targets: list[Path] = []
+
+    for path in paths:
+        if not path.exists():
+            raise CommandError(f"No file or folder found for path: {path}")
+
+        if expand_roots:
+            if not path.is_dir():
+                raise CommandError(f"Batch root is not a folder: {path}")
+
+            targets.extend(
+                e.path for e in scan_dir(path).entries if not e.name.startswith(".")
+            )
+        else:
+            targets.append(path)
+
+    return targets
+
+
+def _infer_name_and_year(
+    fp: Path, input_type: InputType
+) -> tuple[str, str, int | None, float]:
+    """Like get_name_and_year but without asking, also returning how confident the guess is"""
+
+    is_file = input_type == InputType.MOVIE_WITHOUT_FOLDER
+    try:
+        raw_name, name, year = parse_name_and_year(fp.name, is_file=is_file)
+        confidence = score_name_and_year(fp.name, is_file=is_file)
+    except ParseTimeout as e:
+        raise CommandError(str(e))
+
+    # A title found in the title index needs no review, however vague its name was
+    title = match_title(
+        name, year, is_show=input_type == InputType.FOLDER_WITH_SHOW_SEASONS
+    )
+    if title is not None:
+        name, year, confidence = title.name, title.year, 1.0
+
+    return raw_name, name, year, confidence
+
+
+def _skip_deletes(plan: Plan) -> Plan:
+    """Leaves the files the plan would delete in place"""
+
+    if not plan.deletes:
+        return plan
+
+    for op in plan.deletes:
+        logger.info(f"Leaving {op.path} in place, add --purge to delete it")
+
+    return dataclasses.replace(
+        plan, ops=tuple(op for op in plan.ops if not isinstance(op, DeleteOp))
+    )
+
+
+def _process_job(job: _BatchJob) -> BatchResult:
+    if job.options.interactive:
+        plan = process_title(
+            job.path,
+            job.input_type,
+            job.raw_name,
+            job.name,
+            job.year,
+            options=job.options,
+        )
+        return BatchResult(
+            path=job.path,
+            input_type=job.input_type,
+            destination=_destination(plan, job.path),
+        )
+
+    plan = plan_title(
+        job.path,
+        job.input_type,
+        job.raw_name,
+        job.name,
+        job.year,
+        output_root=job.options.output_root,
+    )
+    confidence = min(job.confidence, plan.confidence)
+
+    if confidence < job.options.min_confidence:
+        logger.info(
+            f"Queued {job.path.name!r} for review (confidence {confidence:.2f})"
+        )
+        return BatchResult(
+            path=job.path,
+            input_type=job.input_type,
+            needs_review=True,
+            confidence=confidence,
+        )
+
+    if not job.options.purge:
+        plan = _skip_deletes(plan)
+
+    validate_plan(plan, job.options.destinations)
+    _apply(plan, job.options)
+
+    return BatchResult(
+        path=job.path,
+        input_type=job.input_type,
+        confidence=confidence,
+        destination=_destination(plan, job.path),
+    )
+
+
+def _emit_result(result: BatchResult):
+    if result.error is not None:
+        emit("error", path=str(result.path), message=result.error)
+    else:
+        emit(
+            "title",
+            path=str(result.path),
+            destination=str(result.destination) if result.destination else None,
+            needs_review=result.needs_review,
+            confidence=result.confidence,
+        )
+
+
+def _run_job(job: _BatchJob) -> BatchResult:
+    logger.info(f"Processing {job.input_type.value} at {job.path.absolute()} ...")
+    count("titles")
+
+    try:
+        with hold_title_locks(job.path, job.lock_paths):
+            result = _process_job(job)
+    except CommandError as e:
+        result = BatchResult(path=job.path, input_type=job.input_type, error=e.message)
+    except Exception as e:
+        logger.debug(f"Unexpected error while processing {job.path}", exc_info=True)
+        result = BatchResult(
+            path=job.path, input_type=job.input_type, error=f"{type(e).__name__}: {e}"
+        )
+
+    _emit_result(result)
+
+    return result
+
+
+def _run_jobs(batch_jobs: list[_BatchJob], *, jobs: int) -> list[BatchResult]:
+    """Runs jobs in parallel, except that a job sharing a lock path with a running or earlier
+    queued job is held back until that one is done, instead of tying up a worker waiting on it"""
+
+    queued = list(batch_jobs)
+    running: dict[Future[BatchResult], frozenset[Path]] = {}
+    results: list[BatchResult] = []
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while queued or running:
+            claimed: set[Path] = set().union(*running.values())
+
+            for job in list(queued):
+                if len(running) >= jobs:
+                    break
+
+                conflicts = not claimed.isdisjoint(job.lock_paths)
+                claimed |= job.lock_paths
+                if conflicts:
+                    continue
+
+                queued.remove(job)
+                # Each job runs in a copy of this thread's context, so a server job's log
+                # output and prompts still reach its client
+                future = pool.submit(contextvars.copy_context().run, _run_job, job)
+                running[future] = job.lock_paths
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                results.append(future.result())
+
+    return results
+
+
+def _review(results: list[BatchResult], options: ProcessOptions) -> list[BatchResult]:
+    """Asks about every title that was queued for review, in one session at the end of the run"""
+
+    queued = [r for r in results if r.needs_review]
+    if not queued:
+        return results
+
+    if options.unattended or not current_terminal().is_interactive():
+        logger.warning(
+            f"{len(queued)} titles need review, re-run without --yes from a terminal to review them"
+        )
+        return results
+
+    logger.info(f"Reviewing {len(queued)} low confidence titles ...")
+
+    reviewed: dict[Path, BatchResult] = {}
+    for result in queued:
+        logger.info(f"{result.path} (confidence {result.confidence:.2f})")
+        raw_name, name, year = get_name_and_year(result.path, result.input_type)
+
+        reviewed[result.path] = _run_job(
+            _BatchJob(
+                path=result.path,
+                input_type=result.input_type,
+                raw_name=raw_name,
+                name=name,
+                year=year,
+                confidence=1.0,
+                options=dataclasses.replace(options, interactive=True),
+            )
+        )
+
+    return [reviewed.get(r.path, r) for r in results]
+
+
+def run_batch(
+    targets: list[Path],
+    *,
+    jobs: int = DEFAULT_JOBS,
+    options: ProcessOptions | None = None,
+) -> list[BatchResult]:
+    """Classifies and processes every target, returning one result per target in the same order.
+    Failures are recorded in the results instead of aborting the remaining titles."""
+
+    if options is None:
+        options = ProcessOptions()
+
+    if options.destinations is None:
+        options = dataclasses.replace(options, destinations=DestinationIndex())
+
+    results: dict[Path, BatchResult] = {}
+    batch_jobs: list[_BatchJob] = []
+
+    # Classification and name confirmation may prompt, so they run up front on this thread
+    for fp in targets:
+        try:
+            input_type = infer_input_type(fp)
+            logger.info(f"Detected {input_type.value} at {fp.absolute()}")
+
+            if options.interactive:
+                raw_name, name, year = get_name_and_year(fp, input_type)
+                confidence = 1.0
+            else:
+                with timed("infer_name_and_year", fp):
+                    raw_name, name, year, confidence = _infer_name_and_year(
+                        fp, input_type
+                    )
+        except CommandError as e:
+            # A name that can't be parsed in time fails just its own title
+            results[fp] = BatchResult(path=fp, input_type=None, error=e.message)
+            _emit_result(results[fp])
+            continue
+
+        emit(
+            "name",
+            path=str(fp),
+            raw_name=raw_name,
+            name=name,
+            year=year,
+            confidence=confidence,
+        )
+
+        batch_jobs.append(
+            _BatchJob(
+                path=fp,
+                input_type=input_type,
+                raw_name=raw_name,
+                name=name,
+                year=year,
+                confidence=confidence,
+                options=options,
+            )
+        )
+
+    for result in _run_jobs(batch_jobs, jobs=max(jobs, 1)):
+        results[result.path] = result
+
+    return _review([results[fp] for fp in targets], options)
+
+
+def log_batch_summary(results: list[BatchResult]):
+    failed = [r for r in results if r.error is not None]
+    queued = [r for r in results if r.needs_review]
+
+    logger.info(
+        f"Processed {len(results)} titles, {len(failed)} failed, {len(queued)} need review"
+    )
+    emit("summary", titles=len(results), failed=len(failed), needs_review=len(queued))
+
+    for result in results:
+        if result.ok:
+            logger.info(f"\tOK      {result.path.name}")
+        elif result.needs_review:
+            logger.warning(
+                f"\tREVIEW  {result.path.name}: confidence {result.confidence:.2f}"
+            )
+        else:
+            logger.error(f"\tFAILED  {result.path.name}: {result.error}")
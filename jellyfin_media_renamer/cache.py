@@ -0,0 +1,110 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+def default_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "jellyfin-media-renamer" / "parse-cache.sqlite3"
+
+
+class ParseCache:
+    """A size-bounded, least recently used, on-disk cache of JSON-serializable parse results.
+    Everything is dropped when the version it was written with doesn't match the given version."""
+
+    def __init__(
+        self, path: Path, *, version: int, max_entries: int = DEFAULT_MAX_ENTRIES
+    ):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.path = path
+        self.max_entries = max_entries
+
+        # Batch mode parses from worker threads, access is serialized by the lock instead
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " kind TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " last_used REAL NOT NULL,"
+                " PRIMARY KEY (kind, key)"
+                ")"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+            )
+
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'version'"
+            ).fetchone()
+            if row is None or row[0] != str(version):
+                self._conn.execute("DELETE FROM entries")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                    (str(version),),
+                )
+
+    def get_many(self, kind: str, keys: Iterable[str]) -> dict[str, Any]:
+        """Returns the cached values for whichever of the keys are present"""
+
+        keys = list(dict.fromkeys(keys))
+        found: dict[str, Any] = {}
+
+        with self._lock, self._conn:
+            # Stay well under SQLite's limit on the number of bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE kind = ? AND key IN ({','.join('?' * len(chunk))})",
+                    (kind, *chunk),
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE kind = ? AND key = ?",
+                    [(now, kind, key) for key in found],
+                )
+
+        return found
+
+    def put_many(self, kind: str, items: dict[str, Any]):
+        if not items:
+            return
+
+        now = time.time()
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (kind, key, value, last_used) VALUES (?, ?, ?, ?)",
+                [(kind, key, json.dumps(value), now) for key, value in items.items()],
+            )
+
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM entries WHERE rowid IN ("
+                    " SELECT rowid FROM entries ORDER BY last_used LIMIT ?"
+                    ")",
+                    (count - self.max_entries,),
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
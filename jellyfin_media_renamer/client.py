@@ -0,0 +1,105 @@
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+# This is the entry point, so it sticks to the standard library and only imports the rest of the
+# package when there is no server to hand the job to
+
+# These always run in this process, --watch because it never finishes
+LOCAL_FLAGS = {"--serve", "--watch", "--local"}
+
+
+def default_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "jellyfin-media-renamer.sock"
+
+    return Path(f"/tmp/jellyfin-media-renamer-{os.getuid()}.sock")
+
+
+def _send(f, message: dict):
+    f.write(json.dumps(message).encode() + b"\n")
+    f.flush()
+
+
+def _ask_on_stderr(message: str) -> str:
+    sys.stderr.write(message)
+    sys.stderr.flush()
+
+    answer = sys.stdin.readline()
+    if not answer:
+        raise EOFError
+    return answer.removesuffix("\n")
+
+
+def submit(socket_path: Path, argv: list[str]) -> int | None:
+    """Hands the job to the server listening on socket_path and relays its log output and prompts,
+    returning the job's exit code, or None if no server is running"""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(os.fspath(socket_path))
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    # With --json stdout only carries events, so prompts go to stderr along with the log output
+    json_output = "--json" in {arg.partition("=")[0].casefold() for arg in argv}
+    ask = _ask_on_stderr if json_output else input
+
+    with sock, sock.makefile("rwb") as f:
+        _send(
+            f,
+            {
+                "argv": argv,
+                "cwd": os.getcwd(),
+                "interactive": sys.stdin.isatty(),
+            },
+        )
+
+        for line in f:
+            message = json.loads(line)
+
+            if "log" in message:
+                print(message["log"], file=sys.stderr, flush=True)
+            elif "event" in message:
+                print(json.dumps(message["event"]), flush=True)
+            elif "prompt" in message:
+                try:
+                    _send(f, {"answer": ask(message["prompt"])})
+                except EOFError:
+                    _send(f, {"eof": True})
+            elif "exit" in message:
+                return message["exit"]
+
+    print("The server closed the connection before the job finished", file=sys.stderr)
+    return 1
+
+
+def main():
+    argv = sys.argv[1:]
+    flags = {arg.partition("=")[0].casefold() for arg in argv if arg.startswith("-")}
+    socket_path = Path(
+        next(
+            (arg.partition("=")[2] for arg in argv if arg.startswith("--socket=")),
+            None,
+        )
+        or default_socket_path()
+    )
+
+    if "--serve" in flags:
+        from jellyfin_media_renamer.server import serve
+
+        serve(socket_path, verbose=bool(flags & {"--verbose", "-v"}))
+        return
+
+    if not flags & LOCAL_FLAGS:
+        exit_code = submit(socket_path, argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from jellyfin_media_renamer.main import main as run_locally
+
+    run_locally()
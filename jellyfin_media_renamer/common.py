@@ -1,8 +1,17 @@
+import contextvars
+import enum
 import logging
 import os
-import re
+import sys
+import threading
 from pathlib import Path
 
+from jellyfin_media_renamer.events import emit
+from jellyfin_media_renamer.fs import scan_dir
+from jellyfin_media_renamer.metrics import timed
+from jellyfin_media_renamer.parsing import ParseTimeout, parse_name_and_year
+from jellyfin_media_renamer.titles import match_title
+
 VIDEO_FILE_EXTS = [
     "mkv",
     "mp4",
@@ -19,6 +28,9 @@ VIDEO_FILE_EXTS = [
 
 SUBTITLES_FILE_EXTS = ["srt", "sub"]
 
+# Files deleted by a journaled run are kept under this suffix until the trash is emptied
+TRASH_SUFFIX = ".jmr-trash"
+
 
 logger = logging.getLogger(__name__)
 
@@ -29,87 +41,191 @@ class CommandError(Exception):
         self.message = message
 
 
-def get_name_and_year(fp: Path) -> tuple[str, str, int | None]:
-    raw_name, name, year = infer_name_and_year(fp)
+class InputType(str, enum.Enum):
+    FOLDER_WITH_MOVIE = "movie in folder"
+    MOVIE_WITHOUT_FOLDER = "movie without folder"
+    FOLDER_WITH_SHOW_SEASONS = "show"
 
-    logger.info(f"Detected name: {name}")
-    logger.info(f"Detected year: {year}")
-    is_correct = input("Is this correct? (Y/n): ")
-    is_correct = is_correct.upper() in ["Y", "Yes", "Ye", ""]
 
-    if not is_correct:
-        return (
-            input_str := input("Enter correct name: "),
-            input_str,
-            int(input("Enter year (optional): ") or 0) or None,
-        )
+# Batch mode runs jobs on worker threads, so prompts must not interleave on the terminal
+prompt_lock = threading.RLock()
 
-    return raw_name, name.strip(), year
+
+class Terminal:
+    """Where prompts are asked and answered, the local terminal unless a server job swaps it out"""
+
+    def ask(self, message: str) -> str:
+        return input(message)
+
+    def is_interactive(self) -> bool:
+        return sys.stdin.isatty()
+
+
+class StderrTerminal(Terminal):
+    """The local terminal with prompts written to stderr, for --json runs where stdout only carries
+    events"""
+
+    def ask(self, message: str) -> str:
+        sys.stderr.write(message)
+        sys.stderr.flush()
+
+        answer = sys.stdin.readline()
+        if not answer:
+            raise EOFError
+        return answer.removesuffix("\n")
+
+
+_local_terminal = Terminal()
+
+# Set by server jobs to their client's connection
+terminal: contextvars.ContextVar[Terminal | None] = contextvars.ContextVar(
+    "terminal", default=None
+)
 
 
-def strip_tags(text: str) -> str:
-    return re.sub(
-        r"(\[[a-zA-Z0-9\-_\+\.\s\$\#\@\!]+\])", "", text
-    )  # Remove tags like [1080p]
+def current_terminal() -> Terminal:
+    return terminal.get() or _local_terminal
 
 
-def infer_name_and_year(fp: Path) -> tuple[str, str, int | None]:
-    name = fp.name
+def prompt(message: str) -> str:
+    with prompt_lock, timed("prompt"):
+        return current_terminal().ask(message)
+
+
+def infer_input_type(fp: Path) -> InputType:
+    with timed("infer_input_type", fp):
+        input_type = _infer_input_type(fp)
+
+    emit("detected", path=str(fp), type=input_type.value)
+
+    return input_type
+
+
+def _infer_input_type(fp: Path) -> InputType:
     if fp.is_file():
-        name = name[: -len(fp.suffix)]
-
-    # Find the year and split the title by it (we don't care for tags/junk after the year)
-    year = next(re.finditer(r"\(\s?([0-9]{4})\s?\)", fp.name), None)
-    if year:
-        raw_name = strip_tags(name).strip()
-        name = name.split(year.group())[0]
-        year = int(year.group(1))
+        if fp.suffixes and (fp.suffixes[-1][1:] in VIDEO_FILE_EXTS):
+            return InputType.MOVIE_WITHOUT_FOLDER
+
+        raise CommandError(f"Unknown file extension: {fp.suffix}")
+
+    snapshot = scan_dir(fp)
+
+    if any(
+        "SEASON" in sub_dir.name.upper() or "S0" in sub_dir.name.upper()
+        for sub_dir in snapshot.dirs
+    ):
+        return InputType.FOLDER_WITH_SHOW_SEASONS
+
+    if any(
+        sub_file.suffixes and sub_file.suffixes[-1][1:].lower() in VIDEO_FILE_EXTS
+        for sub_file in snapshot.files
+    ):
+        return InputType.FOLDER_WITH_MOVIE
+
+    raise CommandError(f"Failed to determine MediaType for path: {fp}")
+
+
+def get_name_and_year(
+    fp: Path, input_type: InputType | None = None
+) -> tuple[str, str, int | None]:
+    raw_name, name, year = infer_name_and_year(fp, input_type)
+
+    with prompt_lock:
+        logger.info(f"Detected name: {name}")
+        logger.info(f"Detected year: {year}")
+        is_correct = prompt("Is this correct? (Y/n): ")
+        is_correct = is_correct.upper() in ["Y", "Yes", "Ye", ""]
+
+        if not is_correct:
+            return (
+                input_str := prompt("Enter correct name: "),
+                input_str,
+                int(prompt("Enter year (optional): ") or 0) or None,
+            )
+
+    return raw_name, name.strip(), year
+
+
+def infer_name_and_year(
+    fp: Path, input_type: InputType | None = None
+) -> tuple[str, str, int | None]:
+    """Infers (raw name, clean name, year) for a title, only movies are looked up in the title
+    index for movies and only shows for shows (either when input_type isn't known)"""
+
+    with timed("infer_name_and_year", fp):
+        return _infer_name_and_year(fp, input_type)
+
+
+def _infer_name_and_year(
+    fp: Path, input_type: InputType | None
+) -> tuple[str, str, int | None]:
+    if input_type is None:
+        is_file = fp.is_file()
+        is_show = False if is_file else None
     else:
-        # Try and find the year if it's not in ()
-        year = next(re.finditer(r"((?:19|20)[0-9]{2})", fp.name), None)
-        if year:
-            year = year.group()
-        raw_name = strip_tags(name).strip()
-        if year:
-            name = name.split(str(year))[0]
-            year = int(year)
-
-    for re_pattern in [
-        r"((?:www)?\.?UIndex\.org\s*-?\s*)",  # www.UIndex.org -
-        r"((?:www)?\.?Torrenting\.com\s*-?\s*)",  # www.UIndex.org -
-        r"((?:-|_|\.|\s)?WEB(?:-|_|\.|\s)DL(?:-|_|\.|\s)?)"  # WEB-Dl
-        r"((?:-|_|\.|\s)?DVD(?:-|_|\.|\s)?RIP(?:-|_|\.|\s)?)",  # DVDRIP
-    ]:
-        name = re.sub(re_pattern, "", name, count=1, flags=re.IGNORECASE)
-
-    for resolution in ("720p", "1080p", "2160p"):
-        if f"{resolution} " in name:
-            name = name.split(resolution)[0]
-            break
-
-    name = re.sub(r"\.+(\w+)", r" \1", name)  # Replace dots with spaces
-    name = strip_tags(name)
-
-    return raw_name.strip(" ."), name.strip(" ."), year
+        is_file = input_type == InputType.MOVIE_WITHOUT_FOLDER
+        is_show = input_type == InputType.FOLDER_WITH_SHOW_SEASONS
 
+    try:
+        raw_name, name, year = parse_name_and_year(fp.name, is_file=is_file)
+    except ParseTimeout as e:
+        raise CommandError(str(e))
 
-def purge_extra_files(folder: Path):
+    if (title := match_title(name, year, is_show=is_show)) is not None:
+        return raw_name, title.name, title.year
+
+    return raw_name, name, year
+
+
+def find_extra_files(folder: Path) -> list[Path]:
     known_exts = {f".{ext}" for ext in [*VIDEO_FILE_EXTS, *SUBTITLES_FILE_EXTS]}
-    extra_files = [
-        f for f in folder.iterdir() if f.is_file() and f.suffix not in known_exts
+    return [
+        f
+        for f in scan_dir(folder).files
+        if f.suffix not in known_exts and f.suffix != TRASH_SUFFIX
     ]
 
-    if not extra_files:
-        return
+
+def confirm_purge(
+    folder: Path, extra_files: list[Path], duplicates: dict[Path, Path] | None = None
+) -> bool:
+    """Asks whether to delete the extra files and the duplicate copies (mapped to the copy that's
+    kept) in folder"""
+
+    duplicates = duplicates or {}
+
+    if not duplicates:
+        question = f"Purge extra files in {folder}?"
+    elif not extra_files:
+        question = f"Delete duplicate copies in {folder}?"
+    else:
+        question = f"Purge extra files and delete duplicate copies in {folder}?"
 
     confirmation_message = "\n".join(
         (
-            f"Purge extra files in {folder}?",
-            "\n".join(f"\t{f}" for f in extra_files),
+            question,
+            "\n".join(
+                [
+                    *(f"\t{f}" for f in extra_files),
+                    *(
+                        f"\t{f} (duplicate of {kept.name})"
+                        for f, kept in duplicates.items()
+                    ),
+                ]
+            ),
             "\n",
         )
     )
 
-    if input(f"{confirmation_message} [Y/n]: ").upper() in ["Y", "YES", "YE", ""]:
+    return prompt(f"{confirmation_message} [Y/n]: ").upper() in ["Y", "YES", "YE", ""]
+
+
+def purge_extra_files(folder: Path):
+    extra_files = find_extra_files(folder)
+
+    if not extra_files:
+        return
+
+    if confirm_purge(folder, extra_files):
         for file in extra_files:
             os.remove(file.absolute())
@@ -0,0 +1,83 @@
+import hashlib
+import logging
+import mmap
+import os
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+from jellyfin_media_renamer.fs import MappedFile
+
+logger = logging.getLogger(__name__)
+
+# Files that are the same size are compared by hashing this many evenly spaced chunks first, only
+# files that still look identical are hashed in full
+SAMPLE_CHUNKS = 8
+SAMPLE_CHUNK_BYTES = 64 * 1024
+FULL_HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def _sample_hash(path: Path) -> bytes:
+    digest = hashlib.blake2b()
+
+    with open(path, "rb") as f:
+        file = MappedFile(f.fileno())
+        # The first chunk starts at the beginning of the file and the last one ends at its end
+        span = max(file.size - SAMPLE_CHUNK_BYTES, 0)
+        for i in range(SAMPLE_CHUNKS):
+            offset = i * span // (SAMPLE_CHUNKS - 1)
+            digest.update(file.read(offset, SAMPLE_CHUNK_BYTES))
+
+    return digest.digest()
+
+
+def _full_hash(path: Path) -> bytes:
+    digest = hashlib.blake2b()
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapped) as view:
+                for offset in range(0, size, FULL_HASH_CHUNK_BYTES):
+                    digest.update(view[offset : offset + FULL_HASH_CHUNK_BYTES])
+
+    return digest.digest()
+
+
+def _group_by(
+    groups: Iterable[list[Path]], key: Callable[[Path], object]
+) -> list[list[Path]]:
+    """Splits each group by key, keeping only the parts with more than one file"""
+
+    split: list[list[Path]] = []
+    for group in groups:
+        by_key: dict[object, list[Path]] = defaultdict(list)
+        for path in group:
+            by_key[key(path)].append(path)
+
+        split.extend(g for g in by_key.values() if len(g) > 1)
+
+    return split
+
+
+def find_duplicates(paths: Iterable[Path]) -> list[list[Path]]:
+    """Returns groups of files with identical contents, each sorted by path. Empty files are never
+    considered duplicates."""
+
+    sizes = {path: path.stat().st_size for path in paths}
+
+    groups = _group_by([[p for p, size in sizes.items() if size]], sizes.__getitem__)
+    # Only large files have unsampled parts, smaller ones are fully read by the sample hash
+    groups = _group_by(groups, _sample_hash)
+    groups = [
+        g
+        for group in groups
+        for g in (
+            _group_by([group], _full_hash)
+            if sizes[group[0]] > SAMPLE_CHUNKS * SAMPLE_CHUNK_BYTES
+            else [group]
+        )
+    ]
+
+    return sorted(sorted(group) for group in groups)
@@ -0,0 +1,41 @@
+import contextvars
+import json
+import threading
+import time
+from collections.abc import Callable
+from typing import Any, TextIO
+
+
+class EventStream:
+    """Sends each event as soon as it happens, for tools that follow a run with --json"""
+
+    def __init__(self, send: Callable[[dict], None]):
+        self._send = send
+        # Batch mode emits events from worker threads
+        self._lock = threading.Lock()
+
+    @classmethod
+    def to_file(cls, file: TextIO) -> "EventStream":
+        """Writes events to file as JSON lines, flushing after each one"""
+
+        def send(event: dict):
+            file.write(json.dumps(event) + "\n")
+            file.flush()
+
+        return cls(send)
+
+    def emit(self, event: str, **fields: Any):
+        with self._lock:
+            self._send({"event": event, "time": time.time(), **fields})
+
+
+# Set for the duration of a run with --json, batch workers and server jobs get their own copy of
+# the context so each run's events go to whoever started it
+current_events: contextvars.ContextVar[EventStream | None] = contextvars.ContextVar(
+    "current_events", default=None
+)
+
+
+def emit(event: str, **fields: Any):
+    if (stream := current_events.get()) is not None:
+        stream.emit(event, **fields)
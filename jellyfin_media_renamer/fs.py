@@ -0,0 +1,220 @@
+import contextlib
+import contextvars
+import dataclasses
+import errno
+import fcntl
+import mmap
+import os
+import shutil
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+from jellyfin_media_renamer.metrics import count, timed
+
+# From linux/fs.h, clones a whole file on filesystems that support it (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Entry:
+    path: Path
+    is_dir: bool
+    is_file: bool
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class DirSnapshot:
+    """The contents of a folder as listed by a single os.scandir call, sorted by name"""
+
+    path: Path
+    entries: tuple[Entry, ...]
+
+    @property
+    def files(self) -> tuple[Path, ...]:
+        return tuple(e.path for e in self.entries if e.is_file)
+
+    @property
+    def dirs(self) -> tuple[Path, ...]:
+        return tuple(e.path for e in self.entries if e.is_dir)
+
+
+class _Snapshots:
+    """The folders listed so far, by path"""
+
+    def __init__(self):
+        self.by_path: dict[Path, DirSnapshot] = {}
+        # Every folder leading to a cached one, by its parent, so invalidating a folder only visits
+        # its own subtree rather than every folder listed so far
+        self.children: dict[Path, set[Path]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, snapshot: DirSnapshot):
+        self.by_path[snapshot.path] = snapshot
+
+        path = snapshot.path
+        while path.parent != path:
+            siblings = self.children.setdefault(path.parent, set())
+            if path in siblings:
+                break
+            siblings.add(path)
+            path = path.parent
+
+    def drop(self, path: Path):
+        siblings = self.children.get(path.parent)
+        if siblings is not None:
+            siblings.discard(path)
+
+        stack = [path]
+        while stack:
+            path = stack.pop()
+            self.by_path.pop(path, None)
+            stack.extend(self.children.pop(path, ()))
+
+    def clear(self):
+        self.by_path.clear()
+        self.children.clear()
+
+
+# Outside of a run (see fresh_snapshots) snapshots are kept for as long as the process lives
+_process_snapshots = _Snapshots()
+
+# Set for the duration of a run, batch workers get a copy of the context so they share the run's
+# snapshots, while a server's or watcher's later runs list every folder again
+_run_snapshots: contextvars.ContextVar[_Snapshots | None] = contextvars.ContextVar(
+    "run_snapshots", default=None
+)
+
+
+def _snapshots() -> _Snapshots:
+    return _run_snapshots.get() or _process_snapshots
+
+
+def _scan(path: Path) -> DirSnapshot:
+    entries: list[Entry] = []
+
+    with timed("scan_dir", path), os.scandir(path) as it:
+        for dir_entry in it:
+            # DirEntry caches the file type from the directory listing, so these don't stat on most
+            # filesystems (only symlinks need to be followed)
+            entries.append(
+                Entry(
+                    path=path / dir_entry.name,
+                    is_dir=dir_entry.is_dir(),
+                    is_file=dir_entry.is_file(),
+                )
+            )
+
+    entries.sort(key=lambda e: e.path.name)
+
+    return DirSnapshot(path=path, entries=tuple(entries))
+
+
+def scan_dir(path: Path) -> DirSnapshot:
+    """Returns a snapshot of the folder's contents, only listing it the first time it's asked for"""
+
+    snapshots = _snapshots()
+
+    with snapshots.lock:
+        snapshot = snapshots.by_path.get(path)
+
+    if snapshot is not None:
+        count("scan_dir_cached")
+        return snapshot
+
+    snapshot = _scan(path)
+
+    with snapshots.lock:
+        snapshots.add(snapshot)
+
+    return snapshot
+
+
+def invalidate(path: Path):
+    """Forgets the cached snapshots of path and everything beneath it"""
+
+    snapshots = _snapshots()
+
+    with snapshots.lock:
+        snapshots.drop(path)
+
+
+def clear_snapshots():
+    snapshots = _snapshots()
+
+    with snapshots.lock:
+        snapshots.clear()
+
+
+@contextlib.contextmanager
+def fresh_snapshots() -> Iterator[None]:
+    """Lists every folder again the first time it's asked for within the block, the snapshots
+    taken in it are dropped afterwards. Anything may have changed between runs."""
+
+    token = _run_snapshots.set(_Snapshots())
+    try:
+        yield
+    finally:
+        _run_snapshots.reset(token)
+
+
+class MappedFile:
+    """Reads ranges of an open file by memory-mapping just the pages they're on"""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.size = os.fstat(fd).st_size
+
+    def read(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        if offset < 0 or length <= 0:
+            return b""
+
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        with mmap.mmap(
+            self.fd, offset + length - start, offset=start, access=mmap.ACCESS_READ
+        ) as mapped:
+            return mapped[offset - start :]
+
+
+def _clone(src: Path, dst: Path):
+    with open(src, "rb") as src_f, open(dst, "xb") as dst_f:
+        try:
+            fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+            return
+        except OSError:
+            pass
+
+        try:
+            # Lets the kernel (or a network filesystem's server) copy without going through us
+            remaining = os.fstat(src_f.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(src_f.fileno(), dst_f.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            return
+        except (OSError, AttributeError):  # copy_file_range is Linux only
+            dst_f.seek(0)
+            dst_f.truncate()
+            src_f.seek(0)
+
+        shutil.copyfileobj(src_f, dst_f)
+
+
+def link_file(src: Path, dst: Path):
+    """Hardlinks src to dst, falling back to a reflink and then an in-kernel copy when the
+    destination is on another filesystem"""
+
+    try:
+        os.link(src, dst)
+        return
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+
+    _clone(src, dst)
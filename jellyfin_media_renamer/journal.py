@@ -0,0 +1,320 @@
+import dataclasses
+import json
+import logging
+import os
+import threading
+import uuid
+from pathlib import Path
+
+from jellyfin_media_renamer.common import TRASH_SUFFIX, CommandError
+from jellyfin_media_renamer.fs import invalidate
+from jellyfin_media_renamer.plan import (
+    DeleteOp,
+    LinkOp,
+    MkdirOp,
+    Op,
+    Plan,
+    RenameOp,
+    apply_op,
+    run_ops,
+)
+
+logger = logging.getLogger(__name__)
+
+# Completed ops are fsync'd in batches of this many, ops whose record was lost in a crash are
+# recognized by looking at the filesystem instead
+FSYNC_EVERY = 64
+
+
+def default_journal_path() -> Path:
+    state_home = os.environ.get("XDG_STATE_HOME") or Path.home() / ".local" / "state"
+    return Path(state_home) / "jellyfin-media-renamer" / "journal.jsonl"
+
+
+def trash_path(path: Path, run_id: str) -> Path:
+    """Where a journaled delete parks the file until the trash is emptied, so it can be undone"""
+
+    return path.with_name(f".{path.name}.{run_id}{TRASH_SUFFIX}")
+
+
+def _op_to_json(op: Op) -> dict:
+    if isinstance(op, RenameOp):
+        return {"type": "rename", "src": str(op.src), "dst": str(op.dst)}
+    if isinstance(op, MkdirOp):
+        return {"type": "mkdir", "path": str(op.path), "exist_ok": op.exist_ok}
+    if isinstance(op, LinkOp):
+        return {"type": "link", "src": str(op.src), "dst": str(op.dst)}
+    return {"type": "delete", "path": str(op.path)}
+
+
+def _op_from_json(data: dict) -> Op:
+    if data["type"] == "rename":
+        return RenameOp(Path(data["src"]), Path(data["dst"]))
+    if data["type"] == "mkdir":
+        return MkdirOp(Path(data["path"]), data.get("exist_ok", False))
+    if data["type"] == "link":
+        return LinkOp(Path(data["src"]), Path(data["dst"]))
+    return DeleteOp(Path(data["path"]))
+
+
+def _absolute(op: Op) -> Op:
+    if isinstance(op, (RenameOp, LinkOp)):
+        return dataclasses.replace(op, src=op.src.absolute(), dst=op.dst.absolute())
+    return dataclasses.replace(op, path=op.path.absolute())
+
+
+@dataclasses.dataclass(slots=True, kw_only=True)
+class JournaledRun:
+    session: str
+    run_id: str
+    ops: list[Op]
+    done: set[int] = dataclasses.field(default_factory=set)
+    finished: bool = False
+    undone: bool = False
+    trash_emptied: bool = False
+
+
+class Journal:
+    """An append-only log of every planned and completed op, used to resume or undo runs"""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.path = path
+        self.session = uuid.uuid4().hex[:12]
+
+        # Kept open until close(), every record is appended to it as it happens
+        self._file = open(path, "a", encoding="utf8")  # noqa: SIM115
+        self._lock = threading.Lock()
+        self._unsynced = 0
+
+    def _write(self, record: dict, *, sync: bool):
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._unsynced += 1
+
+            if sync or self._unsynced >= FSYNC_EVERY:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def begin(self, plan: Plan) -> JournaledRun:
+        run = JournaledRun(
+            session=self.session,
+            run_id=uuid.uuid4().hex[:12],
+            ops=[_absolute(op) for op in plan.ops],
+        )
+
+        # The whole plan is made durable before anything is touched
+        self._write(
+            {
+                "event": "begin",
+                "session": run.session,
+                "run": run.run_id,
+                "ops": [_op_to_json(op) for op in run.ops],
+            },
+            sync=True,
+        )
+
+        return run
+
+    def mark_done(self, run: JournaledRun, seq: int):
+        run.done.add(seq)
+        self._write({"event": "done", "run": run.run_id, "seq": seq}, sync=False)
+
+    def finish(self, run: JournaledRun):
+        run.finished = True
+        self._write({"event": "end", "run": run.run_id}, sync=True)
+
+    def mark_undone(self, run: JournaledRun):
+        run.undone = True
+        self._write({"event": "undone", "run": run.run_id}, sync=True)
+
+    def mark_trash_emptied(self, run: JournaledRun):
+        run.trash_emptied = True
+        self._write({"event": "trash_emptied", "run": run.run_id}, sync=True)
+
+    def load_runs(self) -> list[JournaledRun]:
+        with self._lock:
+            self._file.flush()
+
+        runs: dict[str, JournaledRun] = {}
+
+        with open(self.path, encoding="utf8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half written
+                    logger.debug(f"Skipping malformed journal line: {line!r}")
+                    continue
+
+                if record["event"] == "begin":
+                    runs[record["run"]] = JournaledRun(
+                        session=record["session"],
+                        run_id=record["run"],
+                        ops=[_op_from_json(op) for op in record["ops"]],
+                    )
+                elif (run := runs.get(record["run"])) is not None:
+                    if record["event"] == "done":
+                        run.done.add(record["seq"])
+                    elif record["event"] == "end":
+                        run.finished = True
+                    elif record["event"] == "undone":
+                        run.undone = True
+                    elif record["event"] == "trash_emptied":
+                        run.trash_emptied = True
+
+        return list(runs.values())
+
+    def close(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def _is_applied(op: Op) -> bool:
+    if isinstance(op, RenameOp):
+        return not op.src.exists() and op.dst.exists()
+    if isinstance(op, MkdirOp):
+        return op.path.is_dir()
+    if isinstance(op, LinkOp):
+        return op.dst.exists()
+    return not op.path.exists()
+
+
+def _apply_journaled_op(op: Op, run_id: str):
+    if not isinstance(op, DeleteOp):
+        apply_op(op)
+        return
+
+    # Deleting is deferred until the trash is emptied so the run can be undone
+    op.path.rename(trash_path(op.path, run_id))
+    invalidate(op.path.parent)
+
+
+def _continue_run(journal: Journal, run: JournaledRun, *, jobs: int = 1):
+    def apply(seq: int, op: Op):
+        if seq in run.done:
+            return
+
+        if not _is_applied(op):
+            _apply_journaled_op(op, run.run_id)
+
+        journal.mark_done(run, seq)
+
+    # Every op is marked done on its own, so they can complete in any order
+    run_ops(run.ops, apply, jobs=jobs)
+
+    journal.finish(run)
+
+
+def apply_plan_journaled(plan: Plan, journal: Journal, *, jobs: int = 1):
+    _continue_run(journal, journal.begin(plan), jobs=jobs)
+
+
+def resume(journal: Journal) -> int:
+    """Finishes every run that was interrupted, returns how many there were"""
+
+    interrupted = [r for r in journal.load_runs() if not r.finished and not r.undone]
+
+    for run in interrupted:
+        logger.info(f"Resuming interrupted run {run.run_id} ({len(run.ops)} ops)")
+        _continue_run(journal, run)
+
+    return len(interrupted)
+
+
+def _undo_op(op: Op, run_id: str):
+    if isinstance(op, RenameOp):
+        if op.dst.exists() and not op.src.exists():
+            logger.debug(f"Undoing: {op}")
+            op.dst.rename(op.src)
+            invalidate(op.dst)
+            invalidate(op.dst.parent)
+            invalidate(op.src.parent)
+    elif isinstance(op, LinkOp):
+        # Only remove the link while the source still exists, so no data can be lost
+        if op.dst.exists() and op.src.exists():
+            logger.debug(f"Undoing: {op}")
+            op.dst.unlink()
+            invalidate(op.dst.parent)
+    elif isinstance(op, MkdirOp):
+        if op.path.is_dir() and not any(op.path.iterdir()):
+            logger.debug(f"Undoing: {op}")
+            op.path.rmdir()
+            invalidate(op.path.parent)
+    elif isinstance(op, DeleteOp):
+        trashed = trash_path(op.path, run_id)
+        if trashed.exists():
+            logger.debug(f"Undoing: {op}")
+            trashed.rename(op.path)
+            invalidate(op.path.parent)
+        elif not op.path.exists():
+            logger.warning(f"Can't restore {op.path}, the trash has been emptied since")
+
+
+def undo(journal: Journal, session: str | None = None) -> int:
+    """Reverts every run of the given session (the most recent one by default), returns how many
+    runs were undone"""
+
+    runs = [r for r in journal.load_runs() if not r.undone]
+    if not runs:
+        raise CommandError(f"Nothing to undo in {journal.path}")
+
+    if session is None:
+        session = runs[-1].session
+
+    to_undo = [r for r in runs if r.session == session]
+    if not to_undo:
+        raise CommandError(f"No runs found for session {session!r}")
+
+    for run in reversed(to_undo):
+        logger.info(f"Undoing run {run.run_id} ({len(run.ops)} ops)")
+
+        # The filesystem is checked rather than the done records, which may have been lost
+        for op in reversed(run.ops):
+            _undo_op(op, run.run_id)
+
+        journal.mark_undone(run)
+
+    return len(to_undo)
+
+
+def _moved_by(path: Path, ops: list[Op]) -> Path:
+    """Where path ended up after ops, which may have renamed a folder it's in"""
+
+    for op in ops:
+        if isinstance(op, RenameOp) and path.is_relative_to(op.src):
+            path = op.dst / path.relative_to(op.src)
+
+    return path
+
+
+def empty_trash(journal: Journal) -> int:
+    """Deletes the files that finished runs moved to the trash for good, their runs can still be
+    undone except for those files. Returns how many runs had their trash emptied."""
+
+    runs = [r for r in journal.load_runs() if not r.undone]
+    to_empty = [r for r in runs if r.finished and not r.trash_emptied]
+
+    for run in to_empty:
+        # Runs applied since may have moved the trash along with its folder
+        later_ops = [op for r in runs[runs.index(run) + 1 :] for op in r.ops]
+
+        for seq, op in enumerate(run.ops):
+            if not isinstance(op, DeleteOp):
+                continue
+
+            trashed = _moved_by(
+                trash_path(op.path, run.run_id), run.ops[seq + 1 :] + later_ops
+            )
+            if trashed.exists():
+                logger.debug(f"Emptying trash: {trashed}")
+                os.remove(trashed)
+                invalidate(trashed.parent)
+
+        journal.mark_trash_emptied(run)
+
+    return len(to_empty)
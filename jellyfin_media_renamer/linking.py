@@ -0,0 +1,68 @@
+from pathlib import Path
+
+from jellyfin_media_renamer.fs import scan_dir
+from jellyfin_media_renamer.plan import (
+    DeleteOp,
+    Plan,
+    PlanBuilder,
+    RenameOp,
+)
+
+
+def _list_files(fp: Path) -> list[Path]:
+    if not fp.is_dir():
+        return [fp]
+
+    files: list[Path] = []
+    for entry in scan_dir(fp).entries:
+        if entry.is_dir:
+            files.extend(_list_files(entry.path))
+        elif entry.is_file:
+            files.append(entry.path)
+
+    return files
+
+
+def _final_locations(plan: Plan, files: list[Path]) -> dict[Path, Path]:
+    """Works out where each file ends up once the plan has been applied, without touching the
+    filesystem, returning {final path: original path}"""
+
+    current = {f: f for f in files}
+
+    for op in plan.ops:
+        if isinstance(op, DeleteOp):
+            current.pop(op.path, None)
+        elif isinstance(op, RenameOp):
+            if op.src in current:
+                current[op.dst] = current.pop(op.src)
+                continue
+
+            # Renaming a folder moves everything under it
+            for path in [p for p in current if op.src in p.parents]:
+                current[op.dst / path.relative_to(op.src)] = current.pop(path)
+
+    return current
+
+
+def plan_links(plan: Plan, fp: Path, output_root: Path) -> Plan:
+    """Turns an in-place plan for the title at fp into one that builds the renamed tree inside
+    output_root out of links, leaving the source untouched"""
+
+    links = PlanBuilder()
+    links.note_confidence(plan.confidence)
+
+    made_dirs: set[Path] = set()
+
+    for final, original in sorted(_final_locations(plan, _list_files(fp)).items()):
+        target = output_root / final.relative_to(fp.parent)
+
+        for folder in reversed(target.relative_to(output_root).parents[:-1]):
+            folder = output_root / folder
+            if folder not in made_dirs:
+                # The title may already be partly in the library (e.g. earlier seasons)
+                links.mkdir(folder, exist_ok=True)
+                made_dirs.add(folder)
+
+        links.link(original, target)
+
+    return links.build()
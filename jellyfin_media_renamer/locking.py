@@ -0,0 +1,54 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def default_lock_dir() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "jellyfin-media-renamer-locks"
+
+    return Path(f"/tmp/jellyfin-media-renamer-locks-{os.getuid()}")
+
+
+def _lock_file(lock_dir: Path, key: str) -> Path:
+    # Keyed by path rather than locking the folder itself, because the folder gets renamed (or
+    # doesn't exist yet) while the lock is held
+    return lock_dir / f"{hashlib.sha1(os.fsencode(key)).hexdigest()}.lock"
+
+
+@contextlib.contextmanager
+def hold_locks(
+    paths: Iterable[Path], *, lock_dir: Path | None = None
+) -> Iterator[bool]:
+    """Holds an exclusive advisory lock on every path until the block exits, first waiting for
+    any other job (in this process or another one) that holds one of them. Yields whether it had
+    to wait."""
+
+    lock_dir = lock_dir or default_lock_dir()
+    lock_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+    waited = False
+    with contextlib.ExitStack() as stack:
+        # Always locking in the same order means two jobs can't each wait on the other
+        for key in sorted({os.path.abspath(p) for p in paths}):
+            fd = os.open(
+                _lock_file(lock_dir, key), os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600
+            )
+            # Closing the file releases its lock
+            stack.callback(os.close, fd)
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info(f"Waiting for another job working on {key} ...")
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                waited = True
+
+        yield waited
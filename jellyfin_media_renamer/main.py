@@ -1,19 +1,66 @@
+import contextlib
 import dataclasses
-import enum
 import logging
 import sys
 from pathlib import Path
 
+from jellyfin_media_renamer.audit import (
+    DEFAULT_AUDIT_JOBS,
+    AuditState,
+    audit_library,
+    default_audit_state_path,
+    log_audit_report,
+)
+from jellyfin_media_renamer.batch import (
+    DEFAULT_JOBS,
+    DEFAULT_MIN_CONFIDENCE,
+    ProcessOptions,
+    collect_targets,
+    hold_title_locks,
+    log_batch_summary,
+    process_title,
+    run_batch,
+    title_lock_paths,
+)
+from jellyfin_media_renamer.cache import ParseCache, default_cache_path
 from jellyfin_media_renamer.common import (
-    VIDEO_FILE_EXTS,
     CommandError,
+    InputType,
+    StderrTerminal,
     get_name_and_year,
+    infer_input_type,
+    terminal,
+)
+from jellyfin_media_renamer.events import EventStream, current_events, emit
+from jellyfin_media_renamer.fs import fresh_snapshots
+from jellyfin_media_renamer.journal import (
+    Journal,
+    default_journal_path,
+    empty_trash,
+    resume,
+    undo,
+)
+from jellyfin_media_renamer.metrics import (
+    Metrics,
+    current_metrics,
+    write_prometheus_textfile,
+    write_summary,
+)
+from jellyfin_media_renamer.parsing import PARSER_VERSION, current_parse_cache
+from jellyfin_media_renamer.plan import (
+    DEFAULT_DEVICE_JOBS,
+    DEFAULT_IO_JOBS,
+    set_device_jobs,
 )
-from jellyfin_media_renamer.movies import (
-    process_movie_inside_folder,
-    process_movie_without_folder,
+from jellyfin_media_renamer.titles import (
+    TitleIndex,
+    build_title_index,
+    current_title_index,
+    default_titles_path,
 )
-from jellyfin_media_renamer.shows import process_show
+from jellyfin_media_renamer.watch import DEFAULT_SETTLE_SECONDS, Watcher
+
+__all__ = ("CLIFlags", "InputType", "infer_input_type", "main", "run")
 
 logger = logging.getLogger(__name__)
 
@@ -21,39 +68,32 @@ logger = logging.getLogger(__name__)
 @dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
 class CLIFlags:
     verbose: bool
-
-
-class InputType(str, enum.Enum):
-    FOLDER_WITH_MOVIE = "movie in folder"
-    MOVIE_WITHOUT_FOLDER = "movie without folder"
-    FOLDER_WITH_SHOW_SEASONS = "show"
-
-
-def infer_input_type(fp: Path) -> InputType:
-    if fp.is_file():
-        if fp.suffixes and (fp.suffixes[-1][1:] in VIDEO_FILE_EXTS):
-            return InputType.MOVIE_WITHOUT_FOLDER
-
-        raise CommandError(f"Unknown file extension: {fp.suffix}")
-
-    sub_objs = list(fp.iterdir())
-
-    if any(
-        sub_obj.is_dir()
-        and ("SEASON" in sub_obj.name.upper() or "S0" in sub_obj.name.upper())
-        for sub_obj in sub_objs
-    ):
-        return InputType.FOLDER_WITH_SHOW_SEASONS
-
-    if any(
-        sub_obj.is_file()
-        and sub_obj.suffixes
-        and sub_obj.suffixes[-1][1:].lower() in VIDEO_FILE_EXTS
-        for sub_obj in sub_objs
-    ):
-        return InputType.FOLDER_WITH_MOVIE
-
-    raise CommandError(f"Failed to determine MediaType for path: {fp}")
+    batch: bool
+    jobs: int
+    dry_run: bool
+    cache: Path | None
+    yes: bool
+    # Delete extra files and duplicate copies with --yes or --watch too
+    purge: bool
+    min_confidence: float
+    journal: Path | None
+    resume: bool
+    undo: str | None
+    empty_trash: bool
+    output: Path | None
+    watch: bool
+    settle: float
+    titles: Path | None
+    build_titles: Path | None
+    profile: bool
+    # Where the machine readable summary of --profile is written, if anywhere
+    profile_output: Path | None
+    metrics_textfile: Path | None
+    io_jobs: int
+    device_jobs: int
+    json: bool
+    # Where the audit state is kept, set when auditing the library instead of renaming
+    audit: Path | None
 
 
 def setup_logging(*, verbose: bool):
@@ -72,59 +112,311 @@ def setup_logging(*, verbose: bool):
     )
 
 
-def parse_args() -> tuple[CLIFlags, str]:
-    """Parses sys.argv, returning a tuple containing (parsed flags, target path)"""
+def parse_args(argv: list[str] | None = None) -> tuple[CLIFlags, list[str]]:
+    """Parses argv (sys.argv by default), returning a tuple containing (parsed flags, target
+    paths)"""
 
     found_flags: set[str] = set()
-    path = ""
+    flag_values: dict[str, str] = {}
+    paths: list[str] = []
 
-    for arg in sys.argv[1:]:
+    for arg in sys.argv[1:] if argv is None else argv:
         if arg.startswith("-"):
-            found_flags.add(arg.casefold())
-        elif path:
-            raise CommandError(f"Unexpected argument: {arg!r}")
+            flag, sep, value = arg.partition("=")
+            found_flags.add(flag.casefold())
+            if sep:
+                flag_values[flag.casefold()] = value
         else:
-            path = arg
+            paths.append(arg)
+
+    try:
+        # Auditing only lists folders, which is mostly waiting on the disk
+        jobs = int(
+            flag_values.get(
+                "--jobs",
+                DEFAULT_AUDIT_JOBS if "--audit" in found_flags else DEFAULT_JOBS,
+            )
+        )
+    except ValueError:
+        raise CommandError(f"Invalid value for --jobs: {flag_values['--jobs']!r}")
+
+    try:
+        io_jobs = int(flag_values.get("--io-jobs", DEFAULT_IO_JOBS))
+    except ValueError:
+        raise CommandError(f"Invalid value for --io-jobs: {flag_values['--io-jobs']!r}")
+
+    try:
+        device_jobs = int(flag_values.get("--device-jobs", DEFAULT_DEVICE_JOBS))
+    except ValueError:
+        raise CommandError(
+            f"Invalid value for --device-jobs: {flag_values['--device-jobs']!r}"
+        )
+
+    try:
+        settle = float(flag_values.get("--settle", DEFAULT_SETTLE_SECONDS))
+    except ValueError:
+        raise CommandError(f"Invalid value for --settle: {flag_values['--settle']!r}")
+
+    try:
+        min_confidence = float(
+            flag_values.get("--min-confidence", DEFAULT_MIN_CONFIDENCE)
+        )
+    except ValueError:
+        raise CommandError(
+            f"Invalid value for --min-confidence: {flag_values['--min-confidence']!r}"
+        )
 
     flags = CLIFlags(
         verbose=("--verbose" in found_flags or "-v" in found_flags),
+        batch=("--batch" in found_flags or "-b" in found_flags),
+        jobs=jobs,
+        dry_run=("--dry-run" in found_flags or "-n" in found_flags),
+        cache=(
+            Path(flag_values.get("--cache") or default_cache_path())
+            if "--cache" in found_flags
+            else None
+        ),
+        yes=("--yes" in found_flags or "-y" in found_flags),
+        purge="--purge" in found_flags,
+        min_confidence=min_confidence,
+        journal=(
+            Path(flag_values.get("--journal") or default_journal_path())
+            if found_flags & {"--journal", "--resume", "--undo", "--empty-trash"}
+            else None
+        ),
+        resume="--resume" in found_flags,
+        # An empty string undoes the most recent session
+        undo=flag_values.get("--undo", "") if "--undo" in found_flags else None,
+        empty_trash="--empty-trash" in found_flags,
+        output=Path(flag_values["--output"]) if flag_values.get("--output") else None,
+        watch="--watch" in found_flags,
+        settle=settle,
+        titles=(
+            Path(flag_values.get("--titles") or default_titles_path())
+            if found_flags & {"--titles", "--build-titles"}
+            else None
+        ),
+        build_titles=(
+            Path(flag_values["--build-titles"])
+            if flag_values.get("--build-titles")
+            else None
+        ),
+        profile=bool(found_flags & {"--profile", "--metrics-textfile"}),
+        profile_output=(
+            Path(flag_values["--profile"]) if flag_values.get("--profile") else None
+        ),
+        metrics_textfile=(
+            Path(flag_values["--metrics-textfile"])
+            if flag_values.get("--metrics-textfile")
+            else None
+        ),
+        io_jobs=io_jobs,
+        device_jobs=device_jobs,
+        json="--json" in found_flags,
+        audit=(
+            Path(flag_values.get("--audit") or default_audit_state_path())
+            if "--audit" in found_flags
+            else None
+        ),
     )
 
-    return flags, path
+    return flags, paths
 
 
-def main():
-    flags, raw_path = parse_args()
+def run(flags: CLIFlags, raw_paths: list[str]):
+    """Runs the command described by already parsed arguments"""
 
-    setup_logging(verbose=flags.verbose)
+    # The server sets up its own stream that forwards events to the client. Prompts move to stderr
+    # so that stdout stays valid JSON lines.
+    tokens = None
+    if flags.json and current_events.get() is None:
+        tokens = (
+            current_events.set(EventStream.to_file(sys.stdout)),
+            terminal.set(StderrTerminal()),
+        )
 
-    if not raw_path:
-        raise CommandError("Please specify a path to a movie or show")
-
-    fp = Path(raw_path)
-
-    if not fp.exists():
-        raise CommandError(f"No file or folder found for path: {fp}")
+    try:
+        _run_profiled(flags, raw_paths)
+    except CommandError as e:
+        emit("error", message=e.message)
+        raise
+    finally:
+        if tokens is not None:
+            current_events.reset(tokens[0])
+            terminal.reset(tokens[1])
 
-    input_type = infer_input_type(fp)
-    logger.info(f"Processing {input_type.value} at {fp.absolute()} ...")
 
-    raw_name, name, year = get_name_and_year(fp)
+def _run_profiled(flags: CLIFlags, raw_paths: list[str]):
+    if not flags.profile:
+        _run(flags, raw_paths)
+        return
 
-    new_stem = name
-    if year:
-        new_stem += f" ({year})"
+    metrics = Metrics()
+    token = current_metrics.set(metrics)
+    try:
+        _run(flags, raw_paths)
+    finally:
+        current_metrics.reset(token)
+        _report_metrics(metrics, flags)
+
+
+def _report_metrics(metrics: Metrics, flags: CLIFlags):
+    logger.info("Time spent per stage:")
+    for line in metrics.log_lines():
+        logger.info(line)
+
+    if flags.profile_output:
+        write_summary(metrics, flags.profile_output)
+        logger.info(f"Wrote profile summary to {flags.profile_output}")
+
+    if flags.metrics_textfile:
+        write_prometheus_textfile(metrics, flags.metrics_textfile)
+
+
+def _run(flags: CLIFlags, raw_paths: list[str]):
+    # Folder snapshots, the journal, the parse cache and title index are only used for this run
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(fresh_snapshots())
+        journal = (
+            stack.enter_context(contextlib.closing(Journal(flags.journal)))
+            if flags.journal
+            else None
+        )
+
+        if journal and flags.undo is not None:
+            count = undo(journal, flags.undo or None)
+            logger.info(f"Undid {count} runs")
+            return
+
+        if journal and flags.resume:
+            count = resume(journal)
+            logger.info(f"Resumed {count} interrupted runs")
+            return
+
+        if journal and flags.empty_trash:
+            count = empty_trash(journal)
+            logger.info(f"Emptied the trash of {count} runs")
+            return
+
+        if flags.build_titles:
+            try:
+                count = build_title_index(flags.build_titles, flags.titles)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Unable to build title index: {e}")
+
+            logger.info(f"Indexed {count} titles into {flags.titles}")
+            return
+
+        if not raw_paths:
+            raise CommandError("Please specify a path to a movie or show")
+
+        if flags.cache:
+            cache = ParseCache(flags.cache, version=PARSER_VERSION)
+            stack.callback(cache.close)
+            stack.callback(current_parse_cache.reset, current_parse_cache.set(cache))
+
+        if flags.audit:
+            _audit(flags, raw_paths)
+            return
+
+        set_device_jobs(max(flags.device_jobs, 1))
+
+        if flags.titles:
+            try:
+                title_index = TitleIndex(flags.titles)
+            except (OSError, ValueError) as e:
+                raise CommandError(
+                    f"Unable to open title index ({e}), build one with --build-titles=<title.basics.tsv.gz>"
+                )
+
+            stack.callback(title_index.close)
+            stack.callback(
+                current_title_index.reset, current_title_index.set(title_index)
+            )
+
+        options = ProcessOptions(
+            dry_run=flags.dry_run,
+            interactive=not flags.yes,
+            purge=flags.purge,
+            min_confidence=flags.min_confidence,
+            journal=journal,
+            output_root=flags.output,
+            io_jobs=max(flags.io_jobs, 1),
+        )
+
+        if flags.output and not flags.output.is_dir():
+            raise CommandError(f"Output folder does not exist: {flags.output}")
+
+        if flags.watch:
+            watcher = Watcher(
+                list(map(Path, raw_paths)), options=options, settle_seconds=flags.settle
+            )
+            try:
+                watcher.run()
+            finally:
+                watcher.close()
+
+            return
+
+        if flags.batch or len(raw_paths) > 1 or flags.yes:
+            # With --batch every path is a library root whose children are processed
+            targets = collect_targets(map(Path, raw_paths), expand_roots=flags.batch)
+            results = run_batch(targets, jobs=flags.jobs, options=options)
+            log_batch_summary(results)
+
+            if not all(r.ok for r in results):
+                sys.exit(1)
+
+            return
+
+        fp = Path(raw_paths[0])
+
+        if not fp.exists():
+            raise CommandError(f"No file or folder found for path: {fp}")
+
+        input_type = infer_input_type(fp)
+        logger.info(f"Processing {input_type.value} at {fp.absolute()} ...")
+
+        raw_name, name, year = get_name_and_year(fp, input_type)
+        emit(
+            "name",
+            path=str(fp),
+            raw_name=raw_name,
+            name=name,
+            year=year,
+            confidence=1.0,
+        )
+
+        with hold_title_locks(
+            fp, title_lock_paths(fp, name, year, output_root=options.output_root)
+        ):
+            process_title(fp, input_type, raw_name, name, year, options=options)
+
+        logger.info("Done!")
+
+
+def _audit(flags: CLIFlags, raw_paths: list[str]):
+    roots = [Path(p).absolute() for p in raw_paths]
+    for root in roots:
+        if not root.is_dir():
+            raise CommandError(f"Library folder does not exist: {root}")
+
+    state = AuditState(flags.audit)
+    report = audit_library(roots, state=state, jobs=max(flags.jobs, 1))
+    state.save(roots)
+
+    log_audit_report(report)
+
+    if report.issues:
+        sys.exit(1)
 
-    if input_type == InputType.MOVIE_WITHOUT_FOLDER:
-        process_movie_without_folder(fp, name, year, new_stem)
 
-    if input_type == InputType.FOLDER_WITH_MOVIE:
-        process_movie_inside_folder(fp, name, year, new_stem)
+def main():
+    flags, raw_paths = parse_args()
 
-    if input_type == InputType.FOLDER_WITH_SHOW_SEASONS:
-        process_show(fp, raw_name, name, year, new_stem)
+    setup_logging(verbose=flags.verbose)
 
-    logger.info("Done!")
+    run(flags, raw_paths)
 
 
 if __name__ == "__main__":
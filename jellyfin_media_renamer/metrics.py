@@ -0,0 +1,198 @@
+import bisect
+import contextlib
+import contextvars
+import heapq
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+# Upper bounds of the latency buckets in seconds, from a cached directory listing to a NAS
+# that has to spin up its disks
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+# How many of the slowest calls of each stage are remembered, along with what they worked on
+SLOWEST = 5
+
+_PROMETHEUS_PREFIX = "jellyfin_media_renamer"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # (seconds, subject) min-heap, so the fastest of the slowest is dropped first
+        self.slowest: list[tuple[float, str]] = []
+
+    def observe(self, seconds: float, subject: str | None):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+        if subject is not None:
+            if len(self.slowest) < SLOWEST:
+                heapq.heappush(self.slowest, (seconds, subject))
+            elif seconds > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (seconds, subject))
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile as the upper bound of the bucket it falls in"""
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+
+class Metrics:
+    """Counters and latency histograms for each stage of a run"""
+
+    def __init__(self):
+        self.counters: dict[str, int] = {}
+        self.stages: dict[str, Histogram] = {}
+        # Batch mode runs stages on worker threads
+        self._lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, stage: str, seconds: float, subject: str | None = None):
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds, subject)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "stages": {
+                    name: {
+                        "count": h.count,
+                        "total_seconds": h.total,
+                        "max_seconds": h.max,
+                        "p50_seconds": h.quantile(0.5),
+                        "p95_seconds": h.quantile(0.95),
+                        "buckets": dict(
+                            zip([*map(str, BUCKETS), "+Inf"], h.counts, strict=True)
+                        ),
+                        "slowest": [
+                            {"seconds": s, "subject": subject}
+                            for s, subject in sorted(h.slowest, reverse=True)
+                        ],
+                    }
+                    for name, h in sorted(self.stages.items())
+                },
+            }
+
+    def log_lines(self) -> list[str]:
+        """A human readable summary, one line per stage and counter"""
+
+        lines = []
+        for name, stage in self.summary()["stages"].items():
+            lines.append(
+                f"\t{name:<20} {stage['count']:>6} calls  {stage['total_seconds']:8.3f}s total"
+                f"  p50 {stage['p50_seconds'] * 1000:8.2f}ms  p95 {stage['p95_seconds'] * 1000:8.2f}ms"
+                f"  max {stage['max_seconds'] * 1000:8.2f}ms"
+            )
+            if stage["slowest"]:
+                slowest = stage["slowest"][0]
+                lines.append(
+                    f"\t{'':<20} slowest: {slowest['subject']} ({slowest['seconds'] * 1000:.2f}ms)"
+                )
+
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"\t{name:<20} {value:>6}")
+
+        return lines
+
+    def prometheus_text(self) -> str:
+        """The metrics in the Prometheus text format, as read by node_exporter's textfile
+        collector"""
+
+        summary = self.summary()
+        stage_metric = f"{_PROMETHEUS_PREFIX}_stage_seconds"
+        counter_metric = f"{_PROMETHEUS_PREFIX}_events_total"
+
+        lines = [
+            f"# HELP {stage_metric} Time spent in each stage of the last run.",
+            f"# TYPE {stage_metric} histogram",
+        ]
+        for name, stage in summary["stages"].items():
+            cumulative = 0
+            for bound, count in stage["buckets"].items():
+                cumulative += count
+                lines.append(
+                    f'{stage_metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'{stage_metric}_sum{{stage="{name}"}} {stage["total_seconds"]}'
+            )
+            lines.append(f'{stage_metric}_count{{stage="{name}"}} {stage["count"]}')
+
+        lines += [
+            f"# HELP {counter_metric} Number of events of each kind in the last run.",
+            f"# TYPE {counter_metric} counter",
+        ]
+        for name, value in summary["counters"].items():
+            lines.append(f'{counter_metric}{{event="{name}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+
+def _write_atomically(path: Path, text: str):
+    # The textfile collector may read the file at any time, so it's replaced in one go
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
+
+
+def write_summary(metrics: Metrics, path: Path):
+    _write_atomically(path, json.dumps(metrics.summary(), indent=2) + "\n")
+
+
+def write_prometheus_textfile(metrics: Metrics, path: Path):
+    _write_atomically(path, metrics.prometheus_text())
+
+
+# Set for the duration of a run with --profile, batch workers and server jobs get their own copy
+# of the context so each run collects its own metrics
+current_metrics: contextvars.ContextVar[Metrics | None] = contextvars.ContextVar(
+    "current_metrics", default=None
+)
+
+
+@contextlib.contextmanager
+def timed(stage: str, subject: object = None) -> Iterator[None]:
+    """Records how long the block takes under stage, subject (e.g. a path) is remembered if it's
+    one of the slowest"""
+
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe(
+            stage,
+            time.perf_counter() - start,
+            None if subject is None else str(subject),
+        )
+
+
+def count(name: str, n: int = 1):
+    if (metrics := current_metrics.get()) is not None:
+        metrics.count(name, n)
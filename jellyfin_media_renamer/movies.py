@@ -5,23 +5,65 @@ from jellyfin_media_renamer.common import (
     SUBTITLES_FILE_EXTS,
     VIDEO_FILE_EXTS,
     CommandError,
-    infer_name_and_year,
-    purge_extra_files,
 )
+from jellyfin_media_renamer.fs import scan_dir
+from jellyfin_media_renamer.parsing import parse_name_and_year
+from jellyfin_media_renamer.plan import (
+    Plan,
+    PlanBuilder,
+    apply_plan,
+    confirm_deletes,
+    plan_purge_extra_files,
+)
+from jellyfin_media_renamer.probe import probe
 
 logger = logging.getLogger(__name__)
 
+# Videos shorter than this fraction of the feature's length are deleted as samples or trailers,
+# otherwise Jellyfin lists them as other versions of the movie
+SAMPLE_MAX_FRACTION = 0.25
 
-def process_movie_without_folder(fp: Path, name: str, year: int, new_stem: str):
-    folder = fp.parent / new_stem
-    folder.mkdir()
-    fp.rename(folder / fp.with_name(new_stem).with_suffix(fp.suffixes[-1]).name)
 
+def plan_movie_without_folder(fp: Path, name: str, year: int, new_stem: str) -> Plan:
+    plan = PlanBuilder()
+
+    folder = plan.mkdir(fp.parent / new_stem)
+    plan.rename(fp, folder / fp.with_name(new_stem).with_suffix(fp.suffixes[-1]).name)
+
+    return plan.build()
+
+
+def find_feature(video_files: set[Path]) -> tuple[Path, set[Path]] | None:
+    """Picks the longest video by probing their headers, returning it along with the samples and
+    trailers among the others. Returns None unless every video could be probed, since any of the
+    others could be longer."""
+
+    infos = {f: probe(f) for f in video_files}
+    if not all(info and info.duration for info in infos.values()):
+        return None
+
+    feature = max(video_files, key=lambda f: (infos[f].duration, infos[f].pixels, f))
+
+    samples: set[Path] = set()
+    for file in sorted(video_files - {feature}):
+        logger.debug(
+            f"Passing over {file.name!r} ({infos[file].duration:.0f}s), "
+            f"{feature.name!r} is longer ({infos[feature].duration:.0f}s)"
+        )
+
+        # Anything close to the feature's length is more likely another cut of it than a sample
+        if infos[file].duration < infos[feature].duration * SAMPLE_MAX_FRACTION:
+            samples.add(file)
+
+    return feature, samples
 
-def process_movie_inside_folder(fp: Path, name: str, year: int, new_stem: str):
-    fp = fp.rename(fp.with_name(new_stem))
 
-    sub_objs = {f for f in fp.iterdir() if f.is_file()}
+def plan_movie_inside_folder(fp: Path, name: str, year: int, new_stem: str) -> Plan:
+    plan = PlanBuilder()
+
+    folder = plan.rename(fp, fp.with_name(new_stem))
+
+    sub_objs = set(scan_dir(fp).files)
     video_files = {
         f
         for f in sub_objs
@@ -37,11 +79,15 @@ def process_movie_inside_folder(fp: Path, name: str, year: int, new_stem: str):
 
     # Sometimes torrents include a preview or some message from the uploader
     primary_video_file: Path | None = None
+    samples: set[Path] = set()
     if len(video_files) == 1:
         primary_video_file = next(iter(video_files))
-    else:
+    elif found := find_feature(video_files):
+        primary_video_file, samples = found
+
+    if primary_video_file is None:
         for file in video_files:
-            _, test_name, _ = infer_name_and_year(file)
+            _, test_name, _ = parse_name_and_year(file.name, is_file=True)
             if test_name.upper() == name.upper():
                 primary_video_file = file
                 break
@@ -49,10 +95,12 @@ def process_movie_inside_folder(fp: Path, name: str, year: int, new_stem: str):
     if primary_video_file is None:
         raise CommandError(f"Unable to determine movie file inside path: {fp}")
 
-    primary_video_file.rename(
-        primary_video_file.with_name(new_stem).with_suffix(
-            primary_video_file.suffixes[-1]
-        )
+    plan.rename(
+        folder / primary_video_file.name,
+        folder
+        / primary_video_file.with_name(new_stem)
+        .with_suffix(primary_video_file.suffixes[-1])
+        .name,
     )
 
     primary_subtitles_file: Path | None = None
@@ -60,14 +108,17 @@ def process_movie_inside_folder(fp: Path, name: str, year: int, new_stem: str):
         primary_subtitles_file = next(iter(subtitle_files))
     else:
         for file in subtitle_files:
-            _, test_name, _ = infer_name_and_year(file)
+            _, test_name, _ = parse_name_and_year(file.name, is_file=True)
             if test_name.upper() == name.upper():
                 primary_subtitles_file = file
                 break
 
     if primary_subtitles_file:
-        primary_subtitles_file.rename(
-            primary_subtitles_file.with_name(new_stem).with_suffix(
+        plan.rename(
+            folder / primary_subtitles_file.name,
+            folder
+            / primary_subtitles_file.with_name(new_stem)
+            .with_suffix(
                 "."
                 + ".".join(
                     [
@@ -77,8 +128,21 @@ def process_movie_inside_folder(fp: Path, name: str, year: int, new_stem: str):
                     ]
                 ).lower()
             )
+            .name,
         )
     elif len(subtitle_files):
         logger.warning("Couldn't determine primary subtitles file :/")
 
-    purge_extra_files(fp)
+    plan.extend(plan_purge_extra_files(fp, folder))
+    for file in sorted(samples):
+        plan.delete(folder / file.name)
+
+    return plan.build()
+
+
+def process_movie_without_folder(fp: Path, name: str, year: int, new_stem: str):
+    apply_plan(plan_movie_without_folder(fp, name, year, new_stem))
+
+
+def process_movie_inside_folder(fp: Path, name: str, year: int, new_stem: str):
+    apply_plan(confirm_deletes(plan_movie_inside_folder(fp, name, year, new_stem)))
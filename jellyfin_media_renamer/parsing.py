@@ -0,0 +1,605 @@
+import contextvars
+import dataclasses
+import functools
+import logging
+import os
+import re
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+from jellyfin_media_renamer.cache import ParseCache
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a parser change alters results, so stale entries in the on-disk cache get dropped
+PARSER_VERSION = 5
+
+# How much CPU time parsing a single name may take, so that a hostile or junk name fails on its own
+# instead of holding up the rest of the batch. The patterns below run in linear time, so this is
+# checked between them rather than interrupting one. It's measured on the parsing thread's own
+# clock, time spent waiting for the GIL while other workers parse doesn't count.
+PARSE_TIME_BUDGET = 0.05
+
+# Set for the duration of a run with --cache, server jobs get their own copy of the context so each
+# job only uses the cache it asked for
+current_parse_cache: contextvars.ContextVar[ParseCache | None] = contextvars.ContextVar(
+    "current_parse_cache", default=None
+)
+
+_TAGS_RE = re.compile(r"(\[[a-zA-Z0-9\-_\+\.\s\$\#\@\!]+\])")  # Tags like [1080p]
+
+_PAREN_YEAR_RE = re.compile(r"\(\s?([0-9]{4})\s?\)")
+_BARE_YEAR_RE = re.compile(r"((?:19|20)[0-9]{2})")
+
+# Junk patterns are (pattern, lowercase text every match contains) pairs, so they can be skipped
+# for names that can't match, see _strip_junk()
+_NAME_JUNK_RES = tuple(
+    (re.compile(pattern, re.IGNORECASE), literal)
+    for pattern, literal in [
+        (r"((?:www)?\.?UIndex\.org\s*-?\s*)", "uindex.org"),  # www.UIndex.org -
+        (r"((?:www)?\.?Torrenting\.com\s*-?\s*)", "torrenting.com"),  # www.UIndex.org -
+        (
+            r"((?:-|_|\.|\s)?WEB(?:-|_|\.|\s)DL(?:-|_|\.|\s)?)"  # WEB-Dl
+            r"((?:-|_|\.|\s)?DVD(?:-|_|\.|\s)?RIP(?:-|_|\.|\s)?)",  # DVDRIP
+            "dvd",
+        ),
+    ]
+)
+
+# Only matched from the first dot of a run, else every dot of a run not followed by a word would
+# try the rest of it again
+_DOTS_RE = re.compile(r"(?<!\.)\.+(\w+)")
+
+# Episode number patterns that don't depend on the season, the season specific ones are compiled
+# per season by episode_patterns()
+_EPISODE_WORD_RE = re.compile(
+    r"episode(\s|\.|-)?(?P<ep_start>\d+)(?:-(?P<ep_end>\d+))?", re.IGNORECASE
+)  # Episode 01
+# Episode numbers in the middle of a chain like E01E02E03 aren't tried as the start of a match, a
+# match starting there could only end where one starting at the first would have, and trying
+# every one of them is quadratic in the length of the chain
+_SXXEXX_RE = re.compile(
+    r"(?:S\d{1,2})?(?<!E\d)(?<!E\d\d)(?<!E\d\d\d)(?<!E\d-)(?<!E\d\d-)(?<!E\d\d\d-)"
+    r"((?:E(?P<ep_start>\d{1,3}))(?:-?E(?P<ep_end>\d{1,3}))*(?P<parts>(?:abcd)|(?:abc)|(?:ab)|(?:a))?)(?:\s|-|$|_|\.|\()",
+    re.IGNORECASE,
+)  # S01E01 or S01E01E02E03
+_EP_RE = re.compile(r"ep(?P<ep_start>\d{1,3})", re.IGNORECASE)  # Ep01
+_BARE_EP_RE = re.compile(
+    r"(?:^|\s|\.|_|-)(?P<ep_start>\d\d\d?)(?:\s|\.|$|_|-)", re.IGNORECASE
+)  # 01 or 155
+
+_EP_PART_RES = tuple(
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in [
+        r"(?:(?:parts)|(?:part)|(?:pt))(?:\s|\.|-|_)*(?P<p_start>[a-dA-D1-9])(?:-(?P<p_end>[a-dA-D1-9]))?(?:\s|\.|-|_|$)",
+    ]
+)
+
+_EP_YEAR_RE = re.compile(r"((?:\(|\[|\s|-|\.)\d{4}(?:\)|\]|\s|-|\.))")
+# Where a "(1080p ...)" group starts, it runs to the last ")" on the line, see
+# _strip_resolution_group()
+_EP_RESOLUTION_GROUP_RE = re.compile(
+    r"\((?:(?:1080)|(?:480)|(?:720)|(?:2160))p", re.IGNORECASE
+)
+_EP_NAME_JUNK_RES = tuple(
+    (re.compile(pattern, re.IGNORECASE), literal)
+    for pattern, literal in [
+        (r"((?:www)?\.?UIndex\.org\s*-?\s*)", "uindex.org"),  # www.UIndex.org -
+        (
+            r"((?:-|_|\.|\s)?WEB(?:-|_|\.|\s)DL(?:-|_|\.|\s)?)"  # WEB-Dl
+            r"((?:-|_|\.|\s)?DVD(?:-|_|\.|\s)?RIP(?:-|_|\.|\s)?)",  # DVDRIP
+            "dvd",
+        ),
+    ]
+)
+
+_EP_RESOLUTION_RE = re.compile(
+    r"(:?\.|\s)(?:1080|480|720|2160)p(:?\.|\s)", re.IGNORECASE
+)
+_COMMA_DOT_RE = re.compile(r"(,\.)([A-Za-z])")
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class EpisodeInfo:
+    numbers: list[int]
+    name: str | None
+    parts: str | None
+    # How much the episode number pattern that matched can be trusted, from 0 to 1
+    confidence: float = dataclasses.field(default=1.0, compare=False)
+
+
+class ParseTimeout(Exception):
+    def __init__(self, filename: str):
+        super().__init__(
+            f"Gave up parsing {filename!r}, it took longer than {PARSE_TIME_BUDGET * 1000:.0f}ms"
+        )
+        self.filename = filename
+
+
+class _Deadline:
+    """When parsing a name has to be done by, in CPU time of the thread parsing it"""
+
+    __slots__ = ("at", "filename")
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.at = time.thread_time() + PARSE_TIME_BUDGET
+
+    def check(self):
+        if time.thread_time() > self.at:
+            raise ParseTimeout(self.filename)
+
+
+def split_suffix(filename: str) -> tuple[str, str]:
+    """Splits a filename into (stem, suffix) the same way pathlib does"""
+
+    idx = filename.rfind(".")
+    if 0 < idx < len(filename) - 1:
+        return filename[:idx], filename[idx:]
+
+    return filename, ""
+
+
+def strip_tags(text: str) -> str:
+    return _TAGS_RE.sub("", text)
+
+
+def _lowered(text: str) -> str | None:
+    """Returns text in lowercase for matching literals against, or None if literals can't be
+    trusted because case insensitive regex matching of non-ASCII text doesn't map onto lower()"""
+
+    return text.lower() if text.isascii() else None
+
+
+def _may_match(literal: str | None, lowered: str | None) -> bool:
+    return literal is None or lowered is None or literal in lowered
+
+
+def _strip_junk(
+    name: str, patterns: tuple[tuple[re.Pattern[str], str | None], ...]
+) -> str:
+    """Removes the first match of each junk pattern from name, in order"""
+
+    lowered = _lowered(name)
+    for pattern, literal in patterns:
+        if _may_match(literal, lowered):
+            name = pattern.sub("", name, count=1)
+            lowered = _lowered(name)
+
+    return name
+
+
+def _strip_resolution_group(name: str) -> str:
+    """Removes the first "(1080p ...)" group from name, from its "(1080p" to the last ")" after it
+    on the same line. A pattern ending in ".*" followed by ")" matches the same, but searches to the
+    end of the line again from every "(1080p" that has no ")" after it."""
+
+    start = 0
+    while match := _EP_RESOLUTION_GROUP_RE.search(name, start):
+        line_end = name.find("\n", match.end())
+        if line_end == -1:
+            line_end = len(name)
+
+        end = name.rfind(")", match.end(), line_end)
+        if end != -1:
+            return name[: match.start()] + name[end + 1 :]
+
+        # No later "(1080p" on this line has a ")" after it either
+        start = line_end
+
+    return name
+
+
+def parse_name_and_year(filename: str, *, is_file: bool) -> tuple[str, str, int | None]:
+    """Infers (raw name, clean name, year) from a file or folder name, raises ParseTimeout if that
+    takes longer than PARSE_TIME_BUDGET"""
+
+    return parse_names_and_years([filename], is_file=is_file)[0]
+
+
+def _parse_name_and_year(
+    filename: str, *, is_file: bool
+) -> tuple[str, str, int | None]:
+    deadline = _Deadline(filename)
+
+    name = filename
+    if is_file:
+        name = split_suffix(filename)[0]
+
+    # Find the year and split the title by it (we don't care for tags/junk after the year)
+    year = _PAREN_YEAR_RE.search(filename)
+    if year:
+        raw_name = strip_tags(name).strip()
+        name = name.split(year.group())[0]
+        year = int(year.group(1))
+    else:
+        # Try and find the year if it's not in ()
+        year = _BARE_YEAR_RE.search(filename)
+        if year:
+            year = year.group()
+        raw_name = strip_tags(name).strip()
+        if year:
+            name = name.split(str(year))[0]
+            year = int(year)
+
+    deadline.check()
+    name = _strip_junk(name, _NAME_JUNK_RES)
+    deadline.check()
+
+    for resolution in ("720p", "1080p", "2160p"):
+        if f"{resolution} " in name:
+            name = name.split(resolution)[0]
+            break
+
+    name = _DOTS_RE.sub(r" \1", name)  # Replace dots with spaces
+    name = strip_tags(name)
+    deadline.check()
+
+    return raw_name.strip(" ."), name.strip(" ."), year
+
+
+def score_name_and_year(filename: str, *, is_file: bool) -> float:
+    """Rates how trustworthy parse_name_and_year's result for filename is, from 0 to 1"""
+
+    _, name, year = parse_name_and_year(filename, is_file=is_file)
+    if not name:
+        return 0.0
+
+    if _PAREN_YEAR_RE.search(filename):
+        confidence = 1.0
+    elif year:
+        confidence = 0.9
+    else:
+        confidence = 0.7
+
+    # Keeping very little of the original name means a lot of guesswork went into stripping junk
+    stem = split_suffix(filename)[0] if is_file else filename
+    kept = len(name) / len(stem)
+    if kept < 0.25:
+        confidence -= 0.25 - kept
+
+    # Leftover brackets or underscores mean some junk wasn't recognized
+    if any(c in name for c in "[]()_"):
+        confidence -= 0.2
+
+    return round(max(confidence, 0.0), 2)
+
+
+def parse_names_and_years(
+    filenames: Iterable[str], *, is_file: bool
+) -> list[tuple[str, str, int | None]]:
+    filenames = list(filenames)
+
+    parse_cache = current_parse_cache.get()
+    if parse_cache is None:
+        return [_parse_name_and_year(f, is_file=is_file) for f in filenames]
+
+    kind = "name_and_year/file" if is_file else "name_and_year/folder"
+    cached = parse_cache.get_many(kind, filenames)
+
+    results: list[tuple[str, str, int | None]] = []
+    misses: dict[str, tuple[str, str, int | None]] = {}
+    for filename in filenames:
+        if filename in cached:
+            results.append(tuple(cached[filename]))
+        else:
+            result = misses.get(filename) or _parse_name_and_year(
+                filename, is_file=is_file
+            )
+            misses[filename] = result
+            results.append(result)
+
+    parse_cache.put_many(kind, misses)
+
+    return results
+
+
+@dataclass(frozen=True, slots=True)
+class EpisodePatterns:
+    """The compiled patterns needed to parse the episodes of one show's season"""
+
+    # (pattern, confidence, lowercase text every match contains) triples, tried in order
+    ep_number: tuple[tuple[re.Pattern[str], float, str | None], ...]
+    show_name: tuple[re.Pattern[str], ...]
+
+
+@functools.lru_cache(maxsize=256)
+def episode_patterns(
+    raw_show_name: str, show_name: str, season: int
+) -> EpisodePatterns:
+    return EpisodePatterns(
+        ep_number=(
+            (_EPISODE_WORD_RE, 0.95, "episode"),
+            (_SXXEXX_RE, 1.0, None),
+            (_EP_RE, 0.8, "ep"),
+            (
+                re.compile(
+                    rf"{season}x(?P<ep_start>\d{{1,3}})(?:\s|$|\.|\[|\(|\,|_|-)",
+                    re.IGNORECASE,
+                ),  # {season}x01
+                0.9,
+                f"{season}x",
+            ),
+            (
+                re.compile(
+                    rf"(?:^|\s|\.){season}(?P<ep_start>\d{{2,3}})(?:\s|\.|$|_|-)",
+                    re.IGNORECASE,
+                ),  # {season}01
+                0.6,
+                None,
+            ),
+            (_BARE_EP_RE, 0.5, None),
+        ),
+        show_name=(
+            re.compile(re.escape(raw_show_name), re.IGNORECASE),
+            re.compile(re.escape(show_name), re.IGNORECASE),
+        ),
+    )
+
+
+def parse_episode_info(
+    filename: str,
+    raw_show_name: str,
+    show_name: str,
+    year: int | None,
+    season: int,
+) -> EpisodeInfo | None:
+    """Infers the episode number(s), name and parts from an episode's filename, returns None if no
+    episode number could be found"""
+
+    return parse_episodes([filename], raw_show_name, show_name, year, season)[0]
+
+
+@dataclass(frozen=True, slots=True)
+class SeasonBoilerplate:
+    """Text that every filename in a season folder starts and ends with, like the show name, group
+    tags and resolution"""
+
+    prefix: str = ""
+    suffix: str = ""
+    # Whether the prefix includes the show's name, so it doesn't need to be searched for again
+    has_show_name: bool = False
+
+
+_NO_BOILERPLATE = SeasonBoilerplate()
+
+# Characters that separate the words of release names
+_SEPARATORS = frozenset(" ._-[]()")
+
+
+def _prefix_end(prefix: str) -> int:
+    """Returns where prefix should be cut, so it ends on a separator outside of any brackets
+    instead of in the middle of a word or tag (like the episode number)"""
+
+    depth = 0
+    end = 0
+    for i, c in enumerate(prefix):
+        if c in "[(":
+            depth += 1
+        elif c in "])":
+            depth = max(depth - 1, 0)
+
+        if depth == 0 and c in _SEPARATORS:
+            end = i + 1
+
+    return end
+
+
+def _suffix_start(suffix: str) -> int:
+    """Returns where suffix should start, which is the first bracket from which all brackets to
+    the end are balanced, so a last word the episode names happen to share is left alone"""
+
+    start = len(suffix)
+    depth = 0
+    for i in range(len(suffix) - 1, -1, -1):
+        c = suffix[i]
+        if c in "])":
+            depth += 1
+        elif c in "[(":
+            depth -= 1
+            if depth < 0:
+                break
+            if depth == 0:
+                start = i
+
+    return start
+
+
+def season_boilerplate(filenames: list[str], *show_names: str) -> SeasonBoilerplate:
+    """Finds the boilerplate shared by the filenames of one season folder, in linear time"""
+
+    if len(filenames) < 2:
+        return _NO_BOILERPLATE
+
+    prefix = os.path.commonprefix(filenames)
+    prefix = prefix[: _prefix_end(prefix)]
+    suffix = os.path.commonprefix([f[::-1] for f in filenames])[::-1]
+    suffix = suffix[_suffix_start(suffix) :]
+
+    lowered = _lowered(prefix)
+
+    return SeasonBoilerplate(
+        prefix=prefix,
+        suffix=suffix,
+        has_show_name=lowered is not None
+        and any(name.lower() in lowered for name in show_names if name),
+    )
+
+
+def _parse_episode_info(
+    filename: str,
+    patterns: EpisodePatterns,
+    boilerplate: SeasonBoilerplate = _NO_BOILERPLATE,
+) -> EpisodeInfo | None:
+    deadline = _Deadline(filename)
+
+    ep_start: int | None = None
+    ep_end: int | None = None
+    parts: str | None = None
+
+    confidence = 0.0
+
+    # Most names only contain the text one or two of the patterns need, checking for it first
+    # skips searching with the others
+    lowered = _lowered(filename)
+
+    match: re.Match[str] | None = None
+    for pattern, confidence, literal in patterns.ep_number:
+        deadline.check()
+        if _may_match(literal, lowered) and (match := pattern.search(filename)):
+            ep_start = int(match.group("ep_start").strip())
+            ep_end = int((match.groupdict().get("ep_end") or "").strip() or -1)
+            if ep_end == -1:
+                ep_end = None
+
+            try:
+                parts = (match.group("parts") or "").strip()
+            except IndexError:
+                pass
+
+            break
+
+    if ep_start is None:
+        return None
+
+    # Only the part that differs between the season's files can contain the episode's name, as
+    # long as the boilerplate doesn't overlap the episode number
+    start = 0
+    if len(boilerplate.prefix) <= match.start():
+        start = len(boilerplate.prefix)
+
+    end = len(split_suffix(filename)[0])
+    if boilerplate.suffix and len(filename) - len(boilerplate.suffix) >= match.end():
+        end = len(filename) - len(boilerplate.suffix)
+
+    name = filename[start:end]
+
+    for pattern in _EP_PART_RES:
+        if part_match := pattern.search(filename):
+            name = name.replace(part_match.group(), "")
+            part_match_dict = part_match.groupdict()
+            parts = "-".join(
+                filter(
+                    None,
+                    map(
+                        str.strip,
+                        [
+                            part_match_dict.get("p_start") or "",
+                            part_match_dict.get("p_end") or "",
+                        ],
+                    ),
+                )
+            )
+            break
+
+    deadline.check()
+    if not (start and boilerplate.has_show_name):
+        for pattern in patterns.show_name:
+            name = pattern.sub("", name)
+    name = strip_tags(name.strip())
+    full_group = match.group().rstrip(". ")
+    if not full_group.isnumeric():
+        name = name.replace(full_group, "", 1)  # Remove ep number
+
+    name = _EP_YEAR_RE.sub("", name, count=1)
+    name = _strip_resolution_group(name)
+    name = _strip_junk(name, _EP_NAME_JUNK_RES)
+    deadline.check()
+
+    for match in _EP_RESOLUTION_RE.finditer(name):
+        name = name.split(match.group())[0]
+
+    name = _COMMA_DOT_RE.sub(r", \2", name)
+
+    name = name.strip(",.-_ ")
+    parts = (parts or "").strip(",.-_ ")
+
+    if not (parts.isalpha() or parts.isnumeric()):
+        parts = None
+
+    return EpisodeInfo(
+        numbers=list(range(ep_start, (ep_end or ep_start) + 1)),
+        name=name or None,
+        parts=parts or None,
+        confidence=confidence,
+    )
+
+
+def _parse_episode_info_in_budget(
+    filename: str, patterns: EpisodePatterns, boilerplate: SeasonBoilerplate
+) -> EpisodeInfo | None:
+    try:
+        return _parse_episode_info(filename, patterns, boilerplate)
+    except ParseTimeout as e:
+        logger.warning(e)
+        return None
+
+
+def parse_episodes(
+    filenames: Iterable[str],
+    raw_show_name: str,
+    show_name: str,
+    year: int | None,
+    season: int,
+) -> list[EpisodeInfo | None]:
+    """Parses many episode filenames from the same show and season, returning one result per name
+    in the same order (None for names without an episode number, or that took too long to
+    parse)"""
+
+    filenames = list(filenames)
+    boilerplate = season_boilerplate(filenames, raw_show_name, show_name)
+
+    parse_cache = current_parse_cache.get()
+    if parse_cache is None:
+        patterns = episode_patterns(raw_show_name, show_name, season)
+        return [
+            _parse_episode_info_in_budget(filename, patterns, boilerplate)
+            for filename in filenames
+        ]
+
+    def cache_key(filename: str) -> str:
+        return "\0".join(
+            (
+                filename,
+                raw_show_name,
+                show_name,
+                str(season),
+                boilerplate.prefix,
+                boilerplate.suffix,
+            )
+        )
+
+    cached = parse_cache.get_many("episode", map(cache_key, filenames))
+
+    results: list[EpisodeInfo | None] = []
+    misses: dict[str, EpisodeInfo | None] = {}
+    # Whether a name runs out of time depends on the machine, so that isn't cached
+    timed_out: set[str] = set()
+    for filename in filenames:
+        key = cache_key(filename)
+        if key in cached:
+            results.append(cached[key] and EpisodeInfo(**cached[key]))
+            continue
+
+        if key not in misses:
+            # Patterns are only compiled if something actually needs parsing
+            patterns = episode_patterns(raw_show_name, show_name, season)
+            try:
+                misses[key] = _parse_episode_info(filename, patterns, boilerplate)
+            except ParseTimeout as e:
+                logger.warning(e)
+                misses[key] = None
+                timed_out.add(key)
+        results.append(misses[key])
+
+    parse_cache.put_many(
+        "episode",
+        {
+            key: info and dataclasses.asdict(info)
+            for key, info in misses.items()
+            if key not in timed_out
+        },
+    )
+
+    return results
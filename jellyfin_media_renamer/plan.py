@@ -0,0 +1,553 @@
+import contextvars
+import dataclasses
+import heapq
+import logging
+import os
+import threading
+from collections.abc import Callable, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from jellyfin_media_renamer.common import CommandError, confirm_purge, find_extra_files
+from jellyfin_media_renamer.events import emit
+from jellyfin_media_renamer.fs import invalidate, link_file
+from jellyfin_media_renamer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# How many ops of a plan may be applied at once, on network storage most of a rename is waiting
+DEFAULT_IO_JOBS = 4
+# How many ops may be applied at once on each filesystem, whichever plans they belong to
+DEFAULT_DEVICE_JOBS = 4
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class RenameOp:
+    src: Path
+    dst: Path
+
+    def __str__(self) -> str:
+        return f"rename {self.src} -> {self.dst}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class MkdirOp:
+    path: Path
+    exist_ok: bool = False
+
+    def __str__(self) -> str:
+        return f"mkdir {self.path}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class LinkOp:
+    """Hardlinks (or failing that, clones) src to dst"""
+
+    src: Path
+    dst: Path
+
+    def __str__(self) -> str:
+        return f"link {self.src} -> {self.dst}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class DeleteOp:
+    path: Path
+    # The copy that's kept, when this deletes a duplicate of it rather than an extra file
+    duplicate_of: Path | None = dataclasses.field(default=None, compare=False)
+
+    def __str__(self) -> str:
+        if self.duplicate_of is not None:
+            return f"delete {self.path} (duplicate of {self.duplicate_of.name})"
+        return f"delete {self.path}"
+
+
+Op = RenameOp | MkdirOp | LinkOp | DeleteOp
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Plan:
+    """An ordered list of filesystem operations, each path is as it will be when that op runs"""
+
+    ops: tuple[Op, ...] = ()
+    # The lowest confidence of any parse result this plan was derived from
+    confidence: float = 1.0
+
+    def __add__(self, other: "Plan") -> "Plan":
+        return Plan(self.ops + other.ops, min(self.confidence, other.confidence))
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    @property
+    def deletes(self) -> tuple[DeleteOp, ...]:
+        return tuple(op for op in self.ops if isinstance(op, DeleteOp))
+
+
+class PlanBuilder:
+    """Mutable helper used by the planners to assemble a Plan"""
+
+    def __init__(self):
+        self._ops: list[Op] = []
+        self._confidence = 1.0
+
+    def rename(self, src: Path, dst: Path) -> Path:
+        if src != dst:
+            self._ops.append(RenameOp(src, dst))
+        return dst
+
+    def mkdir(self, path: Path, *, exist_ok: bool = False) -> Path:
+        self._ops.append(MkdirOp(path, exist_ok))
+        return path
+
+    def link(self, src: Path, dst: Path) -> Path:
+        self._ops.append(LinkOp(src, dst))
+        return dst
+
+    def delete(self, path: Path, *, duplicate_of: Path | None = None):
+        self._ops.append(DeleteOp(path, duplicate_of))
+
+    def note_confidence(self, confidence: float):
+        self._confidence = min(self._confidence, confidence)
+
+    def extend(self, plan: Plan):
+        self._ops.extend(plan.ops)
+        self.note_confidence(plan.confidence)
+
+    def build(self) -> Plan:
+        return Plan(tuple(self._ops), self._confidence)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Conflict:
+    op: RenameOp | MkdirOp | LinkOp
+    # The op planned earlier in the run with the same destination, None if it already exists
+    other: Op | None = None
+
+    def __str__(self) -> str:
+        if self.other is not None:
+            return f"{self.op} collides with {self.other}"
+
+        return f"{self.op} would replace an existing file"
+
+
+def _destination(op: Op) -> Path | None:
+    if isinstance(op, (RenameOp, LinkOp)):
+        return op.dst
+    if isinstance(op, MkdirOp) and not op.exist_ok:
+        return op.path
+
+    return None
+
+
+def _is_same_file(op: Op, on_disk: Callable[[Path], Path], current: Path) -> bool:
+    """Whether a rename only changes the case of a name on a case-insensitive filesystem"""
+
+    if not isinstance(op, RenameOp):
+        return False
+
+    src = on_disk(op.src)
+    return os.path.lexists(src) and os.path.samefile(src, current)
+
+
+class DestinationIndex:
+    """Every destination planned so far in a run, so each plan can be checked against the others
+    and the filesystem before anything is touched"""
+
+    def __init__(self):
+        self._claimed: dict[Path, Op] = {}
+        self._lock = threading.Lock()
+
+    def _find_conflicts(self, plan: Plan) -> list[Conflict]:
+        conflicts: list[Conflict] = []
+
+        planned: dict[Path, Op] = {}
+        # Paths in a plan are as they will be when each op runs, so paths under a renamed folder
+        # are mapped back to where they are right now before looking at the filesystem
+        origins: dict[Path, Path] = {}
+        vacated: set[Path] = set()
+
+        def on_disk(path: Path) -> Path:
+            for folder in (path, *path.parents):
+                if folder in origins:
+                    return origins[folder] / path.relative_to(folder)
+            return path
+
+        for op in plan.ops:
+            if isinstance(op, (RenameOp, DeleteOp)):
+                src = op.src if isinstance(op, RenameOp) else op.path
+                planned.pop(src.absolute(), None)
+                vacated.add(on_disk(src).absolute())
+
+            dst = _destination(op)
+            if dst is None:
+                continue
+
+            key = dst.absolute()
+            current = on_disk(dst).absolute()
+            other = planned.get(key) or self._claimed.get(key)
+            if other is not None:
+                conflicts.append(Conflict(op, other))
+            elif (
+                current not in vacated
+                and os.path.lexists(current)
+                and not _is_same_file(op, on_disk, current)
+            ):
+                conflicts.append(Conflict(op))
+
+            planned[key] = op
+            if isinstance(op, RenameOp):
+                origins[dst] = on_disk(op.src)
+
+        return conflicts
+
+    def claim(self, plan: Plan) -> list[Conflict]:
+        """Returns every conflict in the plan, if there are none its destinations are claimed so
+        later plans in the run can't reuse them"""
+
+        with self._lock:
+            conflicts = self._find_conflicts(plan)
+            if not conflicts:
+                for op in plan.ops:
+                    if (dst := _destination(op)) is not None:
+                        self._claimed[dst.absolute()] = op
+
+        return conflicts
+
+
+def validate_plan(plan: Plan, index: DestinationIndex | None = None):
+    """Raises a CommandError listing every rename, mkdir or link that would collide with another
+    one or replace an existing file"""
+
+    conflicts = (index or DestinationIndex()).claim(plan)
+    if conflicts:
+        raise CommandError(
+            f"Found {len(conflicts)} conflicting destinations, nothing was changed:\n"
+            + "\n".join(f"\t{c}" for c in conflicts)
+        )
+
+
+def plan_purge_extra_files(source_folder: Path, target_folder: Path) -> Plan:
+    """Plans deleting the extra files found in source_folder, which will live at target_folder once
+    the preceding renames have been applied"""
+
+    return Plan(
+        tuple(DeleteOp(target_folder / f.name) for f in find_extra_files(source_folder))
+    )
+
+
+def confirm_deletes(plan: Plan) -> Plan:
+    """Asks for confirmation of each folder's deletes, returning the plan without the rejected
+    ones"""
+
+    rejected: set[DeleteOp] = set()
+
+    # Duplicates are deleted before a season's renames and extra files after them, so a folder's
+    # deletes aren't necessarily next to each other
+    by_folder: dict[Path, list[DeleteOp]] = {}
+    for op in plan.deletes:
+        by_folder.setdefault(op.path.parent, []).append(op)
+
+    for folder, deletes in by_folder.items():
+        extra_files = [op.path for op in deletes if op.duplicate_of is None]
+        duplicates = {
+            op.path: op.duplicate_of for op in deletes if op.duplicate_of is not None
+        }
+        if not confirm_purge(folder, extra_files, duplicates):
+            rejected.update(deletes)
+
+    if not rejected:
+        return plan
+
+    return dataclasses.replace(
+        plan, ops=tuple(op for op in plan.ops if op not in rejected)
+    )
+
+
+_OP_STAGES = {RenameOp: "rename", MkdirOp: "mkdir", LinkOp: "link", DeleteOp: "delete"}
+
+
+def _emit_op(op: Op, *, dry_run: bool = False):
+    if isinstance(op, (RenameOp, LinkOp)):
+        paths = {"src": str(op.src), "dst": str(op.dst)}
+    else:
+        paths = {"path": str(op.path)}
+
+    emit(_OP_STAGES[type(op)], **paths, dry_run=dry_run)
+
+
+def log_plan(plan: Plan):
+    if not plan.ops:
+        logger.info("Nothing to do")
+
+    for op in plan.ops:
+        logger.info(str(op))
+        _emit_op(op, dry_run=True)
+
+
+def apply_op(op: Op):
+    with timed(_OP_STAGES[type(op)], op):
+        _apply_op(op)
+
+
+def _apply_op(op: Op):
+    if isinstance(op, RenameOp):
+        op.src.rename(op.dst)
+        invalidate(op.src)
+        invalidate(op.src.parent)
+        invalidate(op.dst.parent)
+    elif isinstance(op, MkdirOp):
+        op.path.mkdir(exist_ok=op.exist_ok)
+        invalidate(op.path.parent)
+    elif isinstance(op, LinkOp):
+        link_file(op.src, op.dst)
+        invalidate(op.dst.parent)
+    elif isinstance(op, DeleteOp):
+        os.remove(op.path)
+        invalidate(op.path.parent)
+
+
+def _footprint(op: Op) -> tuple[set[Path], set[Path]]:
+    """Returns (the paths an op changes, the paths that must stay put while it runs)"""
+
+    if isinstance(op, RenameOp):
+        writes = {op.src, op.dst}
+    elif isinstance(op, LinkOp):
+        writes = {op.dst}
+    elif isinstance(op, MkdirOp):
+        writes = {op.path}
+    else:
+        # Extra files are only purged once everything else in their folder is done
+        writes = {op.path, op.path.parent}
+
+    reads = {folder for path in writes for folder in path.parents} - writes
+    if isinstance(op, LinkOp):
+        reads.add(op.src)
+
+    return writes, reads
+
+
+def _dependencies(ops: Sequence[Op]) -> list[set[int]]:
+    """Works out which earlier ops each op has to wait for: ones that change a path it uses, or
+    use a path it changes. Ops in different season folders don't depend on each other, ops
+    changing a folder depend on everything in it."""
+
+    last_write: dict[Path, int] = {}
+    reads_since_write: dict[Path, list[int]] = {}
+    dependencies: list[set[int]] = []
+
+    for seq, op in enumerate(ops):
+        writes, reads = _footprint(op)
+        depends_on: set[int] = set()
+
+        for path in reads:
+            if path in last_write:
+                depends_on.add(last_write[path])
+
+        for path in writes:
+            if path in last_write:
+                depends_on.add(last_write[path])
+            depends_on.update(reads_since_write.pop(path, ()))
+
+        for path in reads:
+            reads_since_write.setdefault(path, []).append(seq)
+        for path in writes:
+            last_write[path] = seq
+
+        dependencies.append(depends_on)
+
+    return dependencies
+
+
+class DeviceSlots:
+    """Limits how many ops run at once on each filesystem (by st_dev), shared by every plan being
+    applied in this process so concurrent titles on one disk don't pile up on it"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._slots: dict[int, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _slot(self, device: int) -> threading.BoundedSemaphore:
+        with self._lock:
+            if device not in self._slots:
+                self._slots[device] = threading.BoundedSemaphore(self.limit)
+            return self._slots[device]
+
+    def try_acquire(self, device: int) -> threading.BoundedSemaphore | None:
+        slot = self._slot(device)
+        return slot if slot.acquire(blocking=False) else None
+
+    def acquire(self, device: int) -> threading.BoundedSemaphore:
+        slot = self._slot(device)
+        slot.acquire()
+        return slot
+
+
+_device_slots = DeviceSlots(DEFAULT_DEVICE_JOBS)
+
+
+def set_device_jobs(limit: int):
+    """Sets how many ops may run at once on each filesystem"""
+
+    global _device_slots
+    # Plans being applied keep sharing the current slots unless the limit actually changes
+    if limit != _device_slots.limit:
+        _device_slots = DeviceSlots(limit)
+
+
+def _anchor(op: Op) -> Path:
+    """The path whose folder an op updates"""
+
+    if isinstance(op, RenameOp):
+        return op.src
+    if isinstance(op, LinkOp):
+        return op.dst
+    return op.path
+
+
+def _device(path: Path, devices: dict[Path, int]) -> int:
+    """The st_dev of the filesystem path is on, folders are only stat'd once per plan"""
+
+    for folder in path.parents:
+        if folder in devices:
+            return devices[folder]
+
+        try:
+            devices[folder] = os.stat(folder).st_dev
+            return devices[folder]
+        except FileNotFoundError:
+            # Not created yet, it'll be on its parent's filesystem
+            continue
+
+    return 0
+
+
+def _directory_ranks(ops: Sequence[Op]) -> list[int]:
+    """Numbers each op's folder in the order folders first appear in the plan, ready ops are
+    started folder by folder so metadata updates stay local"""
+
+    ranks: dict[Path, int] = {}
+    return [ranks.setdefault(_anchor(op).parent, len(ranks)) for op in ops]
+
+
+def _apply_holding(
+    slot: threading.BoundedSemaphore, apply: Callable[[int, Op], None], seq: int, op: Op
+):
+    try:
+        apply(seq, op)
+    finally:
+        slot.release()
+
+
+def run_ops(
+    ops: Sequence[Op], apply: Callable[[int, Op], None], *, jobs: int = 1
+) -> None:
+    """Calls apply(seq, op) for each op, up to jobs at once. An op only starts once every earlier op
+    it depends on is done, so the outcome is the same as applying them in order, and ops are
+    logged in plan order either way. If ops fail, the ones depending on them are skipped and the
+    rest still run, then the earliest failure is raised.
+
+    Each op also takes one of its filesystem's slots, ops on a filesystem that has none free wait
+    while ops on other filesystems go ahead."""
+
+    device_slots = _device_slots
+    devices: dict[Path, int] = {}
+
+    if jobs <= 1:
+        for seq, op in enumerate(ops):
+            logger.debug(f"Applying: {op}")
+            _apply_holding(
+                device_slots.acquire(_device(_anchor(op), devices)), apply, seq, op
+            )
+            _emit_op(op)
+        return
+
+    dependencies = _dependencies(ops)
+    dependents: list[list[int]] = [[] for _ in ops]
+    for seq, depends_on in enumerate(dependencies):
+        for other in depends_on:
+            dependents[other].append(seq)
+
+    ranks = _directory_ranks(ops)
+    waiting_on = [len(d) for d in dependencies]
+    ready = [(ranks[seq], seq) for seq, count in enumerate(waiting_on) if count == 0]
+    heapq.heapify(ready)
+    running: dict[Future[None], int] = {}
+    errors: dict[int, BaseException | None] = {}
+    logged = 0
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+
+        def submit(slot: threading.BoundedSemaphore, seq: int):
+            # Workers run in a copy of this thread's context, so metrics and a server client's
+            # log output still find their way
+            future = pool.submit(
+                contextvars.copy_context().run,
+                _apply_holding,
+                slot,
+                apply,
+                seq,
+                ops[seq],
+            )
+            running[future] = seq
+
+        while ready or running:
+            busy: list[tuple[int, int]] = []
+            while ready and len(running) < jobs:
+                rank, seq = heapq.heappop(ready)
+                slot = device_slots.try_acquire(_device(_anchor(ops[seq]), devices))
+                if slot is None:
+                    busy.append((rank, seq))
+                else:
+                    submit(slot, seq)
+
+            if busy and not running:
+                # Everything ready is waiting on filesystems other plans are busy with
+                rank, seq = busy.pop(0)
+                submit(device_slots.acquire(_device(_anchor(ops[seq]), devices)), seq)
+
+            for item in busy:
+                heapq.heappush(ready, item)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                seq = running.pop(future)
+                errors[seq] = future.exception()
+                if errors[seq] is not None:
+                    continue
+
+                for other in dependents[seq]:
+                    waiting_on[other] -= 1
+                    if waiting_on[other] == 0:
+                        heapq.heappush(ready, (ranks[other], other))
+
+            while logged in errors:
+                if errors[logged] is None:
+                    logger.debug(f"Applied: {ops[logged]}")
+                    _emit_op(ops[logged])
+                logged += 1
+
+    # Ops depending on a failed one never finish, so the ones applied after the first of those are
+    # logged now that everything is done
+    for seq in range(logged, len(ops)):
+        if seq in errors and errors[seq] is None:
+            logger.debug(f"Applied: {ops[seq]}")
+            _emit_op(ops[seq])
+
+    failed = sorted(seq for seq, error in errors.items() if error is not None)
+    if not failed:
+        return
+
+    for seq in failed[1:]:
+        logger.error(f"Failed to {ops[seq]}: {errors[seq]}")
+
+    skipped = len(ops) - len(errors)
+    if skipped:
+        logger.error(f"Skipped {skipped} ops that depended on failed ones")
+
+    raise errors[failed[0]]
+
+
+def apply_plan(plan: Plan, *, jobs: int = 1):
+    run_ops(plan.ops, lambda _, op: apply_op(op), jobs=jobs)
@@ -0,0 +1,242 @@
+import dataclasses
+import logging
+import struct
+from pathlib import Path
+
+from jellyfin_media_renamer.fs import MappedFile
+from jellyfin_media_renamer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Matroska keeps its track and duration info in the first few KB, and so do MP4 files written for
+# streaming. Other MP4s keep it at the end, after the media data.
+HEAD_BYTES = 64 * 1024
+MOOV_BYTES = 64 * 1024
+
+# Matroska element IDs (with their length marker bits, as they appear in the file)
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_INFO = 0x1549A966
+_TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_TYPE = 0x83
+_VIDEO = 0xE0
+_PIXEL_WIDTH = 0xB0
+_PIXEL_HEIGHT = 0xBA
+_CLUSTER = 0x1F43B675
+
+_MKV_VIDEO_TRACK = 1
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class MediaInfo:
+    # In seconds
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+
+    @property
+    def pixels(self) -> int:
+        return (self.width or 0) * (self.height or 0)
+
+
+def _read_vint(buf: bytes, pos: int, *, keep_marker: bool) -> tuple[int | None, int]:
+    """Reads a Matroska variable length integer, returning (value, length). The value is None for
+    sizes that are all ones, which means unknown."""
+
+    first = buf[pos]
+    if first == 0:
+        raise ValueError("Invalid EBML variable length integer")
+
+    length = 9 - first.bit_length()
+    value = first if keep_marker else first & ((1 << (8 - length)) - 1)
+    for b in buf[pos + 1 : pos + length]:
+        value = (value << 8) | b
+
+    if len(buf) < pos + length:
+        raise ValueError("Truncated EBML variable length integer")
+
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+
+    return value, length
+
+
+def _ebml_elements(buf: bytes, start: int, end: int):
+    """Yields (id, data start, data end) for each element between start and end"""
+
+    pos = start
+    while pos < end:
+        element_id, id_len = _read_vint(buf, pos, keep_marker=True)
+        size, size_len = _read_vint(buf, pos + id_len, keep_marker=False)
+
+        data_start = pos + id_len + size_len
+        data_end = len(buf) if size is None else min(data_start + size, len(buf))
+
+        yield element_id, data_start, data_end
+
+        if size is None:
+            return
+        pos = data_start + size
+
+
+def _ebml_uint(buf: bytes, start: int, end: int) -> int:
+    return int.from_bytes(buf[start:end], "big")
+
+
+def _ebml_float(buf: bytes, start: int, end: int) -> float:
+    return struct.unpack(">f" if end - start == 4 else ">d", buf[start:end])[0]
+
+
+def _probe_mkv(buf: bytes) -> MediaInfo | None:
+    elements = _ebml_elements(buf, 0, len(buf))
+    if next(elements, (None,))[0] != _EBML:
+        return None
+
+    segment = next(((s, e) for i, s, e in elements if i == _SEGMENT), None)
+    if segment is None:
+        return None
+
+    timecode_scale = 1_000_000
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+
+    for element_id, start, end in _ebml_elements(buf, *segment):
+        if element_id == _CLUSTER:
+            # Only media data from here on
+            break
+
+        if element_id == _INFO:
+            for child_id, c_start, c_end in _ebml_elements(buf, start, end):
+                if child_id == _TIMECODE_SCALE:
+                    timecode_scale = _ebml_uint(buf, c_start, c_end)
+                elif child_id == _DURATION:
+                    duration = _ebml_float(buf, c_start, c_end)
+
+        elif element_id == _TRACKS:
+            for entry_id, e_start, e_end in _ebml_elements(buf, start, end):
+                if entry_id != _TRACK_ENTRY:
+                    continue
+
+                track_type = None
+                size: tuple[int | None, int | None] = (None, None)
+                for child_id, c_start, c_end in _ebml_elements(buf, e_start, e_end):
+                    if child_id == _TRACK_TYPE:
+                        track_type = _ebml_uint(buf, c_start, c_end)
+                    elif child_id == _VIDEO:
+                        video = {
+                            i: _ebml_uint(buf, s, e)
+                            for i, s, e in _ebml_elements(buf, c_start, c_end)
+                            if i in (_PIXEL_WIDTH, _PIXEL_HEIGHT)
+                        }
+                        size = (video.get(_PIXEL_WIDTH), video.get(_PIXEL_HEIGHT))
+
+                if track_type == _MKV_VIDEO_TRACK and width is None:
+                    width, height = size
+
+    return MediaInfo(
+        duration=duration * timecode_scale / 1e9 if duration is not None else None,
+        width=width,
+        height=height,
+    )
+
+
+def _mp4_boxes(buf: bytes, start: int, end: int):
+    """Yields (type, data start, data end) for each box between start and end of buf"""
+
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < header:
+            return
+
+        yield box_type, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _find_moov(file: MappedFile) -> bytes | None:
+    """Walks the top level boxes, reading only their headers, and returns the start of moov"""
+
+    pos = 0
+    while pos + 8 <= file.size:
+        header = file.read(pos, 16)
+        size, box_type = struct.unpack_from(">I4s", header)
+        header_len = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_len = 16
+        elif size == 0:
+            size = file.size - pos
+
+        if box_type == b"moov":
+            return file.read(pos + header_len, min(size - header_len, MOOV_BYTES))
+
+        if size < header_len:
+            return None
+        pos += size
+
+    return None
+
+
+def _probe_mp4(file: MappedFile, head: bytes) -> MediaInfo | None:
+    if head[4:8] != b"ftyp":
+        return None
+
+    moov = _find_moov(file)
+    if moov is None:
+        return None
+
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+
+    for box_type, start, end in _mp4_boxes(moov, 0, len(moov)):
+        if box_type == b"mvhd":
+            if moov[start] == 1:
+                timescale, length = struct.unpack_from(">IQ", moov, start + 20)
+            else:
+                timescale, length = struct.unpack_from(">II", moov, start + 12)
+            if timescale:
+                duration = length / timescale
+
+        elif box_type == b"trak":
+            for child_type, c_start, _ in _mp4_boxes(moov, start, end):
+                if child_type != b"tkhd":
+                    continue
+
+                # Width and height come after the version specific timestamps, reserved fields, a
+                # 36 byte matrix and so on, as 16.16 fixed point numbers
+                offset = c_start + (88 if moov[c_start] == 1 else 76)
+                track_width, track_height = struct.unpack_from(">II", moov, offset)
+                if track_width and track_height and width is None:
+                    width, height = track_width >> 16, track_height >> 16
+
+    return MediaInfo(duration=duration, width=width, height=height)
+
+
+def probe(path: Path) -> MediaInfo | None:
+    """Reads the duration and resolution of a Matroska or MP4 file from its headers, returning None
+    if it's in another format or can't be read"""
+
+    try:
+        with timed("probe", path), open(path, "rb") as f:
+            file = MappedFile(f.fileno())
+            head = file.read(0, HEAD_BYTES)
+
+            if head.startswith(b"\x1a\x45\xdf\xa3"):
+                return _probe_mkv(head)
+
+            return _probe_mp4(file, head)
+    except (OSError, ValueError, IndexError, struct.error) as e:
+        logger.debug(f"Unable to probe {path}: {e}")
+        return None
@@ -0,0 +1,258 @@
+import dataclasses
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from contextvars import ContextVar
+from pathlib import Path
+
+from jellyfin_media_renamer.cache import ParseCache
+from jellyfin_media_renamer.common import CommandError, Terminal, terminal
+from jellyfin_media_renamer.events import EventStream, current_events
+from jellyfin_media_renamer.main import CLIFlags, parse_args, run
+from jellyfin_media_renamer.parsing import PARSER_VERSION, current_parse_cache
+from jellyfin_media_renamer.titles import TitleIndex, current_title_index
+
+logger = logging.getLogger(__name__)
+
+
+class _Connection(Terminal):
+    """A client's end of a job: log records and prompts are forwarded to it as JSON lines"""
+
+    def __init__(self, rfile, wfile, *, verbose: bool, interactive: bool):
+        self._rfile = rfile
+        self._wfile = wfile
+        self._write_lock = threading.Lock()
+        self._interactive = interactive
+
+        self.level = logging.DEBUG if verbose else logging.INFO
+        self.formatter = logging.Formatter(
+            "{asctime} {levelname}: {message}" if verbose else "{message}", style="{"
+        )
+
+    def send(self, message: dict):
+        with self._write_lock:
+            self._wfile.write(json.dumps(message).encode() + b"\n")
+            self._wfile.flush()
+
+    def ask(self, message: str) -> str:
+        self.send({"prompt": message})
+
+        line = self._rfile.readline()
+        if not line:
+            raise EOFError
+
+        reply = json.loads(line)
+        if reply.get("eof"):
+            raise EOFError
+
+        return reply["answer"]
+
+    def is_interactive(self) -> bool:
+        return self._interactive
+
+
+_connection: ContextVar[_Connection | None] = ContextVar("connection", default=None)
+
+
+class _ClientLogHandler(logging.Handler):
+    """Sends each log record to the client whose job emitted it"""
+
+    def emit(self, record: logging.LogRecord):
+        connection = _connection.get()
+        if connection is None or record.levelno < connection.level:
+            return
+
+        try:
+            connection.send({"log": connection.formatter.format(record)})
+        except OSError:
+            # The client went away, the job carries on regardless
+            pass
+
+
+def _resolve_paths(
+    flags: CLIFlags, raw_paths: list[str], cwd: Path
+) -> tuple[CLIFlags, list[str]]:
+    """Makes paths from the client's command line relative to the client's working folder rather
+    than the server's"""
+
+    def resolve(path: Path | None) -> Path | None:
+        return None if path is None else cwd / path
+
+    flags = dataclasses.replace(
+        flags,
+        cache=resolve(flags.cache),
+        journal=resolve(flags.journal),
+        output=resolve(flags.output),
+        titles=resolve(flags.titles),
+        build_titles=resolve(flags.build_titles),
+        profile_output=resolve(flags.profile_output),
+        metrics_textfile=resolve(flags.metrics_textfile),
+        audit=resolve(flags.audit),
+    )
+
+    return flags, [str(cwd / p) for p in raw_paths]
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Runs jobs submitted by clients, keeping compiled patterns and caches warm between them"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path):
+        self.socket_path = socket_path
+        _remove_stale_socket(socket_path)
+
+        super().__init__(os.fspath(socket_path), _JobHandler)
+
+        self._parse_caches: dict[Path, ParseCache] = {}
+        self._parse_caches_lock = threading.Lock()
+        # Keyed by modification time too, so a rebuilt index is picked up
+        self._title_indexes: dict[tuple[Path, int], TitleIndex] = {}
+
+        self._log_handler = _ClientLogHandler()
+        logging.getLogger().addHandler(self._log_handler)
+
+    def server_bind(self):
+        # Anyone who can connect can rename files as this user, so only they may connect
+        old_umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(old_umask)
+
+    def parse_cache(self, path: Path) -> ParseCache:
+        with self._parse_caches_lock:
+            if path not in self._parse_caches:
+                self._parse_caches[path] = ParseCache(path, version=PARSER_VERSION)
+
+            return self._parse_caches[path]
+
+    def title_index(self, path: Path) -> TitleIndex:
+        key = (path, path.stat().st_mtime_ns)
+
+        with self._parse_caches_lock:
+            if key not in self._title_indexes:
+                self._title_indexes[key] = TitleIndex(path)
+
+            return self._title_indexes[key]
+
+    def server_close(self):
+        super().server_close()
+
+        logging.getLogger().removeHandler(self._log_handler)
+        self.socket_path.unlink(missing_ok=True)
+
+        for cache in self._parse_caches.values():
+            cache.close()
+
+        for index in self._title_indexes.values():
+            index.close()
+
+
+def _remove_stale_socket(socket_path: Path):
+    if not socket_path.exists():
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(os.fspath(socket_path))
+    except ConnectionRefusedError:
+        # Left behind by a server that didn't shut down cleanly
+        socket_path.unlink()
+        return
+    finally:
+        probe.close()
+
+    raise CommandError(f"A server is already listening on {socket_path}")
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    server: Server
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        request = json.loads(line)
+        argv: list[str] = request["argv"]
+
+        connection = _Connection(
+            self.rfile,
+            self.wfile,
+            verbose=any(arg in ("-v", "--verbose") for arg in argv),
+            interactive=request.get("interactive", False),
+        )
+        _connection.set(connection)
+        terminal.set(connection)
+
+        try:
+            exit_code = self._run(argv, Path(request["cwd"]))
+            connection.send({"exit": exit_code})
+        except OSError:
+            logger.warning("Lost the connection to a client before its job finished")
+
+    def _run(self, argv: list[str], cwd: Path) -> int:
+        try:
+            flags, raw_paths = _resolve_paths(*parse_args(argv), cwd)
+
+            if flags.watch:
+                raise CommandError("--watch can't be run through the server")
+
+            if flags.json:
+                connection = _connection.get()
+                current_events.set(
+                    EventStream(lambda event: connection.send({"event": event}))
+                )
+
+            # Each job runs on its own thread, so these only last as long as the job does
+            if flags.cache:
+                current_parse_cache.set(self.server.parse_cache(flags.cache))
+                flags = dataclasses.replace(flags, cache=None)
+
+            if flags.titles and not flags.build_titles:
+                try:
+                    current_title_index.set(self.server.title_index(flags.titles))
+                except (OSError, ValueError):
+                    # run() reports it
+                    pass
+                else:
+                    flags = dataclasses.replace(flags, titles=None)
+
+            run(flags, raw_paths)
+        except CommandError as e:
+            logger.error(e.message)
+            return 1
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logger.exception("Unexpected error while running a job")
+            return 1
+
+        return 0
+
+
+def serve(socket_path: Path, *, verbose: bool = False):
+    """Runs jobs submitted through socket_path until interrupted"""
+
+    root = logging.getLogger()
+    # Each client picks its own level, the server's own output is filtered by its handler instead
+    root.setLevel(logging.DEBUG)
+
+    console = logging.StreamHandler()
+    console.setLevel(logging.DEBUG if verbose else logging.INFO)
+    console.setFormatter(
+        logging.Formatter("{asctime} {levelname}: {message}", style="{")
+    )
+    root.addHandler(console)
+
+    with Server(socket_path) as server:
+        logger.info(f"Listening on {socket_path} ...")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Shutting down ...")
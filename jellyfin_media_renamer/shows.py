@@ -1,24 +1,34 @@
+import dataclasses
 import logging
 import re
-from dataclasses import dataclass
 from pathlib import Path
 
 from jellyfin_media_renamer.common import (
     SUBTITLES_FILE_EXTS,
     VIDEO_FILE_EXTS,
     CommandError,
-    purge_extra_files,
-    strip_tags,
+)
+from jellyfin_media_renamer.dedupe import find_duplicates
+from jellyfin_media_renamer.events import emit
+from jellyfin_media_renamer.fs import scan_dir
+from jellyfin_media_renamer.metrics import count, timed
+from jellyfin_media_renamer.parsing import (
+    EpisodeInfo,
+    parse_episode_info,
+    parse_episodes,
+)
+from jellyfin_media_renamer.plan import (
+    DEFAULT_IO_JOBS,
+    Plan,
+    PlanBuilder,
+    apply_plan,
+    confirm_deletes,
+    plan_purge_extra_files,
 )
 
 logger = logging.getLogger(__name__)
 
-
-@dataclass(frozen=True, slots=True, kw_only=True)
-class EpisodeInfo:
-    numbers: list[int]
-    name: str | None
-    parts: str | None
+_SEASON_NUMBER_RE = re.compile(r"(?:Season|S)\s?(\d{1,2})(?:\s|$|\.|-)", re.IGNORECASE)
 
 
 def infer_episode_info(
@@ -28,108 +38,39 @@ def infer_episode_info(
     year: int | None,
     season: int,
 ) -> EpisodeInfo:
-    assert fp.is_file()
-
-    name = fp.name[: -len(fp.suffix)]
-
-    ep_number_patterns = [
-        r"episode(\s|\.|-)?(?P<ep_start>\d+)(?:-(?P<ep_end>\d+))?",  # Episode 01
-        r"(?:S\d{1,2})?((?:E(?P<ep_start>\d{1,3}))(?:-?E(?P<ep_end>\d{1,3}))*(?P<parts>(?:abcd)|(?:abc)|(?:ab)|(?:a))?)(?:\s|-|$|_|\.|\()",  # S01E01 or S01E01E02E03
-        r"ep(?P<ep_start>\d{1,3})",  # Ep01
-        rf"{season}x(?P<ep_start>\d{{1,3}})(?:\s|$|\.|\[|\(|\,|_|-)",  # {season}x01
-        rf"(?:^|\s|\.){season}(?P<ep_start>\d{{2,3}})(?:\s|\.|$|_|-)",  # {season}01
-        r"(?:^|\s|\.|_|-)(?P<ep_start>\d\d\d?)(?:\s|\.|$|_|-)",  # 01 or 155
-    ]
-
-    ep_start: int | None = None
-    ep_end: int | None = None
-    parts: str | None = None
-
-    match: re.Match[str] | None = None
-    for pattern in ep_number_patterns:
-        if match := next(re.finditer(pattern, fp.name, re.IGNORECASE), None):
-            ep_start = int(match.group("ep_start").strip())
-            ep_end = int((match.groupdict().get("ep_end") or "").strip() or -1)
-            if ep_end == -1:
-                ep_end = None
-
-            try:
-                parts = (match.group("parts") or "").strip()
-            except IndexError:
-                pass
-
-            break
-
-    if ep_start is None:
+    ep_info = parse_episode_info(fp.name, raw_show_name, show_name, year, season)
+
+    if ep_info is None:
         raise CommandError(f"Unable to determine episode number for path {fp}")
 
-    ep_part_patterns = [
-        r"(?:(?:parts)|(?:part)|(?:pt))(?:\s|\.|-|_)*(?P<p_start>[a-dA-D1-9])(?:-(?P<p_end>[a-dA-D1-9]))?(?:\s|\.|-|_|$)",
-    ]
-
-    for pattern in ep_part_patterns:
-        if part_match := next(re.finditer(pattern, fp.name, re.IGNORECASE), None):
-            name = name.replace(part_match.group(), "")
-            part_match_dict = part_match.groupdict()
-            parts = "-".join(
-                filter(
-                    None,
-                    map(
-                        str.strip,
-                        [
-                            part_match_dict.get("p_start") or "",
-                            part_match_dict.get("p_end") or "",
-                        ],
-                    ),
-                )
-            )
-            break
-
-    name = re.sub(re.escape(raw_show_name), "", name, flags=re.IGNORECASE)
-    name = re.sub(re.escape(show_name), "", name, flags=re.IGNORECASE)
-    name = strip_tags(name.strip())
-    full_group = match.group().rstrip(". ")
-    if not full_group.isnumeric():
-        name = name.replace(full_group, "", 1)  # Remove ep number
-
-    for re_pattern in [
-        r"((?:\(|\[|\s|-|\.)\d{4}(?:\)|\]|\s|-|\.))",  # Year
-        r"(\((?:(?:1080)|(?:480)|(?:720)|(?:2160))p.*\))",  # (1080p ...)
-        r"((?:www)?\.?UIndex\.org\s*-?\s*)",  # www.UIndex.org -
-        r"((?:-|_|\.|\s)?WEB(?:-|_|\.|\s)DL(?:-|_|\.|\s)?)"  # WEB-Dl
-        r"((?:-|_|\.|\s)?DVD(?:-|_|\.|\s)?RIP(?:-|_|\.|\s)?)",  # DVDRIP
-    ]:
-        name = re.sub(re_pattern, "", name, count=1, flags=re.IGNORECASE)
-
-    for match in re.finditer(
-        r"(:?\.|\s)(?:1080|480|720|2160)p(:?\.|\s)", name, flags=re.IGNORECASE
-    ):
-        name = name.split(match.group())[0]
-
-    name = re.sub(r"(,\.)([A-Za-z])", r", \2", name)
-
-    name = name.strip(",.-_ ")
-    parts = (parts or "").strip(",.-_ ")
-
-    if not (parts.isalpha() or parts.isnumeric()):
-        parts = None
-
-    return EpisodeInfo(
-        numbers=list(range(ep_start, (ep_end or ep_start) + 1)),
-        name=name or None,
-        parts=parts or None,
-    )
+    return ep_info
 
 
-def process_show_season(
-    folder: Path, raw_show_name: str, show_name: str, year: int | None, season: int
-):
+def plan_show_season(
+    folder: Path,
+    raw_show_name: str,
+    show_name: str,
+    year: int | None,
+    season: int,
+    *,
+    target_folder: Path | None = None,
+) -> Plan:
+    """Plans renaming the episodes listed in folder, target_folder is where the season folder will
+    be by the time this plan runs (defaults to folder)"""
+
+    if target_folder is None:
+        target_folder = folder
+
+    plan = PlanBuilder()
+
     show_stem = show_name
     if year:
         show_stem += f" ({year})"
 
-    for fp in folder.iterdir():
-        if not fp.is_file():
+    episode_files: list[Path] = []
+    for entry in scan_dir(folder).entries:
+        fp = entry.path
+        if not entry.is_file:
             logger.warning(f"Unknown folder/object: {fp}")
             continue
 
@@ -137,15 +78,44 @@ def process_show_season(
         if fp_ext not in VIDEO_FILE_EXTS and fp_ext not in SUBTITLES_FILE_EXTS:
             continue
 
-        logger.debug(f"Processing season episode file: {fp.name!r}")
+        episode_files.append(fp)
 
-        ep_info = infer_episode_info(
-            fp,
-            raw_show_name,
-            show_name,
-            year,
-            season,
+    with timed("infer_episode_info", folder):
+        ep_infos = parse_episodes(
+            [fp.name for fp in episode_files], raw_show_name, show_name, year, season
+        )
+    count("episodes", len(episode_files))
+
+    # Copies of an episode would all be renamed to the same name, each rename silently replacing
+    # the one before, so only one copy is kept. Copies tend to have something tacked onto their
+    # name, like "(1)", so the shortest name is kept.
+    duplicates: set[Path] = set()
+    with timed("find_duplicates", folder):
+        duplicate_groups = find_duplicates(episode_files)
+    for group in duplicate_groups:
+        keep = min(group, key=lambda f: (len(f.name), f))
+        copies = [f for f in group if f != keep]
+        logger.info(
+            f"{', '.join(repr(c.name) for c in copies)} duplicate {keep.name!r}, removing them"
         )
+        for copy in copies:
+            emit("duplicate", path=str(copy), original=str(keep))
+            plan.delete(
+                target_folder / copy.name, duplicate_of=target_folder / keep.name
+            )
+        duplicates.update(copies)
+
+    for fp, ep_info in zip(episode_files, ep_infos):
+        if fp in duplicates:
+            continue
+
+        logger.debug(f"Processing season episode file: {fp.name!r}")
+
+        if ep_info is None:
+            raise CommandError(f"Unable to determine episode number for path {fp}")
+
+        emit("episode", path=str(fp), season=season, **dataclasses.asdict(ep_info))
+        plan.note_confidence(ep_info.confidence)
 
         ep_numbers_fmtd = "".join(f"E{n:02d}" for n in ep_info.numbers)
         new_name = f"{show_stem} S{season:02d}{ep_numbers_fmtd}"
@@ -164,30 +134,70 @@ def process_show_season(
         #     else:
         #         new_name += f'-part{p_min}-{p_max}'
 
-        fp.rename(fp.with_name(new_name.strip()).with_suffix(fp.suffixes[-1]))
+        plan.rename(
+            target_folder / fp.name,
+            target_folder
+            / fp.with_name(new_name.strip()).with_suffix(fp.suffixes[-1]).name,
+        )
+
+    plan.extend(plan_purge_extra_files(folder, target_folder))
 
-    purge_extra_files(folder)
+    return plan.build()
 
 
-def process_show(fp: Path, raw_name: str, name: str, year: int | None, new_stem: str):
-    fp = fp.rename(fp.with_name(new_stem))
+def plan_show(
+    fp: Path, raw_name: str, name: str, year: int | None, new_stem: str
+) -> Plan:
+    plan = PlanBuilder()
 
-    for file in fp.iterdir():
-        if not file.is_dir():
+    show_folder = plan.rename(fp, fp.with_name(new_stem))
+
+    for entry in scan_dir(fp).entries:
+        file = entry.path
+        if not entry.is_dir:
             logger.warning(f"Skipping extraneous file in season directory: {file.name}")
             continue
 
         logger.debug(f"Processing season folder: {file.name!r}")
 
-        season_num = next(
-            re.finditer(
-                r"(?:Season|S)\s?(\d{1,2})(?:\s|$|\.|-)", file.name, flags=re.IGNORECASE
-            ),
-            None,
-        )
+        season_num = _SEASON_NUMBER_RE.search(file.name)
         if season_num is None:
             raise CommandError(f"Unable to determine season number for {file}")
         season_num = int(season_num.group(1))
 
-        season_folder = file.rename(file.with_name(f"Season {season_num:02d}"))
-        process_show_season(season_folder, raw_name, name, year, season_num)
+        season_folder = plan.rename(
+            show_folder / file.name, show_folder / f"Season {season_num:02d}"
+        )
+        plan.extend(
+            plan_show_season(
+                file, raw_name, name, year, season_num, target_folder=season_folder
+            )
+        )
+
+    return plan.build()
+
+
+def process_show_season(
+    folder: Path, raw_show_name: str, show_name: str, year: int | None, season: int
+):
+    apply_plan(
+        confirm_deletes(
+            plan_show_season(folder, raw_show_name, show_name, year, season)
+        )
+    )
+
+
+def process_show(
+    fp: Path,
+    raw_name: str,
+    name: str,
+    year: int | None,
+    new_stem: str,
+    *,
+    jobs: int = DEFAULT_IO_JOBS,
+):
+    """Renames a show, its season folders are worked on concurrently (by up to jobs threads)"""
+
+    apply_plan(
+        confirm_deletes(plan_show(fp, raw_name, name, year, new_stem)), jobs=jobs
+    )
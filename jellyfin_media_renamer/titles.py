@@ -0,0 +1,269 @@
+import contextvars
+import dataclasses
+import difflib
+import gzip
+import logging
+import mmap
+import os
+import re
+import struct
+import unicodedata
+from pathlib import Path
+
+from jellyfin_media_renamer.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# An index file is a header, a table of record offsets and then the records themselves, sorted by
+# normalized title so they can be binary searched in place. Each record is a line of
+# "<normalized title>\t<title>\t<year>\t<kind>".
+_MAGIC = b"JMRTITL1"
+_HEADER = struct.Struct("<8sI")
+_OFFSET = struct.Struct("<I")
+
+_KINDS = {
+    "movie": "m",
+    "tvMovie": "m",
+    "tvSeries": "s",
+    "tvMiniSeries": "s",
+}
+
+# Records near where a title would be sorted are compared with it when there's no exact match,
+# which catches typos and missing or extra words towards the end of the title
+FUZZY_WINDOW = 32
+FUZZY_MIN_RATIO = 0.9
+
+_NON_ALNUM_RE = re.compile(r"[\W_]+")
+# Whitespace before a colon is only matched from its start, so a long run of it without a colon
+# isn't searched again from every position in it
+_COLON_RE = re.compile(r"(?:(?<!\s)\s+)?:\s+")
+
+
+def default_titles_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "jellyfin-media-renamer" / "titles.idx"
+
+
+def normalize_title(title: str) -> str:
+    """Lowercases a title and strips accents, apostrophes and punctuation, so that names parsed
+    from filenames compare equal to the real title"""
+
+    title = unicodedata.normalize("NFKD", title.casefold())
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = title.replace("&", " and ").replace("'", "")
+
+    return _NON_ALNUM_RE.sub(" ", title).strip()
+
+
+@dataclasses.dataclass(frozen=True, slots=True, kw_only=True)
+class Title:
+    title: str
+    year: int | None
+    is_show: bool
+
+    @property
+    def name(self) -> str:
+        """The title with characters that can't (or shouldn't) be in a filename replaced"""
+
+        return _COLON_RE.sub(" - ", self.title).replace("/", "-").replace(":", "-")
+
+
+def build_title_index(tsv_path: Path, index_path: Path) -> int:
+    """Compiles an IMDb title.basics.tsv dump (optionally gzipped) into an index at index_path,
+    returning the number of titles in it"""
+
+    opener = gzip.open if tsv_path.suffix == ".gz" else open
+    records: set[bytes] = set()
+
+    with opener(tsv_path, "rt", encoding="utf-8", newline="\n") as f:
+        columns = f.readline().rstrip("\n").split("\t")
+        title_type = columns.index("titleType")
+        primary = columns.index("primaryTitle")
+        original = columns.index("originalTitle")
+        is_adult = columns.index("isAdult")
+        start_year = columns.index("startYear")
+
+        for line in f:
+            row = line.rstrip("\n").split("\t")
+
+            kind = _KINDS.get(row[title_type])
+            if kind is None or row[is_adult] == "1":
+                continue
+
+            year = row[start_year] if row[start_year].isdigit() else "0"
+            for title in {row[primary], row[original]}:
+                if key := normalize_title(title):
+                    records.add(f"{key}\t{row[primary]}\t{year}\t{kind}\n".encode())
+
+    # Lines sort by their normalized title first, since it can't contain a tab
+    sorted_records = sorted(records)
+
+    offsets: list[int] = []
+    position = 0
+    for record in sorted_records:
+        offsets.append(position)
+        position += len(record)
+
+    if position > 0xFFFFFFFF:
+        raise ValueError("Too many titles to fit in an index")
+
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_name(index_path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(sorted_records)))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.writelines(sorted_records)
+
+    # Processes still using the old index keep their mapping of it
+    os.replace(tmp_path, index_path)
+
+    return len(sorted_records)
+
+
+class TitleIndex:
+    """A title index built by build_title_index, searched through mmap without reading it in"""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count = _HEADER.unpack_from(self._mm)
+        if magic != _MAGIC:
+            self._mm.close()
+            raise ValueError(f"Not a title index: {path}")
+
+        self._records_start = _HEADER.size + self._count * _OFFSET.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _record(self, i: int) -> bytes:
+        start = (
+            self._records_start
+            + _OFFSET.unpack_from(self._mm, _HEADER.size + i * _OFFSET.size)[0]
+        )
+        return self._mm[start : self._mm.find(b"\n", start)]
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def _title(self, record: bytes) -> tuple[str, Title]:
+        key, title, year, kind = record.decode().split("\t")
+        return key, Title(title=title, year=int(year) or None, is_show=kind == "s")
+
+    def _exact(self, key: str, start: int) -> list[Title]:
+        prefix = key.encode() + b"\t"
+
+        titles: list[Title] = []
+        for i in range(start, self._count):
+            record = self._record(i)
+            if not record.startswith(prefix):
+                break
+            titles.append(self._title(record)[1])
+
+        return titles
+
+    def _fuzzy(
+        self, key: str, year: int, start: int, *, is_show: bool | None
+    ) -> list[Title]:
+        best: list[Title] = []
+        best_ratio = FUZZY_MIN_RATIO
+        # The matcher only analyzes its second sequence once
+        matcher = difflib.SequenceMatcher(None, b=key)
+
+        for i in range(
+            max(start - FUZZY_WINDOW, 0), min(start + FUZZY_WINDOW, self._count)
+        ):
+            record = self._record(i)
+            # Most records are ruled out by their year, before anything is decoded
+            other_key, _, record_year, kind = record.split(b"\t")
+            if int(record_year) != year or (
+                is_show is not None and (kind == b"s") != is_show
+            ):
+                continue
+
+            matcher.set_seq1(other_key.decode())
+            # Upper bounds of the ratio that are much cheaper to work out
+            if (
+                matcher.real_quick_ratio() < best_ratio
+                or matcher.quick_ratio() < best_ratio
+            ):
+                continue
+
+            ratio = matcher.ratio()
+            if ratio > best_ratio:
+                best, best_ratio = [self._title(record)[1]], ratio
+            elif ratio == best_ratio:
+                best.append(self._title(record)[1])
+
+        return best
+
+    def match(
+        self, name: str, year: int | None, *, is_show: bool | None = None
+    ) -> Title | None:
+        """Finds the title a parsed name and year refer to, only among shows or movies if is_show
+        is given, returning None unless exactly one title fits. Names must match exactly (once
+        normalized) unless the year is known, in which case close misspellings are matched too.
+        Years may be off by one, release dates vary by country."""
+
+        key = normalize_title(name)
+        if not key:
+            return None
+
+        start = self._lower_bound(key.encode() + b"\t")
+
+        candidates = [
+            t
+            for t in self._exact(key, start)
+            if is_show is None or t.is_show == is_show
+        ]
+        if year is not None:
+            candidates = [t for t in candidates if t.year == year] or [
+                t for t in candidates if t.year and abs(t.year - year) == 1
+            ]
+
+        if not candidates and year is not None:
+            candidates = self._fuzzy(key, year, start, is_show=is_show)
+
+        if len(set(candidates)) != 1:
+            if len(candidates) > 1:
+                logger.debug(f"{name!r} ({year}) matches {len(candidates)} titles")
+            return None
+
+        return candidates[0]
+
+    def close(self):
+        self._mm.close()
+
+
+# Set for the duration of a run with --titles, server jobs get their own copy of the context so
+# names are only corrected in jobs that asked for it
+current_title_index: contextvars.ContextVar[TitleIndex | None] = contextvars.ContextVar(
+    "current_title_index", default=None
+)
+
+
+def match_title(name: str, year: int | None, *, is_show: bool | None) -> Title | None:
+    """Looks up a parsed name and year in the title index, if one is set, among shows or movies if
+    is_show is given"""
+
+    title_index = current_title_index.get()
+    if title_index is None:
+        return None
+
+    with timed("match_title", name):
+        title = title_index.match(name, year, is_show=is_show)
+    if title is not None and (title.name, title.year) != (name, year):
+        logger.info(
+            f"Corrected {name!r} ({year}) to {title.name!r} ({title.year}) from the title index"
+        )
+
+    return title
@@ -0,0 +1,216 @@
+import ctypes
+import ctypes.util
+import dataclasses
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+from jellyfin_media_renamer.batch import (
+    ProcessOptions,
+    log_batch_summary,
+    run_batch,
+)
+from jellyfin_media_renamer.common import CommandError
+from jellyfin_media_renamer.fs import fresh_snapshots
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTLE_SECONDS = 30.0
+
+# Files with these suffixes are still being downloaded
+PARTIAL_SUFFIXES = {".part", ".!qb", ".!ut", ".crdownload", ".tmp", ".partial"}
+
+# From sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """A minimal ctypes wrapper around Linux's inotify API"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read_events(self, timeout: float) -> list[tuple[int, int, str]]:
+        """Waits up to timeout seconds, returning a list of (watch descriptor, mask, name)"""
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events: list[tuple[int, int, str]] = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buf[offset : offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            events.append((wd, mask, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """Watches staging folders and processes each new entry once it has been quiet for a while"""
+
+    def __init__(
+        self,
+        roots: list[Path],
+        *,
+        options: ProcessOptions,
+        settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+    ):
+        self.roots = [root.absolute() for root in roots]
+        # Nobody is around to answer prompts or review titles while watching
+        self.options = dataclasses.replace(options, interactive=False, unattended=True)
+        self.settle_seconds = settle_seconds
+
+        self._inotify = Inotify()
+        self._watches: dict[int, Path] = {}
+        # Staging entry -> when activity was last seen inside it
+        self._pending: dict[Path, float] = {}
+        # Entries this watcher renamed things to, which shouldn't be picked up again
+        self._produced: set[Path] = set()
+
+        for root in self.roots:
+            if not root.is_dir():
+                raise CommandError(f"Can't watch {root}, it is not a folder")
+
+            self._add_watch(root)
+            for entry in root.iterdir():
+                if entry.is_dir():
+                    self._add_watches(entry)
+
+    def _add_watch(self, folder: Path):
+        try:
+            self._watches[self._inotify.add_watch(folder, _WATCH_MASK)] = folder
+        except OSError as e:
+            logger.warning(f"Unable to watch {folder}: {e}")
+
+    def _add_watches(self, folder: Path):
+        self._add_watch(folder)
+        for dirpath, dirnames, _ in os.walk(folder):
+            for dirname in dirnames:
+                self._add_watch(Path(dirpath) / dirname)
+
+    def _staging_entry(self, path: Path) -> Path | None:
+        for root in self.roots:
+            if path.parent == root or root in path.parents:
+                return root / path.relative_to(root).parts[0]
+        return None
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("Missed filesystem events (inotify queue overflowed)")
+            return
+
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+
+        folder = self._watches.get(wd)
+        if folder is None or not name:
+            return
+
+        path = folder / name
+        entry = self._staging_entry(path)
+        if entry is None or entry in self._produced or entry.name.startswith("."):
+            return
+
+        if mask & (IN_DELETE | IN_MOVED_FROM) and path == entry:
+            self._pending.pop(entry, None)
+            return
+
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self._add_watches(path)
+
+        self._pending[entry] = time.monotonic()
+
+    def _is_settled(self, entry: Path, now: float) -> bool:
+        if now - self._pending[entry] < self.settle_seconds:
+            return False
+
+        paths = [entry] if entry.is_file() else entry.rglob("*")
+        return not any(p.suffix.lower() in PARTIAL_SUFFIXES for p in paths)
+
+    def _process(self, entry: Path):
+        # Anything may have changed since the last entry was processed
+        with fresh_snapshots():
+            results = run_batch([entry], jobs=1, options=self.options)
+        log_batch_summary(results)
+
+        for result in results:
+            if result.destination is not None:
+                self._produced.add(result.destination)
+
+    def poll(self, timeout: float) -> list[Path]:
+        """Handles events for up to timeout seconds, then processes every settled entry, returning
+        the entries that were processed"""
+
+        for wd, mask, name in self._inotify.read_events(timeout):
+            self._handle_event(wd, mask, name)
+
+        # Entries can disappear while pending, e.g. when they get renamed by us or moved away
+        for entry in [e for e in self._pending if not e.exists()]:
+            del self._pending[entry]
+
+        now = time.monotonic()
+        settled = sorted(e for e in self._pending if self._is_settled(e, now))
+
+        for entry in settled:
+            del self._pending[entry]
+            logger.info(f"{entry} has settled, processing it ...")
+            self._process(entry)
+
+        return settled
+
+    def run(self):
+        logger.info(f"Watching {', '.join(map(str, self.roots))} for new releases ...")
+
+        while True:
+            self.poll(min(self.settle_seconds, 5.0) or 1.0)
+
+    def close(self):
+        self._inotify.close()
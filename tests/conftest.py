@@ -0,0 +1,14 @@
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def list_tree() -> Callable[[Path], list[str]]:
+    """Lists the files beneath a folder, relative to it"""
+
+    def list_tree(root: Path) -> list[str]:
+        return sorted(str(p.relative_to(root)) for p in root.rglob("*") if p.is_file())
+
+    return list_tree
@@ -0,0 +1,80 @@
+import os
+from pathlib import Path
+
+from jellyfin_media_renamer.audit import AuditState, audit_library
+
+
+def _make_library(root: Path):
+    for rel in [
+        "Good Movie (2001)/Good Movie (2001).mkv",
+        "Good Movie (2001)/Good Movie (2001).en.srt",
+        "Good Movie (2001)/poster.jpg",
+        "Bad Movie (1999)/Bad.Movie.1999.1080p.mkv",
+        "Some.Movie.2010.1080p/Some Movie (2010).mkv",
+        "Show (2020)/Season 01/Show (2020) S01E01 Pilot.mkv",
+        "Show (2020)/Season 01/Show (2020) S01E02E03.mkv",
+        "Show (2020)/Season 01/Show (2020) S02E01.mkv",
+        "Show (2020)/Season 01/show.s01e04.mkv",
+        "Show (2020)/Specials/Show (2020) S00E01.mkv",
+        "Show (2020)/Show (2020) S01E05.mkv",
+        "Loose.Movie.2005.mkv",
+    ]:
+        (root / rel).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel).touch()
+
+
+def _age(root: Path):
+    # Folders changed within the last couple of seconds aren't remembered
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (1_600_000_000, 1_600_000_000))
+
+
+def test_audit_library(tmp_path):
+    _make_library(tmp_path)
+
+    report = audit_library([tmp_path])
+
+    assert [
+        (i.path.relative_to(tmp_path).as_posix(), i.problem) for i in report.issues
+    ] == [
+        (
+            "Bad Movie (1999)/Bad.Movie.1999.1080p.mkv",
+            "expected 'Bad Movie (1999).mkv'",
+        ),
+        ("Loose.Movie.2005.mkv", "not inside a title folder"),
+        (
+            "Show (2020)/Season 01/Show (2020) S02E01.mkv",
+            "expected 'Show (2020) S01EMM[ <episode name>].mkv'",
+        ),
+        (
+            "Show (2020)/Season 01/show.s01e04.mkv",
+            "expected 'Show (2020) S01EMM[ <episode name>].mkv'",
+        ),
+        ("Show (2020)/Show (2020) S01E05.mkv", "episode outside of a season folder"),
+        ("Show (2020)/Specials", "expected a 'Season NN' folder"),
+        ("Some.Movie.2010.1080p", "expected 'Some Movie (2010)'"),
+    ]
+    assert (report.examined, report.skipped) == (6, 0)
+
+
+def test_audit_library_skips_unchanged_folders(tmp_path):
+    library = tmp_path / "library"
+    state_path = tmp_path / "audit-state.json"
+    _make_library(library)
+    _age(library)
+
+    state = AuditState(state_path)
+    first = audit_library([library], state=state)
+    state.save([library])
+
+    second = audit_library([library], state=AuditState(state_path))
+    assert (second.examined, second.skipped) == (0, 6)
+    assert second.issues == first.issues
+
+    (library / "Show (2020)" / "Season 01" / "show.s01e04.mkv").rename(
+        library / "Show (2020)" / "Season 01" / "Show (2020) S01E04.mkv"
+    )
+
+    third = audit_library([library], state=AuditState(state_path))
+    assert (third.examined, third.skipped) == (1, 5)
+    assert len(third.issues) == len(first.issues) - 1
@@ -0,0 +1,33 @@
+import pytest
+
+from benchmarks.corpus import generate_movie_names, generate_shows
+from benchmarks.regex_fuzz import MAX_GROWTH_EXPONENT, Attack, collect_patterns, growth
+from benchmarks.run import bench_parse_episodes, bench_process_show
+
+
+def test_corpus_is_reproducible():
+    assert generate_movie_names(50, seed=1) == generate_movie_names(50, seed=1)
+    assert list(generate_shows(100, seed=1)) == list(generate_shows(100, seed=1))
+
+
+def test_synthetic_corpus_parses(tmp_path):
+    assert bench_parse_episodes(500, seed=0).failures == 0
+    assert bench_process_show(200, seed=0, root=tmp_path).failures == 0
+
+
+# The worst inputs the fuzzer found for the patterns that used to backtrack
+@pytest.mark.parametrize(
+    ("name", "attack"),
+    [
+        ("parsing._DOTS_RE", Attack(prefix="_", pump="..", suffix="!2")),
+        ("titles._COLON_RE", Attack(prefix="]", pump="  ", suffix="")),
+        (
+            "parsing._EP_RESOLUTION_GROUP_RE",
+            Attack(prefix="8", pump="(480p", suffix="8"),
+        ),
+        ("parsing._SXXEXX_RE", Attack(prefix="E0E0_", pump="E0E10", suffix="!]")),
+    ],
+)
+def test_patterns_are_linear(name, attack):
+    exponent, _ = growth(collect_patterns()[name], attack, length=8192)
+    assert exponent <= MAX_GROWTH_EXPONENT
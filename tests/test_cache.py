@@ -0,0 +1,84 @@
+from unittest.mock import patch
+
+import pytest
+
+from jellyfin_media_renamer import parsing
+from jellyfin_media_renamer.cache import ParseCache
+from jellyfin_media_renamer.parsing import (
+    EpisodeInfo,
+    current_parse_cache,
+    parse_episodes,
+    parse_name_and_year,
+)
+
+
+@pytest.fixture
+def parse_cache(tmp_path):
+    cache = ParseCache(tmp_path / "cache.sqlite3", version=parsing.PARSER_VERSION)
+    token = current_parse_cache.set(cache)
+    yield cache
+    current_parse_cache.reset(token)
+    cache.close()
+
+
+def test_put_and_get(tmp_path):
+    cache = ParseCache(tmp_path / "cache.sqlite3", version=1)
+    cache.put_many("kind", {"a": [1, "x"], "b": None})
+
+    assert cache.get_many("kind", ["a", "b", "c"]) == {"a": [1, "x"], "b": None}
+    assert cache.get_many("other", ["a"]) == {}
+
+
+def test_version_change_drops_entries(tmp_path):
+    cache = ParseCache(tmp_path / "cache.sqlite3", version=1)
+    cache.put_many("kind", {"a": 1})
+    cache.close()
+
+    assert ParseCache(tmp_path / "cache.sqlite3", version=1).get_many("kind", ["a"])
+    assert not ParseCache(tmp_path / "cache.sqlite3", version=2).get_many("kind", ["a"])
+
+
+def test_lru_eviction(tmp_path):
+    cache = ParseCache(tmp_path / "cache.sqlite3", version=1, max_entries=2)
+    cache.put_many("kind", {"a": 1})
+    cache.put_many("kind", {"b": 2})
+    cache.get_many("kind", ["a"])
+    cache.put_many("kind", {"c": 3})
+
+    assert cache.get_many("kind", ["a", "b", "c"]) == {"a": 1, "c": 3}
+
+
+def test_warm_parse_skips_regex_work(parse_cache):
+    names = ["Test Show S01E01 Pilot.mkv", "Test Show Extras.mkv"]
+    expected = [EpisodeInfo(numbers=[1], name="Pilot", parts=None), None]
+
+    assert parse_episodes(names, "Test Show", "Test Show", None, 1) == expected
+    assert parse_name_and_year("Nacho.Libre.2006.mkv", is_file=True) == (
+        "Nacho.Libre.2006",
+        "Nacho Libre",
+        2006,
+    )
+
+    with (
+        patch.object(parsing, "_parse_episode_info") as parse_episode_info,
+        patch.object(parsing, "_parse_name_and_year") as parse_name,
+    ):
+        assert parse_episodes(names, "Test Show", "Test Show", None, 1) == expected
+        assert parse_name_and_year("Nacho.Libre.2006.mkv", is_file=True) == (
+            "Nacho.Libre.2006",
+            "Nacho Libre",
+            2006,
+        )
+
+    parse_episode_info.assert_not_called()
+    parse_name.assert_not_called()
+
+
+def test_timed_out_episodes_are_not_cached(parse_cache, monkeypatch):
+    args = (["Test Show S01E01.mkv"], "Test Show", "Test Show", None, 1)
+
+    with monkeypatch.context() as m:
+        m.setattr(parsing, "PARSE_TIME_BUDGET", -1)
+        assert parse_episodes(*args) == [None]
+
+    assert parse_episodes(*args) == [EpisodeInfo(numbers=[1], name=None, parts=None)]
@@ -0,0 +1,84 @@
+from jellyfin_media_renamer import dedupe
+from jellyfin_media_renamer.dedupe import find_duplicates
+from jellyfin_media_renamer.plan import DeleteOp, RenameOp, confirm_deletes
+from jellyfin_media_renamer.shows import plan_show_season
+
+MIB = 1024 * 1024
+
+
+def test_find_duplicates(tmp_path):
+    content = bytes(range(256)) * (MIB // 256)
+
+    (tmp_path / "a.mkv").write_bytes(content)
+    (tmp_path / "b.mkv").write_bytes(content)
+    # Same size, but differs between the sampled chunks
+    different = bytearray(content)
+    different[100_000] ^= 0xFF
+    (tmp_path / "c.mkv").write_bytes(different)
+    (tmp_path / "d.mkv").write_bytes(content[:-1])
+    (tmp_path / "empty1.mkv").touch()
+    (tmp_path / "empty2.mkv").touch()
+
+    assert dedupe._sample_hash(tmp_path / "a.mkv") == dedupe._sample_hash(
+        tmp_path / "c.mkv"
+    )
+    assert find_duplicates(sorted(tmp_path.iterdir())) == [
+        [tmp_path / "a.mkv", tmp_path / "b.mkv"]
+    ]
+
+
+def test_find_duplicates_small_files_skip_full_hash(tmp_path, monkeypatch):
+    (tmp_path / "a.srt").write_text("1\n00:00:01,000 --> 00:00:02,000\nHi\n")
+    (tmp_path / "b.srt").write_text("1\n00:00:01,000 --> 00:00:02,000\nHi\n")
+    (tmp_path / "c.srt").write_text("1\n00:00:01,000 --> 00:00:02,000\nHo\n")
+
+    def fail(_):
+        raise AssertionError("small files are fully covered by the sample hash")
+
+    monkeypatch.setattr(dedupe, "_full_hash", fail)
+
+    assert find_duplicates(sorted(tmp_path.iterdir())) == [
+        [tmp_path / "a.srt", tmp_path / "b.srt"]
+    ]
+
+
+def test_plan_show_season_removes_duplicate_episodes(tmp_path):
+    (tmp_path / "Test.Show.S01E01.mkv").write_bytes(b"episode one")
+    (tmp_path / "Test.Show.S01E01.REPACK.mkv").write_bytes(b"episode one")
+    (tmp_path / "Test.Show.S01E02.mkv").write_bytes(b"episode two")
+
+    plan = plan_show_season(tmp_path, "Test Show", "Test Show", None, 1)
+
+    assert DeleteOp(path=tmp_path / "Test.Show.S01E01.REPACK.mkv") in plan.ops
+    assert [
+        (op.src.name, op.dst.name) for op in plan.ops if isinstance(op, RenameOp)
+    ] == [
+        ("Test.Show.S01E01.mkv", "Test Show S01E01.mkv"),
+        ("Test.Show.S01E02.mkv", "Test Show S01E02.mkv"),
+    ]
+
+
+def test_confirm_deletes_asks_once_per_folder(tmp_path, monkeypatch):
+    (tmp_path / "Test.Show.S01E01.mkv").write_bytes(b"episode one")
+    (tmp_path / "Test.Show.S01E01.REPACK.mkv").write_bytes(b"episode one")
+    (tmp_path / "info.nfo").touch()
+
+    prompts: list[str] = []
+    monkeypatch.setattr(
+        "jellyfin_media_renamer.common.prompt",
+        lambda message: prompts.append(message) or "n",
+    )
+
+    plan = confirm_deletes(
+        plan_show_season(tmp_path, "Test Show", "Test Show", None, 1)
+    )
+
+    assert plan.deletes == ()
+    assert prompts == [
+        (
+            f"Purge extra files and delete duplicate copies in {tmp_path}?\n"
+            f"\t{tmp_path / 'info.nfo'}\n"
+            f"\t{tmp_path / 'Test.Show.S01E01.REPACK.mkv'} (duplicate of Test.Show.S01E01.mkv)\n"
+            "\n [Y/n]: "
+        )
+    ]
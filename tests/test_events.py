@@ -0,0 +1,89 @@
+import io
+import json
+
+import pytest
+
+from jellyfin_media_renamer.common import CommandError
+from jellyfin_media_renamer.events import EventStream, current_events, emit
+from jellyfin_media_renamer.main import parse_args, run
+
+
+def test_emit_without_stream():
+    emit("detected", path="/media/a", type="movie")
+
+
+def test_event_stream_to_file():
+    out = io.StringIO()
+    token = current_events.set(EventStream.to_file(out))
+    try:
+        emit("detected", path="/media/a", type="movie")
+    finally:
+        current_events.reset(token)
+
+    event = json.loads(out.getvalue())
+    assert event["event"] == "detected"
+    assert event["path"] == "/media/a"
+    assert event["type"] == "movie"
+    assert isinstance(event["time"], float)
+
+
+def test_run_with_json(tmp_path, capsys):
+    show = tmp_path / "Test.Show.2020"
+    (show / "S01").mkdir(parents=True)
+    (show / "S01" / "Test.Show.S01E01.mkv").touch()
+    (tmp_path / "Good.Movie.2001.1080p.mkv").touch()
+
+    run(
+        *parse_args(
+            ["--yes", "--json", str(show), str(tmp_path / "Good.Movie.2001.1080p.mkv")]
+        )
+    )
+
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    names = [e["event"] for e in events]
+
+    assert names.count("detected") == 2
+    assert names.count("name") == 2
+    assert names.count("title") == 2
+    assert names[-1] == "summary"
+
+    episode = next(e for e in events if e["event"] == "episode")
+    assert (episode["season"], episode["numbers"]) == (1, [1])
+
+    renames = {(e["src"], e["dst"]) for e in events if e["event"] == "rename"}
+    assert (str(show), str(tmp_path / "Test Show (2020)")) in renames
+    assert not any(e["dry_run"] for e in events if e["event"] == "rename")
+
+    assert events[-1] | {"time": None} == {
+        "event": "summary",
+        "time": None,
+        "titles": 2,
+        "failed": 0,
+        "needs_review": 0,
+    }
+
+
+def test_run_with_json_reports_errors(tmp_path, capsys):
+    with pytest.raises(CommandError):
+        run(*parse_args(["--json", str(tmp_path / "missing")]))
+
+    event = json.loads(capsys.readouterr().out)
+    assert event["event"] == "error"
+    assert "missing" in event["message"]
+
+
+def test_run_with_json_prompts_on_stderr(tmp_path, capsys, monkeypatch):
+    folder = tmp_path / "Nacho.Libre.2006.1080p.WEB-DL"
+    folder.mkdir()
+    (folder / "Nacho.Libre.2006.1080p.WEB-DL.mkv").touch()
+    (folder / "RARBG.txt").touch()
+
+    monkeypatch.setattr("sys.stdin", io.StringIO("y\ny\n"))
+
+    run(*parse_args(["--json", str(folder)]))
+
+    captured = capsys.readouterr()
+    events = [json.loads(line) for line in captured.out.splitlines()]
+    assert "delete" in [e["event"] for e in events]
+    assert "Is this correct?" in captured.err
+    assert "RARBG.txt" in captured.err
@@ -0,0 +1,82 @@
+import time
+from pathlib import Path
+
+from jellyfin_media_renamer.fs import (
+    DirSnapshot,
+    _snapshots,
+    fresh_snapshots,
+    invalidate,
+    scan_dir,
+)
+
+
+def test_scan_dir(tmp_path):
+    (tmp_path / "b.mkv").touch()
+    (tmp_path / "a.srt").touch()
+    (tmp_path / "Season 01").mkdir()
+
+    snapshot = scan_dir(tmp_path)
+
+    assert [e.name for e in snapshot.entries] == ["Season 01", "a.srt", "b.mkv"]
+    assert snapshot.files == (tmp_path / "a.srt", tmp_path / "b.mkv")
+    assert snapshot.dirs == (tmp_path / "Season 01",)
+
+
+def test_scan_dir_is_cached_until_invalidated(tmp_path):
+    (tmp_path / "a.mkv").touch()
+    snapshot = scan_dir(tmp_path)
+
+    (tmp_path / "b.mkv").touch()
+    assert scan_dir(tmp_path) is snapshot
+
+    invalidate(tmp_path)
+    assert scan_dir(tmp_path).files == (tmp_path / "a.mkv", tmp_path / "b.mkv")
+
+
+def test_fresh_snapshots_lists_folders_again(tmp_path):
+    (tmp_path / "a.mkv").touch()
+
+    with fresh_snapshots():
+        snapshot = scan_dir(tmp_path)
+        (tmp_path / "b.mkv").touch()
+        assert scan_dir(tmp_path) is snapshot
+
+    with fresh_snapshots():
+        assert scan_dir(tmp_path).files == (tmp_path / "a.mkv", tmp_path / "b.mkv")
+
+
+def test_invalidate_drops_the_whole_subtree(tmp_path):
+    nested = tmp_path / "Show" / "Season 01" / "Extras"
+    nested.mkdir(parents=True)
+    (tmp_path / "Other").mkdir()
+
+    # The Show folder itself is never listed, its subfolders still go with it
+    snapshots = [
+        scan_dir(p) for p in (tmp_path, nested.parent, nested, tmp_path / "Other")
+    ]
+    invalidate(tmp_path / "Show")
+
+    assert scan_dir(tmp_path) is snapshots[0]
+    assert scan_dir(nested.parent) is not snapshots[1]
+    assert scan_dir(nested) is not snapshots[2]
+    assert scan_dir(tmp_path / "Other") is snapshots[3]
+
+
+def _time_invalidate(cached: int) -> float:
+    with fresh_snapshots():
+        for i in range(cached):
+            path = Path(f"/media/Title {i}")
+            _snapshots().add(DirSnapshot(path=path, entries=()))
+
+        best = float("inf")
+        for i in range(50):
+            start = time.perf_counter()
+            invalidate(Path(f"/media/Title {i}"))
+            best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def test_invalidate_cost_does_not_grow_with_the_cache():
+    # Used to test every cached folder, about 200 times slower with the larger cache
+    assert _time_invalidate(20_000) < _time_invalidate(100) * 10
@@ -0,0 +1,121 @@
+from pathlib import Path
+
+from jellyfin_media_renamer.journal import (
+    Journal,
+    _apply_journaled_op,
+    apply_plan_journaled,
+    empty_trash,
+    resume,
+    undo,
+)
+from jellyfin_media_renamer.plan import DeleteOp, Plan, RenameOp
+from jellyfin_media_renamer.shows import plan_show
+
+
+def _make_show(root: Path) -> Path:
+    show = root / "Test Show"
+    for file in [
+        "S01/Test Show - S01E01.mkv",
+        "S01/Test Show - S01E02.mkv",
+        "S01/a.nfo",
+    ]:
+        (show / file).parent.mkdir(parents=True, exist_ok=True)
+        (show / file).touch()
+    return show
+
+
+def _plan(show: Path):
+    return plan_show(show, "Test Show", "Test Show", 2020, "Test Show (2020)")
+
+
+ORIGINAL = [
+    "Test Show/S01/Test Show - S01E01.mkv",
+    "Test Show/S01/Test Show - S01E02.mkv",
+    "Test Show/S01/a.nfo",
+]
+
+RENAMED = [
+    "Test Show (2020)/Season 01/Test Show (2020) S01E01.mkv",
+    "Test Show (2020)/Season 01/Test Show (2020) S01E02.mkv",
+]
+
+
+def test_undo_reverts_a_finished_run(tmp_path, list_tree):
+    show = _make_show(tmp_path / "library")
+    journal = Journal(tmp_path / "journal.jsonl")
+
+    apply_plan_journaled(_plan(show), journal)
+    (run,) = journal.load_runs()
+    # The purged extra file is kept in the trash
+    assert list_tree(tmp_path / "library") == [
+        f"Test Show (2020)/Season 01/.a.nfo.{run.run_id}.jmr-trash",
+        *RENAMED,
+    ]
+
+    assert undo(journal) == 1
+    assert list_tree(tmp_path / "library") == ORIGINAL
+
+
+def test_resume_and_undo_an_interrupted_run(tmp_path, list_tree):
+    show = _make_show(tmp_path / "library")
+    journal = Journal(tmp_path / "journal.jsonl")
+
+    # Simulate dying after the first three ops, with only the first one recorded as done
+    run = journal.begin(_plan(show))
+    for op in run.ops[:3]:
+        _apply_journaled_op(op, run.run_id)
+    journal.mark_done(run, 0)
+    journal.close()
+
+    journal = Journal(tmp_path / "journal.jsonl")
+    assert resume(journal) == 1
+    assert list_tree(tmp_path / "library") == [
+        f"Test Show (2020)/Season 01/.a.nfo.{run.run_id}.jmr-trash",
+        *RENAMED,
+    ]
+    assert resume(journal) == 0
+
+    assert undo(journal, run.session) == 1
+    assert list_tree(tmp_path / "library") == ORIGINAL
+
+
+def test_undo_restores_trashed_files_of_interrupted_run(tmp_path, list_tree):
+    show = _make_show(tmp_path / "library")
+    journal = Journal(tmp_path / "journal.jsonl")
+
+    run = journal.begin(_plan(show))
+    for op in run.ops:
+        _apply_journaled_op(op, run.run_id)
+
+    undo(journal)
+    assert "Test Show/S01/a.nfo" in list_tree(tmp_path / "library")
+
+
+def test_empty_trash_follows_renamed_folders(tmp_path, list_tree):
+    show = _make_show(tmp_path / "library")
+    journal = Journal(tmp_path / "journal.jsonl")
+
+    # A duplicate is deleted before its season folder is renamed
+    apply_plan_journaled(
+        Plan(
+            (
+                DeleteOp(show / "S01" / "Test Show - S01E02.mkv"),
+                RenameOp(show / "S01", show / "Season 01"),
+            )
+        ),
+        journal,
+    )
+
+    assert empty_trash(journal) == 1
+    assert list_tree(tmp_path / "library") == [
+        "Test Show/Season 01/Test Show - S01E01.mkv",
+        "Test Show/Season 01/a.nfo",
+    ]
+    assert empty_trash(journal) == 0
+
+    # Everything else can still be undone
+    assert undo(journal) == 1
+    assert list_tree(tmp_path / "library") == [
+        "Test Show/S01/Test Show - S01E01.mkv",
+        "Test Show/S01/a.nfo",
+    ]
@@ -0,0 +1,66 @@
+import os
+
+from jellyfin_media_renamer.batch import plan_title
+from jellyfin_media_renamer.common import InputType
+from jellyfin_media_renamer.fs import link_file
+from jellyfin_media_renamer.plan import LinkOp, MkdirOp, apply_plan
+
+
+def test_plan_title_with_output_root_links_renamed_tree(tmp_path, list_tree):
+    staging = tmp_path / "staging"
+    library = tmp_path / "library"
+    library.mkdir()
+
+    movie = staging / "Conan.The.Barbarian.1982.1080p.BluRay"
+    movie.mkdir(parents=True)
+    (movie / "Conan.The.Barbarian.1982.1080p.BluRay.mp4").write_text("video")
+    (movie / "Conan.The.Barbarian.1982.1080p.BluRay.srt").write_text("subs")
+    (movie / "junk.txt").write_text("junk")
+    before = list_tree(staging)
+
+    plan = plan_title(
+        movie,
+        InputType.FOLDER_WITH_MOVIE,
+        "Conan.The.Barbarian.1982.1080p.BluRay",
+        "Conan The Barbarian",
+        1982,
+        output_root=library,
+    )
+
+    new_folder = library / "Conan The Barbarian (1982)"
+    assert plan.ops == (
+        MkdirOp(new_folder, exist_ok=True),
+        LinkOp(
+            movie / "Conan.The.Barbarian.1982.1080p.BluRay.mp4",
+            new_folder / "Conan The Barbarian (1982).mp4",
+        ),
+        LinkOp(
+            movie / "Conan.The.Barbarian.1982.1080p.BluRay.srt",
+            new_folder / "Conan The Barbarian (1982).srt",
+        ),
+    )
+
+    apply_plan(plan)
+
+    assert list_tree(staging) == before
+    assert list_tree(library) == [
+        "Conan The Barbarian (1982)/Conan The Barbarian (1982).mp4",
+        "Conan The Barbarian (1982)/Conan The Barbarian (1982).srt",
+    ]
+    assert os.path.samefile(
+        movie / "Conan.The.Barbarian.1982.1080p.BluRay.mp4",
+        new_folder / "Conan The Barbarian (1982).mp4",
+    )
+
+
+def test_link_file_falls_back_to_copying(tmp_path, monkeypatch):
+    def fail_link(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", fail_link)
+
+    (tmp_path / "src").write_bytes(b"x" * 100_000)
+    link_file(tmp_path / "src", tmp_path / "dst")
+
+    assert (tmp_path / "dst").read_bytes() == b"x" * 100_000
+    assert not os.path.samefile(tmp_path / "src", tmp_path / "dst")
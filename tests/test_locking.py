@@ -0,0 +1,114 @@
+import threading
+import time
+from pathlib import Path
+
+from jellyfin_media_renamer import batch
+from jellyfin_media_renamer.batch import ProcessOptions, run_batch, title_lock_paths
+from jellyfin_media_renamer.locking import hold_locks
+
+
+def test_hold_locks_waits_for_holder(tmp_path):
+    lock_dir = tmp_path / "locks"
+    events = []
+
+    def second():
+        with hold_locks(
+            [Path("/library/Show"), Path("/library/Other")], lock_dir=lock_dir
+        ):
+            events.append("second")
+
+    with hold_locks([Path("/library/Show")], lock_dir=lock_dir):
+        thread = threading.Thread(target=second)
+        thread.start()
+        time.sleep(0.2)
+        events.append("first")
+
+    thread.join(timeout=5)
+    assert events == ["first", "second"]
+
+
+def test_hold_locks_unrelated_paths_dont_wait(tmp_path):
+    lock_dir = tmp_path / "locks"
+    acquired = threading.Event()
+
+    def other():
+        with hold_locks([Path("/library/Other")], lock_dir=lock_dir):
+            acquired.set()
+
+    with hold_locks([Path("/library/Show")], lock_dir=lock_dir):
+        threading.Thread(target=other).start()
+        assert acquired.wait(timeout=5)
+
+
+def test_title_lock_paths(tmp_path):
+    assert title_lock_paths(tmp_path / "Nacho.Libre.2006.mkv", "Nacho Libre", 2006) == {
+        tmp_path / "Nacho.Libre.2006.mkv",
+        tmp_path / "Nacho Libre (2006)",
+    }
+    assert title_lock_paths(
+        tmp_path / "Nacho.Libre.2006.mkv",
+        "Nacho Libre",
+        None,
+        output_root=tmp_path / "library",
+    ) == {tmp_path / "Nacho.Libre.2006.mkv", tmp_path / "library" / "Nacho Libre"}
+
+
+def test_run_batch_serializes_conflicting_jobs(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path / "run"))
+
+    # The first two end up in the same folder, the third is unrelated
+    targets = [
+        tmp_path / "Nacho.Libre.2006.1080p.WEB-DL.mkv",
+        tmp_path / "Nacho.Libre.2006.720p.BluRay.mkv",
+        tmp_path / "Hot.Rod.2007.1080p.WEB-DL.mkv",
+    ]
+    for target in targets:
+        target.touch()
+
+    running: set[str] = set()
+    overlaps: list[set[str]] = []
+    lock = threading.Lock()
+
+    def fake_process_job(job):
+        with lock:
+            running.add(job.path.name)
+            overlaps.append(set(running))
+        time.sleep(0.2)
+        with lock:
+            running.discard(job.path.name)
+        return batch.BatchResult(path=job.path, input_type=job.input_type)
+
+    monkeypatch.setattr(batch, "_process_job", fake_process_job)
+
+    results = run_batch(targets, jobs=3, options=ProcessOptions(interactive=False))
+
+    assert [r.path for r in results] == targets
+    assert not any({t.name for t in targets[:2]} <= seen for seen in overlaps)
+    # The unrelated title still ran alongside one of the others
+    assert any(targets[2].name in seen and len(seen) > 1 for seen in overlaps)
+
+
+def test_run_batch_lists_the_title_again_after_waiting(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path / "run"))
+
+    folder = tmp_path / "Nacho.Libre.2006.1080p.WEB-DL"
+    folder.mkdir()
+    (folder / "Nacho.Libre.2006.1080p.WEB-DL.mkv").touch()
+
+    results = []
+    batch_run = threading.Thread(
+        target=lambda: results.extend(
+            run_batch([folder], options=ProcessOptions(interactive=False))
+        )
+    )
+
+    # Another job renames the video while this one waits for the title's lock, after it has
+    # already listed the folder
+    with hold_locks(title_lock_paths(folder, "Nacho Libre", 2006)):
+        batch_run.start()
+        time.sleep(0.2)
+        (folder / "Nacho.Libre.2006.1080p.WEB-DL.mkv").rename(folder / "nl.mkv")
+
+    batch_run.join(timeout=5)
+    assert results[0].ok
+    assert (tmp_path / "Nacho Libre (2006)" / "Nacho Libre (2006).mkv").exists()
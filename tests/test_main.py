@@ -1,42 +1,244 @@
+import sys
 from pathlib import Path
-from unittest.mock import MagicMock
 
 import pytest
 
-from jellyfin_media_renamer.main import InputType, infer_input_type
+from jellyfin_media_renamer.batch import (
+    DEFAULT_JOBS,
+    DEFAULT_MIN_CONFIDENCE,
+    ProcessOptions,
+    collect_targets,
+    run_batch,
+)
+from jellyfin_media_renamer.common import infer_name_and_year
+from jellyfin_media_renamer.main import (
+    CLIFlags,
+    InputType,
+    infer_input_type,
+    parse_args,
+)
+from jellyfin_media_renamer.plan import DEFAULT_DEVICE_JOBS, DEFAULT_IO_JOBS
+from jellyfin_media_renamer.watch import DEFAULT_SETTLE_SECONDS
 
 
 @pytest.mark.parametrize(
     ("fp", "fp_items", "expected_type"),
     [
-        (Path("./test.mp4"), [], InputType.MOVIE_WITHOUT_FOLDER),
-        (Path("/path/to/my/movie.mkv"), [], InputType.MOVIE_WITHOUT_FOLDER),
+        ("test.mp4", [], InputType.MOVIE_WITHOUT_FOLDER),
+        ("path/to/my/movie.mkv", [], InputType.MOVIE_WITHOUT_FOLDER),
         (
-            Path("/path/to/movie"),
+            "path/to/movie",
             ["movie.mkv", "movie.srt", "other.txt", "other/"],
             InputType.FOLDER_WITH_MOVIE,
         ),
         (
-            Path("path/to/show"),
+            "path/to/show",
             ["Season 1/", "Season 02/", "balls.txt"],
             InputType.FOLDER_WITH_SHOW_SEASONS,
         ),
     ],
 )
-def test_infer_input_type(fp, fp_items, expected_type):
-    def make_path_mock(path: str | Path, is_dir: bool) -> MagicMock:
-        path = Path(path)
-        mock = MagicMock(spec=path)
-        mock.is_dir.return_value = is_dir
-        mock.is_file.return_value = not is_dir
-        mock.name = path.name
-        mock.suffixes = path.suffixes
-
-        return mock
-
-    fp_mock = make_path_mock(fp, bool(fp_items))
-    fp_mock.iterdir.return_value = (
-        make_path_mock(sub_obj, is_dir=sub_obj.endswith("/")) for sub_obj in fp_items
+def test_infer_input_type(tmp_path, fp, fp_items, expected_type):
+    fp = tmp_path / fp
+    fp.parent.mkdir(parents=True, exist_ok=True)
+
+    if fp_items:
+        fp.mkdir()
+        for sub_obj in fp_items:
+            if sub_obj.endswith("/"):
+                (fp / sub_obj).mkdir()
+            else:
+                (fp / sub_obj).touch()
+    else:
+        fp.touch()
+
+    assert infer_input_type(fp) == expected_type
+
+
+@pytest.mark.parametrize(
+    ("argv", "expected_flags", "expected_paths"),
+    [
+        (
+            ["jellyfinrename", "movie"],
+            CLIFlags(
+                verbose=False,
+                batch=False,
+                jobs=DEFAULT_JOBS,
+                dry_run=False,
+                cache=None,
+                yes=False,
+                purge=False,
+                min_confidence=DEFAULT_MIN_CONFIDENCE,
+                journal=None,
+                resume=False,
+                undo=None,
+                empty_trash=False,
+                output=None,
+                watch=False,
+                settle=DEFAULT_SETTLE_SECONDS,
+                titles=None,
+                build_titles=None,
+                profile=False,
+                profile_output=None,
+                metrics_textfile=None,
+                io_jobs=DEFAULT_IO_JOBS,
+                device_jobs=DEFAULT_DEVICE_JOBS,
+                json=False,
+                audit=None,
+            ),
+            ["movie"],
+        ),
+        (
+            [
+                "jellyfinrename",
+                "-v",
+                "--batch",
+                "--jobs=8",
+                "--dry-run",
+                "--cache=/tmp/cache.sqlite3",
+                "-y",
+                "--purge",
+                "--min-confidence=0.5",
+                "--journal=/tmp/journal.jsonl",
+                "--output=/library",
+                "--watch",
+                "--settle=2.5",
+                "--titles=/tmp/titles.idx",
+                "--profile=/tmp/profile.json",
+                "--io-jobs=16",
+                "--device-jobs=2",
+                "--json",
+                "--audit=/tmp/audit.json",
+                "a",
+                "b",
+            ],
+            CLIFlags(
+                verbose=True,
+                batch=True,
+                jobs=8,
+                dry_run=True,
+                cache=Path("/tmp/cache.sqlite3"),
+                yes=True,
+                purge=True,
+                min_confidence=0.5,
+                journal=Path("/tmp/journal.jsonl"),
+                resume=False,
+                undo=None,
+                empty_trash=False,
+                output=Path("/library"),
+                watch=True,
+                settle=2.5,
+                titles=Path("/tmp/titles.idx"),
+                build_titles=None,
+                profile=True,
+                profile_output=Path("/tmp/profile.json"),
+                metrics_textfile=None,
+                io_jobs=16,
+                device_jobs=2,
+                json=True,
+                audit=Path("/tmp/audit.json"),
+            ),
+            ["a", "b"],
+        ),
+    ],
+)
+def test_parse_args(monkeypatch, argv, expected_flags, expected_paths):
+    monkeypatch.setattr(sys, "argv", argv)
+
+    assert parse_args() == (expected_flags, expected_paths)
+
+
+def test_run_batch_isolates_failures(tmp_path, monkeypatch):
+    (tmp_path / "Good.Movie.2001.1080p").mkdir()
+    (tmp_path / "Good.Movie.2001.1080p" / "Good.Movie.2001.1080p.mkv").touch()
+    (tmp_path / "junk.txt").touch()
+    (tmp_path / "Another.Movie.1999.mp4").touch()
+
+    monkeypatch.setattr(
+        "jellyfin_media_renamer.batch.get_name_and_year",
+        lambda fp, input_type: (fp.name, *infer_name_and_year(fp, input_type)[1:]),
+    )
+
+    targets = collect_targets([tmp_path], expand_roots=True)
+    results = run_batch(targets, jobs=2)
+
+    assert [r.path.name for r in results] == [
+        "Another.Movie.1999.mp4",
+        "Good.Movie.2001.1080p",
+        "junk.txt",
+    ]
+    assert [r.ok for r in results] == [True, True, False]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "Another Movie (1999)",
+        "Good Movie (2001)",
+        "junk.txt",
+    ]
+
+
+def test_run_batch_non_interactive_queues_low_confidence(tmp_path, monkeypatch):
+    (tmp_path / "Good.Movie.2001.1080p.mkv").touch()
+    (tmp_path / "Vague Movie").mkdir()
+    (tmp_path / "Vague Movie" / "Vague Movie.mkv").touch()
+    (tmp_path / "Vague Movie" / "notes.txt").touch()
+
+    def fail_prompt(_):
+        raise AssertionError("Should not prompt")
+
+    monkeypatch.setattr("jellyfin_media_renamer.common.prompt", fail_prompt)
+    monkeypatch.setattr("sys.stdin.isatty", lambda: False)
+
+    targets = collect_targets([tmp_path], expand_roots=True)
+    results = run_batch(targets, options=ProcessOptions(interactive=False))
+
+    assert [(r.path.name, r.ok, r.needs_review) for r in results] == [
+        ("Good.Movie.2001.1080p.mkv", True, False),
+        ("Vague Movie", False, True),
+    ]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "Good Movie (2001)",
+        "Vague Movie",
+    ]
+
+
+def test_run_batch_unattended_never_reviews(tmp_path, monkeypatch):
+    (tmp_path / "Vague Movie").mkdir()
+    (tmp_path / "Vague Movie" / "Vague Movie.mkv").touch()
+
+    def fail_prompt(_):
+        raise AssertionError("Should not prompt")
+
+    monkeypatch.setattr("jellyfin_media_renamer.common.prompt", fail_prompt)
+    monkeypatch.setattr("sys.stdin.isatty", lambda: True)
+
+    targets = collect_targets([tmp_path], expand_roots=True)
+    results = run_batch(
+        targets, options=ProcessOptions(interactive=False, unattended=True)
+    )
+
+    assert [(r.path.name, r.needs_review) for r in results] == [("Vague Movie", True)]
+
+
+@pytest.mark.parametrize(("purge", "kept"), [(False, True), (True, False)])
+def test_run_batch_non_interactive_only_deletes_with_purge(tmp_path, purge, kept):
+    (tmp_path / "Good.Movie.2001.1080p").mkdir()
+    (tmp_path / "Good.Movie.2001.1080p" / "Good.Movie.2001.1080p.mkv").touch()
+    (tmp_path / "Good.Movie.2001.1080p" / "notes.txt").touch()
+
+    targets = collect_targets([tmp_path], expand_roots=True)
+    results = run_batch(targets, options=ProcessOptions(interactive=False, purge=purge))
+
+    assert [r.ok for r in results] == [True]
+    assert (tmp_path / "Good Movie (2001)" / "notes.txt").exists() == kept
+
+
+def test_run_batch_reports_colliding_titles(tmp_path):
+    (tmp_path / "Movie.2001.1080p.mkv").touch()
+    (tmp_path / "Movie.2001.720p.mkv").touch()
+
+    targets = collect_targets([tmp_path], expand_roots=True)
+    results = run_batch(
+        targets, options=ProcessOptions(dry_run=True, interactive=False)
     )
 
-    assert infer_input_type(fp_mock) == expected_type
+    assert [r.ok for r in results] == [True, False]
+    assert "collides with mkdir" in results[1].error
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from jellyfin_media_renamer.main import parse_args, run
+from jellyfin_media_renamer.metrics import Histogram, Metrics
+
+
+def test_histogram():
+    histogram = Histogram()
+    for seconds in [0.0002, 0.0003, 0.002, 0.02, 7]:
+        histogram.observe(seconds, f"{seconds}s")
+
+    assert histogram.count == 5
+    assert histogram.total == pytest.approx(7.0225)
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(1) == 7
+    assert max(histogram.slowest) == (7, "7s")
+
+
+def test_prometheus_text():
+    metrics = Metrics()
+    metrics.observe("scan_dir", 0.002, "/media/a")
+    metrics.observe("scan_dir", 40)
+    metrics.count("episodes", 3)
+
+    lines = metrics.prometheus_text().splitlines()
+
+    assert "# TYPE jellyfin_media_renamer_stage_seconds histogram" in lines
+    assert (
+        'jellyfin_media_renamer_stage_seconds_bucket{stage="scan_dir",le="0.001"} 0'
+        in lines
+    )
+    assert (
+        'jellyfin_media_renamer_stage_seconds_bucket{stage="scan_dir",le="0.005"} 1'
+        in lines
+    )
+    assert (
+        'jellyfin_media_renamer_stage_seconds_bucket{stage="scan_dir",le="+Inf"} 2'
+        in lines
+    )
+    assert 'jellyfin_media_renamer_stage_seconds_count{stage="scan_dir"} 2' in lines
+    assert 'jellyfin_media_renamer_events_total{event="episodes"} 3' in lines
+
+
+def test_run_with_profile(tmp_path):
+    show = tmp_path / "Test.Show.2020"
+    (show / "S01").mkdir(parents=True)
+    (show / "S01" / "Test.Show.S01E01.mkv").touch()
+    (show / "S01" / "Test.Show.S01E02.mkv").touch()
+
+    run(
+        *parse_args(
+            [
+                "--yes",
+                f"--profile={tmp_path / 'profile.json'}",
+                f"--metrics-textfile={tmp_path / 'renamer.prom'}",
+                str(show),
+            ]
+        )
+    )
+
+    summary = json.loads((tmp_path / "profile.json").read_text())
+    assert summary["counters"]["episodes"] == 2
+    assert summary["counters"]["titles"] == 1
+    assert summary["stages"]["rename"]["count"] == 4
+    assert summary["stages"]["infer_input_type"]["slowest"][0]["subject"] == str(show)
+    assert {"infer_name_and_year", "infer_episode_info", "scan_dir"} <= set(
+        summary["stages"]
+    )
+
+    assert (
+        "jellyfin_media_renamer_stage_seconds_count"
+        in (tmp_path / "renamer.prom").read_text()
+    )
+    assert (tmp_path / "Test Show (2020)" / "Season 01").is_dir()
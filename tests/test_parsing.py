@@ -0,0 +1,231 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.corpus import generate_shows
+from jellyfin_media_renamer import parsing
+from jellyfin_media_renamer.parsing import (
+    PARSE_TIME_BUDGET,
+    EpisodeInfo,
+    ParseTimeout,
+    SeasonBoilerplate,
+    episode_patterns,
+    parse_episodes,
+    parse_name_and_year,
+    parse_names_and_years,
+    score_name_and_year,
+    season_boilerplate,
+    split_suffix,
+)
+
+
+@pytest.mark.parametrize(
+    ("filename", "expected"),
+    [
+        ("movie.mkv", ("movie", ".mkv")),
+        ("movie.en.srt", ("movie.en", ".srt")),
+        ("movie", ("movie", "")),
+        (".hidden", (".hidden", "")),
+        ("trailing.", ("trailing.", "")),
+    ],
+)
+def test_split_suffix(filename, expected):
+    assert split_suffix(filename) == expected
+
+
+def test_parse_names_and_years():
+    assert parse_names_and_years(
+        ["Nacho.Libre.2006.1080p.mkv", "Prince Of Persia ( 2010 ) [1080p].mp4"],
+        is_file=True,
+    ) == [
+        ("Nacho.Libre.2006.1080p", "Nacho Libre", 2006),
+        ("Prince Of Persia ( 2010 )", "Prince Of Persia", 2010),
+    ]
+
+
+def test_parse_episodes():
+    assert parse_episodes(
+        [
+            "Test Show S01E01 Pilot.mkv",
+            "Test Show S01E02-E03.mkv",
+            "Test Show Extras.mkv",
+        ],
+        "Test Show",
+        "Test Show",
+        None,
+        1,
+    ) == [
+        EpisodeInfo(numbers=[1], name="Pilot", parts=None),
+        EpisodeInfo(numbers=[2, 3], name=None, parts=None),
+        None,
+    ]
+
+
+def test_episode_patterns_are_compiled_once_per_season():
+    patterns = episode_patterns("Test Show", "Test Show", 1)
+
+    assert episode_patterns("Test Show", "Test Show", 1) is patterns
+    assert episode_patterns("Test Show", "Test Show", 2) is not patterns
+
+
+@pytest.mark.parametrize(
+    ("filename", "is_file", "expected"),
+    [
+        ("Harry Potter and the Chamber of Secrets (2002) [1080p]", False, 1.0),
+        ("Nacho.Libre.2006.1080p.mkv", True, 0.9),
+        ("[AC] Kamisama Kiss", False, 0.7),
+        ("[1080p]", False, 0.0),
+    ],
+)
+def test_score_name_and_year(filename, is_file, expected):
+    assert score_name_and_year(filename, is_file=is_file) == expected
+
+
+def test_episode_confidence_follows_matched_pattern():
+    sxxexx, bare = parse_episodes(
+        ["Test Show S01E01.mkv", "Test Show - 01.mkv"],
+        "Test Show",
+        "Test Show",
+        None,
+        1,
+    )
+
+    assert sxxexx.confidence > bare.confidence
+
+
+@pytest.mark.parametrize(
+    ("filename", "expected"),
+    [
+        ("www.UIndex.org    -    Nacho Libre 2006 1080p", ("Nacho Libre", 2006)),
+        ("WWW.TORRENTING.COM - Hot Rod 2007", ("Hot Rod", 2007)),
+        ("Amélie 2001 WEB DL DVDRip", ("Amélie", 2001)),
+    ],
+)
+def test_junk_is_stripped_regardless_of_case(filename, expected):
+    [(_, name, year)] = parse_names_and_years([filename], is_file=False)
+
+    assert (name, year) == expected
+
+
+@pytest.mark.parametrize(
+    ("filename", "expected"),
+    [
+        ("Test Show EPISODE 4.mkv", EpisodeInfo(numbers=[4], name=None, parts=None)),
+        (
+            "Test Show - 1X05 - Été.mkv",
+            EpisodeInfo(numbers=[5], name="Été", parts=None),
+        ),
+        (
+            "Test Show Ep07 (1080p WEB).mkv",
+            EpisodeInfo(numbers=[7], name=None, parts=None),
+        ),
+        # Everything from "(1080p" to the last ")" is junk
+        (
+            "Test Show - S01E01 - Title (1080p x265) (Group).mkv",
+            EpisodeInfo(numbers=[1], name="Title", parts=None),
+        ),
+    ],
+)
+def test_episode_patterns_match_regardless_of_case(filename, expected):
+    assert parse_episodes([filename], "Test Show", "Test Show", None, 1) == [expected]
+
+
+@pytest.mark.parametrize(
+    ("filenames", "expected"),
+    [
+        (["Show S01E01.mkv"], SeasonBoilerplate()),
+        (
+            ["Show.S01E01.Pilot.mkv", "Show.S01E02.Second.mkv"],
+            SeasonBoilerplate(prefix="Show.", has_show_name=True),
+        ),
+        (
+            [
+                "[SubsPlease] Show - 01 [1080p][ABCD].mkv",
+                "[SubsPlease] Show - 02 [1080p][ABCD].mkv",
+            ],
+            SeasonBoilerplate(
+                prefix="[SubsPlease] Show - ",
+                suffix="[1080p][ABCD].mkv",
+                has_show_name=True,
+            ),
+        ),
+        # Brackets are never split, and a shared last word isn't boilerplate
+        (
+            ["[A] Show - 01 Part One (720p).mkv", "[B] Show - 02 Day One (720p).mkv"],
+            SeasonBoilerplate(suffix="(720p).mkv"),
+        ),
+    ],
+)
+def test_season_boilerplate(filenames, expected):
+    assert season_boilerplate(filenames, "Show") == expected
+
+
+def test_parse_episodes_ignores_season_boilerplate():
+    assert parse_episodes(
+        [
+            "Night.Girl.S01E01.Dark.1080p.WEB-DL.x264-GalaxyTV.mkv",
+            "Night.Girl.S01E02.Dark.Wild.720p.WEB-DL.x264-RARBG.mkv",
+        ],
+        "Night.Girl.2019.1080p.WEB-DL.x264-GalaxyTV",
+        "Night Girl",
+        2019,
+        1,
+    ) == [
+        EpisodeInfo(numbers=[1], name="Dark", parts=None),
+        EpisodeInfo(numbers=[2], name="Dark.Wild", parts=None),
+    ]
+
+
+@pytest.mark.parametrize(
+    ("filename", "expected"),
+    [
+        ("Test Show S01E01E02E03.mkv", [1, 2, 3]),
+        ("Test Show E01-E02.mkv", [1, 2]),
+        ("Test Show xE1E05 .mkv", [1, 2, 3, 4, 5]),
+        ("Test Show E1234E05.mkv", [5]),
+        ("Test Show E01S01E02.mkv", [2]),
+    ],
+)
+def test_episode_chains(filename, expected):
+    assert parse_episodes([filename], "Test Show", "Test Show", None, 1)[0].numbers == (
+        expected
+    )
+
+
+def test_parse_time_budget(monkeypatch):
+    monkeypatch.setattr(parsing, "PARSE_TIME_BUDGET", -1)
+
+    with pytest.raises(ParseTimeout):
+        parse_name_and_year("Nacho.Libre.2006.1080p.mkv", is_file=True)
+
+    assert parse_episodes(
+        ["Test Show S01E01.mkv"], "Test Show", "Test Show", None, 1
+    ) == [None]
+
+
+def test_parse_time_budget_ignores_other_threads(monkeypatch):
+    # Time spent off the CPU, like waiting for the GIL while other threads parse, used to count
+    # against each name's budget. Sleeping partway through stands in for losing the GIL.
+    strip_tags = parsing.strip_tags
+
+    def descheduled(text: str) -> str:
+        time.sleep(PARSE_TIME_BUDGET)
+        return strip_tags(text)
+
+    monkeypatch.setattr(parsing, "strip_tags", descheduled)
+
+    shows = list(generate_shows(400, seed=3))
+    names = [
+        (show.folder_name, season, episode)
+        for show in shows
+        for season, episodes in show.seasons.items()
+        for episode in episodes
+    ][:48]
+
+    def parse(folder_name: str, season: int, episode: str) -> EpisodeInfo | None:
+        raw_name, name, year = parse_name_and_year(folder_name, is_file=False)
+        return parse_episodes([episode], raw_name, name, year, season)[0]
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        assert None not in pool.map(parse, *zip(*names))
@@ -0,0 +1,318 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from jellyfin_media_renamer import plan as plan_module
+from jellyfin_media_renamer.common import CommandError
+from jellyfin_media_renamer.events import EventStream, current_events
+from jellyfin_media_renamer.plan import (
+    Conflict,
+    DeleteOp,
+    DestinationIndex,
+    DeviceSlots,
+    MkdirOp,
+    Plan,
+    RenameOp,
+    _dependencies,
+    apply_op,
+    apply_plan,
+    run_ops,
+    validate_plan,
+)
+from jellyfin_media_renamer.shows import plan_show
+
+
+def _make_tree(root: Path, files: list[str]):
+    for file in files:
+        path = root / file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+
+def test_plan_show_does_not_touch_filesystem(tmp_path, list_tree):
+    show = tmp_path / "Test.Show.2020.1080p"
+    _make_tree(
+        show,
+        [
+            "S01/Test Show - S01E01.mkv",
+            "S01/Test Show - S01E02.mkv",
+            "S01/info.nfo",
+            "Season 2/Test Show - S02E01.mkv",
+        ],
+    )
+    before = list_tree(tmp_path)
+
+    plan = plan_show(show, "Test Show", "Test Show", 2020, "Test Show (2020)")
+
+    assert list_tree(tmp_path) == before
+
+    new_show = tmp_path / "Test Show (2020)"
+    assert plan.ops == (
+        RenameOp(show, new_show),
+        RenameOp(new_show / "S01", new_show / "Season 01"),
+        RenameOp(
+            new_show / "Season 01" / "Test Show - S01E01.mkv",
+            new_show / "Season 01" / "Test Show (2020) S01E01.mkv",
+        ),
+        RenameOp(
+            new_show / "Season 01" / "Test Show - S01E02.mkv",
+            new_show / "Season 01" / "Test Show (2020) S01E02.mkv",
+        ),
+        DeleteOp(new_show / "Season 01" / "info.nfo"),
+        RenameOp(new_show / "Season 2", new_show / "Season 02"),
+        RenameOp(
+            new_show / "Season 02" / "Test Show - S02E01.mkv",
+            new_show / "Season 02" / "Test Show (2020) S02E01.mkv",
+        ),
+    )
+
+    apply_plan(plan)
+
+    assert list_tree(tmp_path) == [
+        "Test Show (2020)/Season 01/Test Show (2020) S01E01.mkv",
+        "Test Show (2020)/Season 01/Test Show (2020) S01E02.mkv",
+        "Test Show (2020)/Season 02/Test Show (2020) S02E01.mkv",
+    ]
+
+
+def test_apply_plan_mkdir_and_rename(tmp_path, list_tree):
+    (tmp_path / "movie.mkv").touch()
+
+    apply_plan(
+        Plan(
+            (
+                MkdirOp(tmp_path / "Movie"),
+                RenameOp(tmp_path / "movie.mkv", tmp_path / "Movie" / "Movie.mkv"),
+            )
+        )
+    )
+
+    assert list_tree(tmp_path) == ["Movie/Movie.mkv"]
+
+
+def test_destination_index_finds_every_conflict(tmp_path, list_tree):
+    _make_tree(tmp_path, ["Show/a.mkv", "Show/b.mkv", "Show/c.mkv", "Show/E01.mkv"])
+    show = tmp_path / "Show (2020)"
+
+    a_to_e02 = RenameOp(show / "a.mkv", show / "E02.mkv")
+    b_to_e02 = RenameOp(show / "b.mkv", show / "E02.mkv")
+    c_to_e01 = RenameOp(show / "c.mkv", show / "E01.mkv")
+    plan = Plan((RenameOp(tmp_path / "Show", show), a_to_e02, b_to_e02, c_to_e01))
+
+    assert DestinationIndex().claim(plan) == [
+        Conflict(b_to_e02, a_to_e02),
+        # E01.mkv is still in the show folder under its old name
+        Conflict(c_to_e01),
+    ]
+
+    with pytest.raises(CommandError, match="Found 2 conflicting destinations"):
+        validate_plan(plan)
+
+    assert list_tree(tmp_path) == [
+        "Show/E01.mkv",
+        "Show/a.mkv",
+        "Show/b.mkv",
+        "Show/c.mkv",
+    ]
+
+
+def test_destination_index_allows_vacated_and_shared_destinations(tmp_path):
+    _make_tree(tmp_path, ["a.mkv", "b.mkv"])
+    index = DestinationIndex()
+
+    plan = Plan(
+        (
+            MkdirOp(tmp_path / "Show", exist_ok=True),
+            RenameOp(tmp_path / "a.mkv", tmp_path / "Show" / "a.mkv"),
+            RenameOp(tmp_path / "b.mkv", tmp_path / "a.mkv"),
+        )
+    )
+    assert index.claim(plan) == []
+
+    # Destinations claimed by an earlier plan in the run are taken, even before being applied
+    other = RenameOp(tmp_path / "c.mkv", tmp_path / "Show" / "a.mkv")
+    assert index.claim(Plan((MkdirOp(tmp_path / "Show", exist_ok=True), other))) == [
+        Conflict(other, plan.ops[1])
+    ]
+
+
+def test_dependencies_let_seasons_run_concurrently(tmp_path):
+    show = tmp_path / "Test.Show"
+    _make_tree(
+        show,
+        [
+            "S01/Test Show - S01E01.mkv",
+            "S01/Test Show - S01E02.mkv",
+            "S01/info.nfo",
+            "S02/Test Show - S02E01.mkv",
+        ],
+    )
+
+    plan = plan_show(show, "Test Show", "Test Show", None, "Test Show")
+    assert [str(op).split()[0] for op in plan.ops] == [
+        "rename",
+        "rename",
+        "rename",
+        "rename",
+        "delete",
+        "rename",
+        "rename",
+    ]
+
+    assert _dependencies(plan.ops) == [
+        set(),
+        {0},
+        # Episodes wait for their season folder, not for each other
+        {0, 1},
+        {0, 1},
+        # Purging waits for the season's renames
+        {0, 1, 2, 3},
+        # The next season only waits for the show folder
+        {0},
+        {0, 5},
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_apply_plan_concurrently(tmp_path, jobs, list_tree):
+    show = tmp_path / "Test.Show"
+    _make_tree(
+        show,
+        [
+            f"S{season:02d}/Test Show - S{season:02d}E{episode:02d}.mkv"
+            for season in range(1, 6)
+            for episode in range(1, 6)
+        ]
+        + ["S03/info.nfo"],
+    )
+
+    apply_plan(plan_show(show, "Test Show", "Test Show", None, "Test Show"), jobs=jobs)
+
+    assert list_tree(tmp_path) == [
+        f"Test Show/Season {season:02d}/Test Show S{season:02d}E{episode:02d}.mkv"
+        for season in range(1, 6)
+        for episode in range(1, 6)
+    ]
+
+
+def test_apply_plan_concurrently_reports_earliest_failure(tmp_path, list_tree):
+    _make_tree(tmp_path, ["S01/a.mkv", "S01/info.nfo", "S02/b.mkv", "S02/c.mkv"])
+
+    plan = Plan(
+        (
+            RenameOp(tmp_path / "S01", tmp_path / "Season 01"),
+            RenameOp(
+                tmp_path / "Season 01" / "missing.mkv",
+                tmp_path / "Season 01" / "E01.mkv",
+            ),
+            DeleteOp(tmp_path / "Season 01" / "info.nfo"),
+            RenameOp(tmp_path / "S02", tmp_path / "Season 02"),
+            RenameOp(
+                tmp_path / "Season 02" / "b.mkv", tmp_path / "Season 02" / "E01.mkv"
+            ),
+            RenameOp(
+                tmp_path / "Season 02" / "missing.mkv",
+                tmp_path / "Season 02" / "E02.mkv",
+            ),
+            RenameOp(
+                tmp_path / "Season 02" / "c.mkv", tmp_path / "Season 02" / "E03.mkv"
+            ),
+        )
+    )
+
+    with pytest.raises(FileNotFoundError, match="Season 01/missing.mkv"):
+        apply_plan(plan, jobs=4)
+
+    # Everything that didn't depend on a failed op was still applied, the purge was skipped
+    assert list_tree(tmp_path) == [
+        "Season 01/a.mkv",
+        "Season 01/info.nfo",
+        "Season 02/E01.mkv",
+        "Season 02/E03.mkv",
+    ]
+
+
+def test_run_ops_reports_ops_applied_after_a_failure(tmp_path):
+    _make_tree(tmp_path, ["y/a.mkv", "y/c.mkv"])
+    ops = [
+        RenameOp(tmp_path / "x" / "missing.mkv", tmp_path / "x" / "new.mkv"),
+        RenameOp(tmp_path / "x" / "new.mkv", tmp_path / "x" / "newer.mkv"),
+        RenameOp(tmp_path / "y" / "a.mkv", tmp_path / "y" / "b.mkv"),
+        RenameOp(tmp_path / "y" / "c.mkv", tmp_path / "y" / "d.mkv"),
+    ]
+
+    events: list[dict] = []
+    token = current_events.set(EventStream(events.append))
+    try:
+        with pytest.raises(FileNotFoundError):
+            run_ops(ops, lambda _, op: apply_op(op), jobs=4)
+    finally:
+        current_events.reset(token)
+
+    assert [(e["event"], e["src"]) for e in events] == [
+        ("rename", str(tmp_path / "y" / "a.mkv")),
+        ("rename", str(tmp_path / "y" / "c.mkv")),
+    ]
+
+
+def _record_runs(devices: dict[str, int]):
+    """Returns an apply function that takes a little while, and what it saw: the order ops
+    started in and the most ops running at once on each device"""
+
+    lock = threading.Lock()
+    started: list[str] = []
+    running: dict[int, int] = {}
+    peak: dict[int, int] = {}
+
+    def apply(_, op):
+        device = devices[op.src.parent.name]
+        with lock:
+            started.append(f"{op.src.parent.name}/{op.src.name}")
+            running[device] = running.get(device, 0) + 1
+            peak[device] = max(peak.get(device, 0), running[device])
+
+        time.sleep(0.01)
+
+        with lock:
+            running[device] -= 1
+
+    return apply, started, peak
+
+
+def test_run_ops_limits_each_device(tmp_path, monkeypatch):
+    devices = {"nas": 1, "ssd": 2}
+    monkeypatch.setattr(plan_module, "_device_slots", DeviceSlots(2))
+    monkeypatch.setattr(
+        plan_module, "_device", lambda path, _: devices[path.parent.name]
+    )
+
+    ops = [
+        RenameOp(tmp_path / folder / f"{i}.mkv", tmp_path / folder / f"{i}.new.mkv")
+        for i in range(6)
+        for folder in devices
+    ]
+    apply, _, peak = _record_runs(devices)
+
+    run_ops(ops, apply, jobs=8)
+
+    # Both devices were kept busy, neither beyond its limit
+    assert peak == {1: 2, 2: 2}
+
+
+def test_run_ops_orders_by_folder(tmp_path, monkeypatch):
+    devices = {"a": 1, "b": 1}
+    monkeypatch.setattr(plan_module, "_device_slots", DeviceSlots(1))
+    monkeypatch.setattr(plan_module, "_device", lambda path, _: 1)
+
+    ops = [
+        RenameOp(tmp_path / folder / f"{i}.mkv", tmp_path / folder / f"{i}.new.mkv")
+        for i in range(3)
+        for folder in devices
+    ]
+    apply, started, _ = _record_runs(devices)
+
+    run_ops(ops, apply, jobs=4)
+
+    assert started == ["a/0.mkv", "a/1.mkv", "a/2.mkv", "b/0.mkv", "b/1.mkv", "b/2.mkv"]
@@ -0,0 +1,115 @@
+import struct
+
+import pytest
+
+from jellyfin_media_renamer import fs
+from jellyfin_media_renamer import probe as probe_module
+from jellyfin_media_renamer.movies import plan_movie_inside_folder
+from jellyfin_media_renamer.plan import DeleteOp, RenameOp
+from jellyfin_media_renamer.probe import MediaInfo, probe
+
+
+def _ebml(element_id: int, data: bytes) -> bytes:
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + (1 << 56 | len(data)).to_bytes(8, "big") + data
+
+
+def _ebml_uint(element_id: int, value: int) -> bytes:
+    return _ebml(element_id, value.to_bytes(4, "big"))
+
+
+def make_mkv(duration: float, width: int, height: int) -> bytes:
+    info = _ebml(
+        0x1549A966,
+        _ebml_uint(0x2AD7B1, 1_000_000)
+        + _ebml(0x4489, struct.pack(">d", duration * 1000)),
+    )
+    audio = _ebml(0xAE, _ebml_uint(0x83, 2))
+    video = _ebml(
+        0xAE,
+        _ebml_uint(0x83, 1)
+        + _ebml(0xE0, _ebml_uint(0xB0, width) + _ebml_uint(0xBA, height)),
+    )
+    tracks = _ebml(0x1654AE6B, audio + video)
+    cluster = _ebml(0x1F43B675, b"\0" * 1024)
+
+    header = _ebml(0x1A45DFA3, _ebml(0x4282, b"matroska"))
+    # Segments are usually written with an unknown size
+    segment = bytes.fromhex("18538067") + b"\x01\xff\xff\xff\xff\xff\xff\xff"
+
+    return header + segment + info + tracks + cluster
+
+
+def _box(box_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I4s", len(data) + 8, box_type) + data
+
+
+def make_mp4(duration: float, width: int, height: int, *, mdat_size: int) -> bytes:
+    mvhd = _box(
+        b"mvhd", struct.pack(">4xIIII", 0, 0, 1000, int(duration * 1000)) + b"\0" * 80
+    )
+    tkhd = _box(
+        b"tkhd",
+        b"\0" * 76 + struct.pack(">II", width << 16, height << 16),
+    )
+    moov = _box(b"moov", mvhd + _box(b"trak", tkhd))
+
+    # Media data first, so the probe has to skip over it to find moov at the end
+    return _box(b"ftyp", b"isom") + _box(b"mdat", b"\0" * mdat_size) + moov
+
+
+def test_probe_mkv(tmp_path):
+    path = tmp_path / "movie.mkv"
+    path.write_bytes(make_mkv(5400.5, 1920, 1080))
+
+    assert probe(path) == MediaInfo(duration=5400.5, width=1920, height=1080)
+
+
+def test_probe_mp4_reads_only_headers(tmp_path, monkeypatch):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(make_mp4(120.0, 1280, 720, mdat_size=5_000_000))
+
+    reads = []
+    read = fs.MappedFile.read
+
+    def tracking_read(self, offset, length):
+        data = read(self, offset, length)
+        reads.append(len(data))
+        return data
+
+    monkeypatch.setattr(fs.MappedFile, "read", tracking_read)
+
+    assert probe(path) == MediaInfo(duration=120.0, width=1280, height=720)
+    assert sum(reads) < 2 * probe_module.HEAD_BYTES
+
+
+@pytest.mark.parametrize("content", [b"", b"not a video", b"\x1a\x45\xdf\xa3\x00"])
+def test_probe_unknown_or_broken(tmp_path, content):
+    path = tmp_path / "movie.avi"
+    path.write_bytes(content)
+
+    assert probe(path) is None
+
+
+def test_plan_movie_inside_folder_skips_samples(tmp_path):
+    folder = tmp_path / "Nacho.Libre.2006.1080p.WEB-DL"
+    folder.mkdir()
+    (folder / "nl-1080p.mkv").write_bytes(make_mkv(5500, 1920, 1080))
+    (folder / "nl-720p.mkv").write_bytes(make_mkv(5400, 1280, 720))
+    (folder / "Nacho.Libre.2006.1080p.WEB-DL-sample.mkv").write_bytes(
+        make_mkv(60, 1920, 1080)
+    )
+    (folder / "trailer.mp4").write_bytes(make_mp4(150, 1920, 1080, mdat_size=10))
+
+    plan = plan_movie_inside_folder(folder, "Nacho Libre", 2006, "Nacho Libre (2006)")
+
+    target = tmp_path / "Nacho Libre (2006)"
+    assert (
+        RenameOp(src=target / "nl-1080p.mkv", dst=target / "Nacho Libre (2006).mkv")
+        in plan.ops
+    )
+    # Another cut of about the same length is kept, the sample and trailer aren't
+    assert plan.deletes == (
+        DeleteOp(target / "Nacho.Libre.2006.1080p.WEB-DL-sample.mkv"),
+        DeleteOp(target / "trailer.mp4"),
+    )
@@ -0,0 +1,112 @@
+import io
+import json
+import logging
+import stat
+import threading
+
+import pytest
+
+from jellyfin_media_renamer.client import submit
+from jellyfin_media_renamer.common import CommandError
+from jellyfin_media_renamer.server import Server
+from jellyfin_media_renamer.titles import build_title_index
+
+
+@pytest.fixture
+def server(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+
+    server = Server(tmp_path / "jmr.sock")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_submit_without_server(tmp_path):
+    assert submit(tmp_path / "missing.sock", ["--yes", "x"]) is None
+
+
+def test_socket_is_private(server):
+    assert stat.S_IMODE(server.socket_path.stat().st_mode) == 0o600
+
+
+def test_second_server_is_refused(server):
+    with pytest.raises(CommandError):
+        Server(server.socket_path)
+
+
+def test_job_runs_relative_to_client_cwd(server, tmp_path, monkeypatch, capsys):
+    library = tmp_path / "library"
+    library.mkdir()
+    (library / "Nacho.Libre.2006.1080p.WEB-DL.mkv").touch()
+    monkeypatch.chdir(library)
+
+    assert (
+        submit(server.socket_path, ["--yes", "Nacho.Libre.2006.1080p.WEB-DL.mkv"]) == 0
+    )
+    assert (library / "Nacho Libre (2006)" / "Nacho Libre (2006).mkv").exists()
+
+    # The job's log output is streamed back to the client
+    assert "Processed 1 titles" in capsys.readouterr().err
+
+
+def test_prompts_are_forwarded_to_the_client(server, tmp_path, monkeypatch):
+    movie = tmp_path / "Nacho.Libre.2006.1080p.WEB-DL.mkv"
+    movie.touch()
+
+    answers = iter(["n", "Nacho Libre Remastered", "2007"])
+    monkeypatch.setattr("builtins.input", lambda _: next(answers))
+
+    assert submit(server.socket_path, [str(movie)]) == 0
+    assert (
+        tmp_path / "Nacho Libre Remastered (2007)" / "Nacho Libre Remastered (2007).mkv"
+    ).exists()
+
+
+def test_prompts_stay_off_stdout_with_json(server, tmp_path, monkeypatch, capsys):
+    movie = tmp_path / "Nacho.Libre.2006.1080p.WEB-DL.mkv"
+    movie.touch()
+
+    monkeypatch.setattr("sys.stdin", io.StringIO("y\n"))
+    monkeypatch.setattr("sys.stdin.isatty", lambda: True)
+
+    assert submit(server.socket_path, ["--json", str(movie)]) == 0
+
+    captured = capsys.readouterr()
+    assert [json.loads(line)["event"] for line in captured.out.splitlines()]
+    assert "Is this correct?" in captured.err
+
+
+def test_failing_job_reports_exit_code(server, tmp_path, capsys):
+    assert submit(server.socket_path, [str(tmp_path / "missing.mkv")]) == 1
+    assert "No file or folder found" in capsys.readouterr().err
+
+
+def test_title_index_is_only_used_by_the_job_that_asked_for_it(
+    server, tmp_path, monkeypatch
+):
+    tsv = tmp_path / "title.basics.tsv"
+    tsv.write_text(
+        "tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\n"
+        "tt0816692\tmovie\tInterstellar\tInterstellar\t0\t2014\n"
+    )
+    build_title_index(tsv, tmp_path / "titles.idx")
+
+    for name in ("first", "second"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "Interstelar.2014.1080p.mkv").touch()
+    monkeypatch.chdir(tmp_path)
+
+    argv = ["--yes", "--titles=titles.idx", "first/Interstelar.2014.1080p.mkv"]
+    assert submit(server.socket_path, argv) == 0
+    assert (
+        submit(server.socket_path, ["--yes", "second/Interstelar.2014.1080p.mkv"]) == 0
+    )
+
+    assert (tmp_path / "first" / "Interstellar (2014)").is_dir()
+    assert (tmp_path / "second" / "Interstelar (2014)").is_dir()
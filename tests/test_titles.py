@@ -0,0 +1,125 @@
+import gzip
+from pathlib import Path
+
+import pytest
+
+from jellyfin_media_renamer.common import InputType, infer_name_and_year
+from jellyfin_media_renamer.titles import (
+    Title,
+    TitleIndex,
+    build_title_index,
+    current_title_index,
+    normalize_title,
+)
+
+BASICS = [
+    ("tt0816692", "movie", "Interstellar", "Interstellar", "0", "2014"),
+    ("tt1160419", "movie", "Dune", "Dune: Part One", "0", "2021"),
+    ("tt0087182", "movie", "Dune", "Dune", "0", "1984"),
+    ("tt0142032", "tvMiniSeries", "Dune", "Dune", "0", "2000"),
+    (
+        "tt0211915",
+        "movie",
+        "Amélie",
+        "Le fabuleux destin d'Amélie Poulain",
+        "0",
+        "2001",
+    ),
+    ("tt0076759", "movie", "Star Wars: A New Hope", "Star Wars", "0", "1977"),
+    ("tt0903747", "tvSeries", "Breaking Bad", "Breaking Bad", "0", "2008"),
+    ("tt0000001", "short", "Carmencita", "Carmencita", "0", "1894"),
+    ("tt0000002", "movie", "Unknown Year", "Unknown Year", "0", "\\N"),
+]
+
+
+@pytest.fixture
+def index(tmp_path) -> TitleIndex:
+    tsv = tmp_path / "title.basics.tsv.gz"
+    with gzip.open(tsv, "wt", encoding="utf-8") as f:
+        f.write(
+            "tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\t"
+            "endYear\truntimeMinutes\tgenres\n"
+        )
+        for row in BASICS:
+            f.write("\t".join([*row, "\\N", "120", "Drama"]) + "\n")
+
+    assert build_title_index(tsv, tmp_path / "titles.idx") == 11
+
+    index = TitleIndex(tmp_path / "titles.idx")
+    yield index
+    index.close()
+
+
+@pytest.mark.parametrize(
+    ("title", "expected"),
+    [
+        ("Star Wars: A New Hope", "star wars a new hope"),
+        ("Amélie", "amelie"),
+        ("Law & Order", "law and order"),
+        ("Ocean's.Eleven", "oceans eleven"),
+    ],
+)
+def test_normalize_title(title, expected):
+    assert normalize_title(title) == expected
+
+
+@pytest.mark.parametrize(
+    ("name", "year", "is_show", "expected"),
+    [
+        ("interstellar", 2014, None, ("Interstellar", 2014)),
+        # Release years differ between countries
+        ("Interstellar", 2015, None, ("Interstellar", 2014)),
+        ("Interstellar", None, None, ("Interstellar", 2014)),
+        ("Interstelar", 2014, None, ("Interstellar", 2014)),
+        ("Interstelar", None, None, None),
+        ("Amelie", 2001, None, ("Amélie", 2001)),
+        ("Le Fabuleux Destin d'Amelie Poulain", None, None, ("Amélie", 2001)),
+        ("Star Wars", 1977, None, ("Star Wars - A New Hope", 1977)),
+        ("Dune", 2021, None, ("Dune", 2021)),
+        ("Dune Part One", None, None, ("Dune", 2021)),
+        ("Dune", None, None, None),
+        ("Dune", 2000, None, ("Dune", 2000)),
+        ("Dune", 2000, False, None),
+        ("Dune", 2001, True, ("Dune", 2000)),
+        ("Dune", 2021, True, None),
+        ("Carmencita", 1894, None, None),
+        ("Unknown Year", None, None, ("Unknown Year", None)),
+        ("Nonexistent Movie", 2020, None, None),
+        ("...", None, None, None),
+    ],
+)
+def test_title_index_match(index, name, year, is_show, expected):
+    title = index.match(name, year, is_show=is_show)
+    assert (title and (title.name, title.year)) == expected
+
+
+def test_title_index_rejects_other_files(tmp_path):
+    (tmp_path / "titles.idx").write_bytes(b"not an index at all")
+
+    with pytest.raises(ValueError, match="Not a title index"):
+        TitleIndex(tmp_path / "titles.idx")
+
+
+def test_infer_name_and_year_uses_title_index(index):
+    token = current_title_index.set(index)
+    try:
+        assert infer_name_and_year(Path("Interstelar.2014.1080p.BluRay"))[1:] == (
+            "Interstellar",
+            2014,
+        )
+        # A movie is never corrected to a show, nor a show to a movie
+        assert infer_name_and_year(
+            Path("Breakin.Bad.2008.1080p"), InputType.FOLDER_WITH_MOVIE
+        )[1:] == ("Breakin Bad", 2008)
+        assert infer_name_and_year(
+            Path("Breakin.Bad.2008.1080p"), InputType.FOLDER_WITH_SHOW_SEASONS
+        )[1:] == ("Breaking Bad", 2008)
+        assert infer_name_and_year(
+            Path("Interstelar.2014.1080p"), InputType.FOLDER_WITH_SHOW_SEASONS
+        )[1:] == ("Interstelar", 2014)
+    finally:
+        current_title_index.reset(token)
+
+    assert index.match("Breaking Bad", None) == Title(
+        title="Breaking Bad", year=2008, is_show=True
+    )
@@ -0,0 +1,41 @@
+import time
+
+from jellyfin_media_renamer.batch import ProcessOptions
+from jellyfin_media_renamer.watch import Watcher
+
+
+def _poll_until(watcher: Watcher, condition, timeout: float = 5.0) -> list:
+    processed = []
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        processed.extend(watcher.poll(0.05))
+    return processed
+
+
+def test_watcher_processes_new_entries_once_settled(tmp_path):
+    watcher = Watcher(
+        [tmp_path], options=ProcessOptions(interactive=False), settle_seconds=0.2
+    )
+
+    try:
+        release = tmp_path / "Nacho.Libre.2006.1080p.WEB-DL"
+        release.mkdir()
+        (release / "Nacho.Libre.2006.1080p.WEB-DL.mkv.part").touch()
+
+        # Still downloading, so it must not be touched
+        assert _poll_until(watcher, lambda: False, timeout=0.5) == []
+
+        (release / "Nacho.Libre.2006.1080p.WEB-DL.mkv.part").rename(
+            release / "Nacho.Libre.2006.1080p.WEB-DL.mkv"
+        )
+
+        processed = _poll_until(
+            watcher, lambda: (tmp_path / "Nacho Libre (2006)").exists()
+        )
+        assert processed == [release]
+        assert (tmp_path / "Nacho Libre (2006)" / "Nacho Libre (2006).mkv").exists()
+
+        # The renamed folder is ours, so it must not be picked up again
+        assert _poll_until(watcher, lambda: False, timeout=0.5) == []
+    finally:
+        watcher.close()